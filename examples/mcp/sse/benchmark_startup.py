@@ -0,0 +1,181 @@
+"""
+excel_mcp stdio 启动耗时基准。
+
+对比两种启动方式，从拉起进程开始计时：
+    cold   : python excel_mcp.py --transport stdio（每次冷启动解释器并导入依赖）
+    attach : python excel_mcp_attach.py（接入预先启动的 --transport prefork 预热进程）
+
+每轮记录 initialize 响应耗时，以及第一次工具调用（read_sheet_data 读取临时 CSV，触发 pandas 导入）完成的耗时。
+另外在新的解释器中单独导入对应脚本的模块，记录 import 本身的耗时（不含解释器启动），
+用于区分启动耗时中有多少来自模块顶层的导入。
+
+用法:
+    python benchmark_startup.py --runs 10
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import Any, Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVER_SCRIPT = os.path.join(HERE, "excel_mcp.py")
+ATTACH_SCRIPT = os.path.join(HERE, "excel_mcp_attach.py")
+
+
+def send(process: subprocess.Popen, message: Dict[str, Any]) -> None:
+    process.stdin.write((json.dumps(message) + "\n").encode())
+    process.stdin.flush()
+
+
+def receive(process: subprocess.Popen, request_id: int) -> Dict[str, Any]:
+    """读取 stdout 直到拿到指定 id 的 JSON-RPC 响应（跳过服务端发来的通知）。"""
+    while True:
+        line = process.stdout.readline()
+        if not line:
+            raise RuntimeError("服务进程在响应前退出")
+        message = json.loads(line)
+        if message.get("id") == request_id:
+            return message
+
+
+def measure(command: List[str], env: Dict[str, str], csv_path: str) -> Dict[str, float]:
+    """拉起一次 stdio 服务，返回 initialize 与首次工具调用完成时相对启动时刻的秒数。"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env
+    )
+    try:
+        send(
+            process,
+            {
+                "jsonrpc": "2.0",
+                "id": 1,
+                "method": "initialize",
+                "params": {
+                    "protocolVersion": "2025-03-26",
+                    "capabilities": {},
+                    "clientInfo": {"name": "benchmark_startup", "version": "1.0"},
+                },
+            },
+        )
+        receive(process, 1)
+        initialized = time.perf_counter()
+        send(process, {"jsonrpc": "2.0", "method": "notifications/initialized"})
+        send(
+            process,
+            {
+                "jsonrpc": "2.0",
+                "id": 2,
+                "method": "tools/call",
+                "params": {"name": "read_sheet_data", "arguments": {"file_path": csv_path}},
+            },
+        )
+        response = receive(process, 2)
+        first_call = time.perf_counter()
+        if "error" in response or response["result"].get("isError"):
+            raise RuntimeError(f"工具调用失败: {response}")
+    finally:
+        process.stdin.close()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return {"initialize": initialized - started, "first_call": first_call - started}
+
+
+def measure_import(script: str, env: Dict[str, str]) -> float:
+    """在新的解释器中导入 script 对应的模块，返回 import 语句本身耗费的秒数。"""
+    module = os.path.splitext(os.path.basename(script))[0]
+    code = (
+        "import sys, time\n"
+        f"sys.path.insert(0, {os.path.dirname(script)!r})\n"
+        "started = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - started)\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], env=env, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    ).stdout
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def start_prefork_server(socket_path: str, env: Dict[str, str]) -> subprocess.Popen:
+    """启动预热进程，等到 socket 可以连接后返回。"""
+    process = subprocess.Popen(
+        [sys.executable, SERVER_SCRIPT, "--transport", "prefork", "--socket", socket_path],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=env,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("预热进程启动失败")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(socket_path)
+                return process
+            except OSError:
+                time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("等待预热进程超时")
+
+
+def summarize(mode: str, samples: List[Dict[str, float]]) -> None:
+    for key in ("import", "initialize", "first_call"):
+        values = [sample[key] * 1000 for sample in samples]
+        print(
+            f"{mode:<7} {key:<11} min {min(values):8.1f} ms  "
+            f"median {statistics.median(values):8.1f} ms  max {max(values):8.1f} ms"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="excel_mcp stdio 启动耗时基准")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modes", nargs="+", default=["cold", "attach"], choices=["cold", "attach"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, "bench.csv")
+        with open(csv_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["id", "name", "value"])
+            writer.writerows([i, f"row{i}", i * 1.5] for i in range(1000))
+
+        # 旁路文件写到临时目录，基准结束后随之清理
+        env = {**os.environ, "EXCEL_MCP_SIDECAR_DIR": os.path.join(workdir, "sidecar")}
+        for mode in args.modes:
+            if mode == "cold":
+                command = [sys.executable, SERVER_SCRIPT, "--transport", "stdio"]
+                samples = [
+                    {"import": measure_import(SERVER_SCRIPT, env), **measure(command, env, csv_path)}
+                    for _ in range(args.runs)
+                ]
+            else:
+                socket_path = os.path.join(workdir, "prefork.sock")
+                attach_env = {**env, "EXCEL_MCP_PREFORK_SOCKET": socket_path}
+                server = start_prefork_server(socket_path, attach_env)
+                try:
+                    command = [sys.executable, ATTACH_SCRIPT]
+                    samples = [
+                        {"import": measure_import(ATTACH_SCRIPT, attach_env), **measure(command, attach_env, csv_path)}
+                        for _ in range(args.runs)
+                    ]
+                finally:
+                    server.terminate()
+                    server.wait(timeout=10)
+            summarize(mode, samples)
+
+
+if __name__ == "__main__":
+    main()
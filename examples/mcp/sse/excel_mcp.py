@@ -1,53 +1,3745 @@
+from __future__ import annotations
+
+import os
 import re
-import numpy as np
-import pandas as pd
+import sys
+import ast
+import io
+import csv
+import json
+import mmap
+import time
+import uuid
+import base64
+import bisect
+import shutil
+import signal
+import socket
+import asyncio
+import argparse
+import hashlib
+import tempfile
+import operator
+import inspect
+import weakref
+import functools
+import contextlib
+import contextvars
+import itertools
+import zipfile
+import threading
+import traceback
+import subprocess
+import multiprocessing
+import importlib
+import importlib.util
+import xml.etree.ElementTree as ET
 from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from fastmcp import FastMCP
-from typing import Union, List, Any, Dict, Optional
+from fastmcp.server.middleware import Middleware
+import pydantic_core
+from typing import Union, List, Any, Dict, Optional, Tuple, Callable
+
+
+class LazyModule:
+    """
+    延迟导入的模块占位：首次访问属性时才真正导入，并把模块级同名变量替换为真实模块。
+
+    numpy/pandas/openpyxl 等依赖的导入耗时远超 MCP initialize 本身，延迟到第一次工具调用时再导入，
+    客户端（如每次构建团队都通过 stdio 拉起本服务的 McpWorkbench）可以更快完成握手。
+    """
+
+    def __init__(self, module_name: str, alias: str):
+        self._module_name = module_name
+        self._alias = alias
+
+    def __getattr__(self, name: str) -> Any:
+        module = importlib.import_module(self._module_name)
+        globals()[self._alias] = module
+        return getattr(module, name)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._module_name!r}>"
+
+
+np = LazyModule("numpy", "np")
+pd = LazyModule("pandas", "pd")
+duckdb = LazyModule("duckdb", "duckdb")
+openpyxl = LazyModule("openpyxl", "openpyxl")
+
+# pyarrow 为可选依赖，缺失时不生成列式旁路文件，CSV 分块读取回退到 pandas；只检查是否安装，不在启动时导入
+if importlib.util.find_spec("pyarrow") is not None:
+    pa = LazyModule("pyarrow", "pa")
+    pa_csv = LazyModule("pyarrow.csv", "pa_csv")
+    pq = LazyModule("pyarrow.parquet", "pq")
+else:
+    pa = None
+    pa_csv = None
+    pq = None
+
+
+def preload_heavy_modules() -> None:
+    """立即导入所有延迟导入的依赖（预热模式在 fork 出会话进程前调用，会话进程无需再导入）。"""
+    for name, value in list(globals().items()):
+        if isinstance(value, LazyModule):
+            getattr(value, "__name__")
+
+
+def serialize_tool_result(data: Any) -> str:
+    """把工具返回值转换为 JSON 文本（与 FastMCP 默认的序列化方式一致），顺便把编码后的字节数记到当前工具调用上。"""
+    payload = pydantic_core.to_json(data, fallback=str)
+    metrics = _call_metrics.get()
+    if metrics is not None:
+        metrics.response_bytes += len(payload)
+    return payload.decode()
+
+
+# Initialize FastMCP
+mcp = FastMCP("excel-operate-mcp", tool_serializer=serialize_tool_result)
+
+# Supported file formats
+SUPPORTED_FORMATS = [".csv", ".xlsx", ".xls"]
+
+# 已解析 DataFrame 缓存的容量上限（字节），可通过环境变量覆盖
+DATAFRAME_CACHE_MAX_BYTES = int(os.getenv("EXCEL_MCP_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# 列式（Parquet）旁路文件：默认写在源文件同级的 .excel_mcp_cache 目录，可指定统一目录或关闭
+SIDECAR_ENABLED = os.getenv("EXCEL_MCP_SIDECAR", "1") != "0"
+SIDECAR_DIR = os.getenv("EXCEL_MCP_SIDECAR_DIR", "")
+SIDECAR_METADATA_KEY = b"excel_mcp"
+
+# 分页：默认页大小、服务端结果集的存活时间（秒）与数量上限
+DEFAULT_PAGE_SIZE = int(os.getenv("EXCEL_MCP_PAGE_SIZE", "500"))
+RESULT_SET_TTL_SECONDS = float(os.getenv("EXCEL_MCP_RESULT_TTL", "300"))
+RESULT_SET_MAX_ENTRIES = int(os.getenv("EXCEL_MCP_RESULT_MAX_ENTRIES", "32"))
+
+# 并发：同时执行的工具调用上限，以及解析/序列化进程池大小（0 表示不使用进程池）
+MAX_CONCURRENCY = int(os.getenv("EXCEL_MCP_MAX_CONCURRENCY", "8"))
+PROCESS_WORKERS = int(os.getenv("EXCEL_MCP_PROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# 合并：输入文件总大小超过该阈值（字节）时自动改用 DuckDB 外存执行；流式写出时每块的行数
+OUT_OF_CORE_THRESHOLD_BYTES = int(os.getenv("EXCEL_MCP_OUT_OF_CORE_BYTES", str(1024 * 1024 * 1024)))
+STREAM_CHUNK_ROWS = int(os.getenv("EXCEL_MCP_STREAM_CHUNK_ROWS", "100000"))
+
+# 超过该大小（字节）且未在内存缓存中的 CSV，筛选/计数/Top-N/按条件删除改为分块处理；pyarrow 每块读取的字节数
+CHUNKED_CSV_THRESHOLD_BYTES = int(os.getenv("EXCEL_MCP_CHUNKED_CSV_BYTES", str(256 * 1024 * 1024)))
+CSV_BLOCK_BYTES = int(os.getenv("EXCEL_MCP_CSV_BLOCK_BYTES", str(16 * 1024 * 1024)))
+
+# 字典编码：行数不少于 CATEGORY_MIN_ROWS 的表中，不同取值数不超过 min(行数 × CATEGORY_MAX_UNIQUE_RATIO,
+# CATEGORY_MAX_CATEGORIES) 的文本列加载后转为 category；默认上限 32767 使编码不超过 int16。比例或上限设为 0 关闭
+CATEGORY_MAX_UNIQUE_RATIO = float(os.getenv("EXCEL_MCP_CATEGORY_MAX_RATIO", "0.1"))
+CATEGORY_MAX_CATEGORIES = int(os.getenv("EXCEL_MCP_CATEGORY_MAX_CATEGORIES", "32767"))
+CATEGORY_MIN_ROWS = int(os.getenv("EXCEL_MCP_CATEGORY_MIN_ROWS", "1000"))
+
+# 操作日志：修改文件前记录操作与快照，支持 undo_last_operation；每个文件最多保留的可撤销步数
+JOURNAL_ENABLED = os.getenv("EXCEL_MCP_JOURNAL", "1") != "0"
+JOURNAL_MAX_DEPTH = int(os.getenv("EXCEL_MCP_JOURNAL_DEPTH", "20"))
+
+
+def get_excel_path(filename: str) -> Path:
+    """
+    获取 Excel 或 CSV 文件的绝对路径。
+
+    Args:
+        filename (str): 文件的绝对路径。
+
+    Returns:
+        Path: 文件的绝对路径 Path 对象。
+
+    Raises:
+        ValueError: 当文件名为空、不是字符串或不是绝对路径时抛出。
+    """
+    if not filename or not isinstance(filename, str):
+        raise ValueError("文件名不能为空且必须为字符串")
+
+    # 移除不可见控制字符（如 \t \n \r），以及前后空白字符
+    cleaned_filename = re.sub(r"[\x00-\x1F]+", "", filename).strip()
+
+    # 使用 Path 处理路径，跨平台兼容
+    file_path = Path(cleaned_filename)
+
+    # 验证是否为绝对路径
+    if not file_path.is_absolute():
+        raise ValueError(f"期望绝对路径，但收到相对路径: {filename}")
+
+    return file_path
+
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+_thread_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="excel-mcp")
+_tool_slots = asyncio.Semaphore(MAX_CONCURRENCY)
+_file_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+_executor_stats = {"waiting": 0, "running": 0, "completed": 0, "max_waiting": 0, "cpu_tasks": 0}
+
+
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    """按需创建解析/序列化用的进程池；EXCEL_MCP_PROCESS_WORKERS=0 时返回 None（在线程内直接执行）。"""
+    global _process_pool
+    if PROCESS_WORKERS <= 0:
+        return None
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn 在 Windows/macOS/Linux 上行为一致，也避免在多线程进程中 fork
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+
+def run_cpu_bound(fn, *args: Any) -> Any:
+    """
+    在进程池中执行 CPU 密集的解析/序列化函数，并阻塞等待结果。
+
+    只应在工具的工作线程中调用，不会阻塞事件循环；fn 及其参数必须可被 pickle。
+    """
+    pool = get_process_pool()
+    if pool is None:
+        return fn(*args)
+    with _process_pool_lock:
+        _executor_stats["cpu_tasks"] += 1
+    return pool.submit(fn, *args).result()
+
+
+def run_cpu_bound_many(fn, arg_list: List[Tuple[Any, ...]]) -> List[Any]:
+    """run_cpu_bound 的批量版本：把多组参数同时提交到进程池并行执行，按提交顺序返回结果。"""
+    pool = get_process_pool()
+    if pool is None or len(arg_list) <= 1:
+        return [fn(*args) for args in arg_list]
+    with _process_pool_lock:
+        _executor_stats["cpu_tasks"] += len(arg_list)
+    futures = [pool.submit(fn, *args) for args in arg_list]
+    return [future.result() for future in futures]
+
+
+def offload_to_executor(lock_arg: Optional[str] = None):
+    """
+    把同步的工具实现包装为异步 MCP 工具，在线程池中执行，事件循环不再被解析和写入阻塞。
+
+    Args:
+        lock_arg (Optional[str]): 写操作的目标路径参数名。同一文件的写操作串行执行，不同文件之间互不影响。
+    """
+
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            call = functools.partial(fn, *args, **kwargs)
+            queued_at = time.perf_counter()
+            if lock_arg is None:
+                return await _run_in_slot(call, queued_at)
+            lock = _get_file_lock(signature.bind_partial(*args, **kwargs).arguments.get(lock_arg))
+            if lock is None:
+                return await _run_in_slot(call, queued_at)
+            # 先排队拿文件锁再占用并发名额，等待同一文件的写操作不会占满全部名额
+            async with lock:
+                return await _run_in_slot(call, queued_at)
+
+        return wrapper
+
+    return decorator
+
+
+async def _run_in_slot(call: functools.partial, queued_at: float) -> Any:
+    """在并发名额内把调用交给线程池执行，并记录排队深度；从 queued_at 到工作线程开始执行的时间记为排队耗时。"""
+
+    def run_call() -> Any:
+        record_queue_wait(queued_at)
+        return call()
+
+    _executor_stats["waiting"] += 1
+    _executor_stats["max_waiting"] = max(_executor_stats["max_waiting"], _executor_stats["waiting"])
+    try:
+        await _tool_slots.acquire()
+    finally:
+        _executor_stats["waiting"] -= 1
+
+    _executor_stats["running"] += 1
+    try:
+        # 复制当前上下文，工作线程中的耗时统计记到本次调用上
+        result = await asyncio.get_running_loop().run_in_executor(
+            _thread_pool, contextvars.copy_context().run, run_call
+        )
+        metrics = _call_metrics.get()
+        if metrics is not None:
+            metrics.returned_at = time.perf_counter()
+            metrics.error = isinstance(result, dict) and result.get("status") == "error"
+        return result
+    finally:
+        _executor_stats["running"] -= 1
+        _executor_stats["completed"] += 1
+        _tool_slots.release()
+
+
+def _get_file_lock(file_path: Any) -> Optional[asyncio.Lock]:
+    """返回某个文件的写锁；路径不合法时返回 None，由工具自身返回错误信息。"""
+    try:
+        lock_key = str(get_excel_path(file_path).resolve())
+    except (ValueError, TypeError):
+        return None
+    lock = _file_locks.get(lock_key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _file_locks[lock_key] = lock
+    return lock
+
+
+# 工具指标直方图的桶上界：耗时（秒）、响应字节数、扫描行数
+METRICS_DURATION_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+METRICS_BYTES_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+METRICS_ROWS_BUCKETS = [0, 10, 100, 1000, 10000, 100000, 1000000, 10000000]
+METRICS_FORMATS = ["json", "prometheus"]
+
+
+class CallMetrics:
+    """单次工具调用的分项计数，由 ToolMetricsMiddleware 创建并通过上下文变量传给加载/编码函数。"""
+
+    __slots__ = (
+        "queue_wait",
+        "parse",
+        "serialize",
+        "rows_scanned",
+        "cache_hits",
+        "cache_misses",
+        "response_bytes",
+        "returned_at",
+        "error",
+    )
+
+    def __init__(self):
+        self.queue_wait = 0.0
+        self.parse = 0.0
+        self.serialize = 0.0
+        self.rows_scanned = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.response_bytes = 0
+        self.returned_at = 0.0
+        self.error = False
+
+
+_call_metrics: "contextvars.ContextVar[Optional[CallMetrics]]" = contextvars.ContextVar(
+    "excel_mcp_call_metrics", default=None
+)
+
+
+def record_queue_wait(queued_at: float) -> None:
+    """把自 queued_at 起等待文件锁、并发名额和线程池的时间记到当前工具调用上（在工作线程开始执行时调用）。"""
+    metrics = _call_metrics.get()
+    if metrics is not None:
+        metrics.queue_wait += time.perf_counter() - queued_at
+
+
+def record_parse(started: float, rows: int = 0, cache_hit: Optional[bool] = None) -> None:
+    """把自 started 起的读取/解析耗时、读入的行数和缓存命中情况记到当前工具调用上（不在工具调用中时忽略）。"""
+    metrics = _call_metrics.get()
+    if metrics is None:
+        return
+    metrics.parse += time.perf_counter() - started
+    metrics.rows_scanned += rows
+    if cache_hit is True:
+        metrics.cache_hits += 1
+    elif cache_hit is False:
+        metrics.cache_misses += 1
+
+
+def record_serialize(started: float) -> None:
+    """把自 started 起的结果编码耗时记到当前工具调用上。"""
+    metrics = _call_metrics.get()
+    if metrics is not None:
+        metrics.serialize += time.perf_counter() - started
+
+
+class Histogram:
+    """固定桶边界的直方图：counts[i] 为落在 (bounds[i-1], bounds[i]] 内的次数，最后一个桶为 +Inf。"""
+
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"count": self.count, "sum": self.sum, "max": self.max, "counts": list(self.counts)}
+
+
+def get_histogram_quantile(snapshot: Dict[str, Any], bounds: List[float], q: float) -> float:
+    """按桶估计分位数：返回累计次数首次达到 q 的桶上界（落在 +Inf 桶时返回最大观测值）。"""
+    target = q * snapshot["count"]
+    cumulative = 0
+    for position, count in enumerate(snapshot["counts"]):
+        cumulative += count
+        if cumulative >= target and count:
+            return min(bounds[position], snapshot["max"]) if position < len(bounds) else snapshot["max"]
+    return 0.0
+
+
+class ToolMetrics:
+    """
+    按工具名累计的调用指标：次数、错误数、缓存命中/未命中数，以及耗时（总计/排队/解析/计算/序列化）、
+    响应字节数和扫描行数的直方图。
+
+    只在事件循环线程中由中间件写入、由指标工具读取，因此不需要加锁。
+    """
+
+    PHASES = ("total", "queue_wait", "parse", "compute", "serialize")
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._tools: Dict[str, Dict[str, Any]] = {}
+
+    def _get_tool(self, name: str) -> Dict[str, Any]:
+        tool = self._tools.get(name)
+        if tool is None:
+            tool = self._tools[name] = {
+                "calls": 0,
+                "errors": 0,
+                "cache_hits": 0,
+                "cache_misses": 0,
+                "duration_seconds": {phase: Histogram(METRICS_DURATION_BUCKETS) for phase in self.PHASES},
+                "response_bytes": Histogram(METRICS_BYTES_BUCKETS),
+                "rows_scanned": Histogram(METRICS_ROWS_BUCKETS),
+            }
+        return tool
+
+    def record(self, name: str, total: float, metrics: CallMetrics) -> None:
+        tool = self._get_tool(name)
+        tool["calls"] += 1
+        tool["errors"] += metrics.error
+        tool["cache_hits"] += metrics.cache_hits
+        tool["cache_misses"] += metrics.cache_misses
+        durations = tool["duration_seconds"]
+        durations["total"].observe(total)
+        durations["queue_wait"].observe(metrics.queue_wait)
+        durations["parse"].observe(metrics.parse)
+        durations["serialize"].observe(metrics.serialize)
+        durations["compute"].observe(max(total - metrics.queue_wait - metrics.parse - metrics.serialize, 0.0))
+        tool["response_bytes"].observe(metrics.response_bytes)
+        tool["rows_scanned"].observe(metrics.rows_scanned)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """导出可合并的指标快照（直方图只含各桶计数，桶边界见 bucket_bounds）。"""
+        tools = {}
+        for name, tool in sorted(self._tools.items()):
+            tools[name] = {
+                "calls": tool["calls"],
+                "errors": tool["errors"],
+                "cache_hits": tool["cache_hits"],
+                "cache_misses": tool["cache_misses"],
+                "duration_seconds": {phase: hist.snapshot() for phase, hist in tool["duration_seconds"].items()},
+                "response_bytes": tool["response_bytes"].snapshot(),
+                "rows_scanned": tool["rows_scanned"].snapshot(),
+            }
+        return {"uptime_seconds": round(time.time() - self.started_at, 3), "tools": tools}
+
+
+_tool_metrics = ToolMetrics()
+
+
+class ToolMetricsMiddleware(Middleware):
+    """
+    为每次工具调用计时。排队、解析、编码耗时由 record_queue_wait / record_parse / record_serialize 在调用过程中累计，
+    响应大小由 serialize_tool_result 在生成 JSON 文本时记录。
+    """
+
+    async def on_call_tool(self, context, call_next):
+        metrics = CallMetrics()
+        token = _call_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            return await call_next(context)
+        except Exception:
+            metrics.error = True
+            raise
+        finally:
+            finished = time.perf_counter()
+            if metrics.returned_at:
+                # 工具返回之后的时间为 FastMCP 把结果转换为 JSON 文本的耗时
+                metrics.serialize += finished - metrics.returned_at
+            _call_metrics.reset(token)
+            _tool_metrics.record(context.message.name, finished - started, metrics)
+
+
+mcp.add_middleware(ToolMetricsMiddleware())
+
+
+def merge_metrics_snapshots(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """合并多个进程的指标快照（分片模式下汇总各 worker），计数与直方图逐项相加。"""
+    tools: Dict[str, Dict[str, Any]] = {}
+    for snapshot in snapshots:
+        for name, tool in snapshot["tools"].items():
+            merged = tools.get(name)
+            if merged is None:
+                tools[name] = json.loads(json.dumps(tool))
+                continue
+            for field in ("calls", "errors", "cache_hits", "cache_misses"):
+                merged[field] += tool[field]
+            pairs = [
+                (merged["duration_seconds"][phase], tool["duration_seconds"][phase]) for phase in ToolMetrics.PHASES
+            ]
+            pairs += [
+                (merged["response_bytes"], tool["response_bytes"]),
+                (merged["rows_scanned"], tool["rows_scanned"]),
+            ]
+            for target, source in pairs:
+                target["count"] += source["count"]
+                target["sum"] += source["sum"]
+                target["max"] = max(target["max"], source["max"])
+                target["counts"] = [a + b for a, b in zip(target["counts"], source["counts"])]
+    uptime = max((snapshot["uptime_seconds"] for snapshot in snapshots), default=0.0)
+    return {"uptime_seconds": uptime, "tools": dict(sorted(tools.items()))}
+
+
+def summarize_metrics_snapshot(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    """把直方图快照整理为便于阅读的均值、p50、p95 和最大值（耗时单位为毫秒）。"""
+
+    def summarize(hist: Dict[str, Any], bounds: List[float], scale: float = 1.0) -> Dict[str, Any]:
+        count = hist["count"]
+        return {
+            "mean": round(hist["sum"] / count * scale, 3) if count else 0.0,
+            "p50": round(get_histogram_quantile(hist, bounds, 0.5) * scale, 3),
+            "p95": round(get_histogram_quantile(hist, bounds, 0.95) * scale, 3),
+            "max": round(hist["max"] * scale, 3),
+        }
+
+    tools = {}
+    for name, tool in snapshot["tools"].items():
+        lookups = tool["cache_hits"] + tool["cache_misses"]
+        tools[name] = {
+            "calls": tool["calls"],
+            "errors": tool["errors"],
+            "cache_hits": tool["cache_hits"],
+            "cache_misses": tool["cache_misses"],
+            "cache_hit_rate": round(tool["cache_hits"] / lookups, 4) if lookups else None,
+            "duration_ms": {
+                phase: summarize(hist, METRICS_DURATION_BUCKETS, 1000.0)
+                for phase, hist in tool["duration_seconds"].items()
+            },
+            "response_bytes": {
+                "total": int(tool["response_bytes"]["sum"]),
+                **summarize(tool["response_bytes"], METRICS_BYTES_BUCKETS),
+            },
+            "rows_scanned": {
+                "total": int(tool["rows_scanned"]["sum"]),
+                **summarize(tool["rows_scanned"], METRICS_ROWS_BUCKETS),
+            },
+        }
+    return {"uptime_seconds": snapshot["uptime_seconds"], "tools": tools}
+
+
+def render_prometheus_metrics(snapshot: Dict[str, Any]) -> str:
+    """把指标快照渲染为 Prometheus 文本格式（version 0.0.4）。"""
+    lines = []
+
+    def add_counter(metric: str, help_text: str, field: str) -> None:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for name, tool in snapshot["tools"].items():
+            lines.append(f'{metric}{{tool="{name}"}} {tool[field]}')
+
+    def add_histogram(metric: str, help_text: str, bounds: List[float], series: List[Tuple[str, Dict[str, Any]]]):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for labels, hist in series:
+            cumulative = 0
+            for bound, count in zip([*map(str, bounds), "+Inf"], hist["counts"]):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{metric}_sum{{{labels}}} {hist['sum']}")
+            lines.append(f"{metric}_count{{{labels}}} {hist['count']}")
+
+    tools = snapshot["tools"].items()
+    add_counter("excel_mcp_tool_calls_total", "Tool calls handled.", "calls")
+    add_counter("excel_mcp_tool_errors_total", "Tool calls that raised or returned an error status.", "errors")
+    add_counter("excel_mcp_tool_cache_hits_total", "DataFrame cache hits during tool calls.", "cache_hits")
+    add_counter("excel_mcp_tool_cache_misses_total", "DataFrame cache misses during tool calls.", "cache_misses")
+    add_histogram(
+        "excel_mcp_tool_duration_seconds",
+        "Tool call wall time by phase (total, queue_wait, parse, compute, serialize).",
+        METRICS_DURATION_BUCKETS,
+        [
+            (f'tool="{name}",phase="{phase}"', hist)
+            for name, tool in tools
+            for phase, hist in tool["duration_seconds"].items()
+        ],
+    )
+    add_histogram(
+        "excel_mcp_tool_response_bytes",
+        "Size of the serialized tool response.",
+        METRICS_BYTES_BUCKETS,
+        [(f'tool="{name}"', tool["response_bytes"]) for name, tool in tools],
+    )
+    add_histogram(
+        "excel_mcp_tool_rows_scanned",
+        "Rows read from workbooks, sidecars or caches per tool call.",
+        METRICS_ROWS_BUCKETS,
+        [(f'tool="{name}"', tool["rows_scanned"]) for name, tool in tools],
+    )
+    return "\n".join(lines) + "\n"
+
+
+def format_server_metrics(snapshot: Dict[str, Any], metrics_format: str) -> Dict[str, Any]:
+    """按 get_server_metrics 的 metrics_format 参数生成响应。"""
+    if metrics_format not in METRICS_FORMATS:
+        return {
+            "status": "error",
+            "message": f"不支持的指标格式: {metrics_format}，支持: {', '.join(METRICS_FORMATS)}",
+            "error_code": "INVALID_METRICS_FORMAT",
+        }
+    if metrics_format == "prometheus":
+        return {"status": "success", "format": "prometheus", "text": render_prometheus_metrics(snapshot)}
+    return {"status": "success", "format": "json", **summarize_metrics_snapshot(snapshot)}
+
+
+class DataFrameCache:
+    """
+    已解析 DataFrame 的进程内 LRU 缓存。
+
+    缓存键为 (绝对路径, 工作表名, mtime_ns, 文件大小)，文件被外部修改后旧条目不会再被命中；
+    总占用超过字节上限时，按最近最少使用的顺序淘汰。每个条目还可附带由该 DataFrame 派生的数据
+    （如排序置换数组），与 DataFrame 一起计入容量、一起淘汰。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # 条目为 [DataFrame, 占用字节数, 派生数据字典]
+        self._entries: "OrderedDict[Tuple[Any, ...], List[Any]]" = OrderedDict()
+        # 工具在线程池中并发执行，所有读写都需持锁
+        self._lock = threading.RLock()
+
+    def contains(self, key: Tuple[Any, ...]) -> bool:
+        """判断是否已缓存（不计入命中统计，也不调整 LRU 顺序）。"""
+        with self._lock:
+            return key in self._entries
+
+    def peek(self, key: Tuple[Any, ...]) -> Optional[pd.DataFrame]:
+        """读取缓存但不计入命中统计，也不调整 LRU 顺序。"""
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def get(self, key: Tuple[Any, ...]) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Tuple[Any, ...], df: pd.DataFrame) -> None:
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        # 单个对象超过总容量时不缓存，避免把其他条目全部挤出
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = [df, size, {}]
+            self.current_bytes += size
+            self._evict()
+
+    def get_derived(self, key: Tuple[Any, ...], df: pd.DataFrame, name: str) -> Any:
+        """读取附加在缓存条目上的派生数据；条目不存在或已换成其他 DataFrame 时返回 None。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not df:
+                return None
+            return entry[2].get(name)
+
+    def put_derived(self, key: Tuple[Any, ...], df: pd.DataFrame, name: str, value: Any, nbytes: int = 0) -> None:
+        """把由 df 派生的数据附加到缓存条目上；df 已不在缓存中时忽略。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not df:
+                return
+            entry[2][name] = value
+            entry[1] += nbytes
+            self.current_bytes += nbytes
+            self._evict()
+
+    def _evict(self) -> None:
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+            self.evictions += 1
+
+    def invalidate(self, full_path: Path) -> int:
+        """移除某个文件的全部缓存条目（所有工作表、所有版本），返回移除数量。"""
+        path_key = str(full_path.resolve())
+        with self._lock:
+            stale_keys = [key for key in self._entries if key[0] == path_key]
+            for key in stale_keys:
+                self._discard(key)
+            self.invalidations += len(stale_keys)
+        return len(stale_keys)
+
+    def _discard(self, key: Tuple[Any, ...]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_dataframe_cache = DataFrameCache(DATAFRAME_CACHE_MAX_BYTES)
+
+
+def file_content_hash(full_path: Path) -> str:
+    """计算文件内容指纹（blake2b），用于在 mtime 变化但内容未变时继续复用旁路文件。"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(full_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_sidecar_path(full_path: Path, sheet_name: Optional[str]) -> Path:
+    """返回某个工作表对应的 Parquet 旁路文件路径。"""
+    resolved = full_path.resolve()
+    sheet_digest = hashlib.blake2b(f"{resolved}\0{sheet_name or ''}".encode("utf-8"), digest_size=8).hexdigest()
+    cache_dir = Path(SIDECAR_DIR) if SIDECAR_DIR else resolved.parent / ".excel_mcp_cache"
+    return cache_dir / f"{resolved.name}.{sheet_digest}.parquet"
+
+
+def read_sidecar(
+    full_path: Path, sheet_name: Optional[str], columns: Optional[List[str]] = None
+) -> Optional[pd.DataFrame]:
+    """
+    从 Parquet 旁路文件读取工作表数据（内存映射，支持列投影）。
+
+    旁路文件不存在、已过期、缺少所需列或无法读取时返回 None，由调用方回退到解析原文件。
+    """
+    sidecar_path = get_fresh_sidecar_path(full_path, sheet_name, columns)
+    if sidecar_path is None:
+        return None
+    try:
+        return pq.read_table(sidecar_path, columns=columns, memory_map=True).to_pandas()
+    except Exception:
+        return None
+
+
+def get_fresh_sidecar_path(
+    full_path: Path, sheet_name: Optional[str], columns: Optional[List[str]] = None
+) -> Optional[Path]:
+    """返回与源文件指纹一致、且包含所需列的旁路文件路径；不可用时返回 None。"""
+    if pq is None or not SIDECAR_ENABLED:
+        return None
+    sidecar_path = get_sidecar_path(full_path, sheet_name)
+    if not sidecar_path.exists():
+        return None
+
+    try:
+        schema = pq.read_schema(sidecar_path)
+        if columns and not set(columns).issubset(schema.names):
+            return None
+        schema_metadata = schema.metadata or {}
+        fingerprint = json.loads(schema_metadata.get(SIDECAR_METADATA_KEY, b"{}"))
+        if not fingerprint_matches(full_path, fingerprint):
+            return None
+        # 表头位置记录变化后，旁路文件中的列与数据不再对应
+        return sidecar_path if fingerprint.get("skiprows", 0) == get_header_skiprows(full_path, sheet_name) else None
+    except Exception:
+        return None
+
+
+def get_file_fingerprint(full_path: Path, stat: os.stat_result) -> Dict[str, Any]:
+    """源文件指纹：大小、修改时间与内容哈希。"""
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "content_hash": file_content_hash(full_path)}
+
+
+def fingerprint_matches(full_path: Path, fingerprint: Dict[str, Any]) -> bool:
+    """判断记录的指纹是否仍与源文件一致。"""
+    stat = full_path.stat()
+    if fingerprint.get("size") != stat.st_size:
+        return False
+    if fingerprint.get("mtime_ns") == stat.st_mtime_ns:
+        return True
+    # mtime 变化（如文件被复制或 touch）时再比对内容指纹；没有记录内容指纹时不计算
+    return "content_hash" in fingerprint and fingerprint["content_hash"] == file_content_hash(full_path)
+
+
+def write_sidecar(
+    full_path: Path, sheet_name: Optional[str], df: pd.DataFrame, stat: os.stat_result, skiprows: int = 0
+) -> bool:
+    """
+    将解析结果写成 Parquet 旁路文件，并在 schema 元数据中记录源文件指纹及解析时跳过的表头前行数。
+
+    含混合类型对象列等无法转换为 Arrow 的数据会被跳过，返回 False。
+    """
+    if pa is None or not SIDECAR_ENABLED:
+        return False
+    sidecar_path = get_sidecar_path(full_path, sheet_name)
+    tmp_path = sidecar_path.with_name(sidecar_path.name + ".tmp")
+
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        fingerprint = {**get_file_fingerprint(full_path, stat), "skiprows": skiprows}
+        metadata = {**(table.schema.metadata or {}), SIDECAR_METADATA_KEY: json.dumps(fingerprint).encode("utf-8")}
+        sidecar_path.parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+        os.replace(tmp_path, sidecar_path)
+        return True
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        return False
+
+
+def get_metadata_index_path(full_path: Path) -> Path:
+    """返回文件元数据索引（JSON）的路径，与 Parquet 旁路文件放在同一目录。"""
+    sidecar_path = get_sidecar_path(full_path, None)
+    return sidecar_path.with_name(sidecar_path.name.replace(".parquet", ".meta.json"))
+
+
+def load_metadata_index(full_path: Path) -> Dict[str, Any]:
+    """
+    读取文件元数据索引；索引不存在或与源文件指纹不一致时返回空索引（记录读取前的文件状态）。
+
+    旧索引中的表头位置记录在文件修改后仍可能有效（例如只追加了数据），放入 pending_header_offsets 等待重新校验。
+    """
+    index = None
+    if SIDECAR_ENABLED:
+        try:
+            with open(get_metadata_index_path(full_path), encoding="utf-8") as f:
+                index = json.load(f)
+            if fingerprint_matches(full_path, index.get("fingerprint", {})):
+                return index
+        except (OSError, ValueError):
+            pass
+    stat = full_path.stat()
+    fresh_index = {"fingerprint": {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}, "sheets": {}}
+    if isinstance(index, dict):
+        pending = {**index.get("pending_header_offsets", {}), **index.get("header_offsets", {})}
+        if pending:
+            fresh_index["pending_header_offsets"] = pending
+    return fresh_index
+
+
+def save_metadata_index(full_path: Path, index: Dict[str, Any]) -> None:
+    """写入文件元数据索引（先写临时文件再替换），失败时忽略。"""
+    if not SIDECAR_ENABLED:
+        return
+    index_path = get_metadata_index_path(full_path)
+    tmp_path = index_path.with_name(index_path.name + ".tmp")
+    try:
+        if "content_hash" not in index["fingerprint"]:
+            index["fingerprint"]["content_hash"] = file_content_hash(full_path)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+
+
+# xlsx 包内 XML 的命名空间
+XLSX_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+XLSX_PACKAGE_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+
+def read_workbook_sheet_names(full_path: Path) -> List[str]:
+    """
+    直接从 xlsx 压缩包的 xl/workbook.xml 读取工作表名称，不解析共享字符串、样式和工作表数据。
+
+    与 pd.ExcelFile 一致，只返回普通工作表（不含图表页）；非 zip 格式（如 .xls）回退到 pandas。
+    """
+    if not zipfile.is_zipfile(full_path):
+        with pd.ExcelFile(full_path) as xls:
+            return xls.sheet_names
+    with zipfile.ZipFile(full_path) as zf:
+        workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+        rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    rel_types = {rel.get("Id"): rel.get("Type", "") for rel in rels.iter(f"{XLSX_PACKAGE_REL_NS}Relationship")}
+    return [
+        sheet.get("name")
+        for sheet in workbook.iter(f"{XLSX_MAIN_NS}sheet")
+        if rel_types.get(sheet.get(f"{XLSX_REL_NS}id"), "").endswith("/worksheet")
+    ]
+
+
+def get_sheet_names(full_path: Path) -> List[str]:
+    """返回工作簿的工作表名称，优先使用元数据索引。"""
+    index = load_metadata_index(full_path)
+    if "sheet_names" not in index:
+        index["sheet_names"] = read_workbook_sheet_names(full_path)
+        save_metadata_index(full_path, index)
+    return index["sheet_names"]
+
+
+def read_head_rows(full_path: Path, sheet_name: Optional[str], max_rows: int) -> Tuple[List[List[Any]], Optional[int]]:
+    """
+    读取前 max_rows 行原始单元格值（不识别表头），以及工作表的总行数。
+
+    Excel 使用 openpyxl 只读流式模式，读到所需行数即停止；总行数取自工作表的 dimension 元素，
+    缺失时为 None。CSV 文件按物理行读取（空行与列数不同的标题行也各占一行，与 skiprows 的计数一致），
+    总行数为 None。
+    """
+    if full_path.suffix.lower() == ".csv":
+        with open(full_path, "r", encoding="utf-8-sig", newline="") as f:
+            rows = [[v if v.strip() else None for v in row] for row in itertools.islice(csv.reader(f), max_rows)]
+        for row in rows:
+            while row and row[-1] is None:
+                row.pop()
+        return rows, None
+
+    wb = openpyxl.load_workbook(full_path, read_only=True, data_only=True)
+    try:
+        if sheet_name not in wb.sheetnames:
+            raise ValueError(f"Worksheet named '{sheet_name}' not found")
+        ws = wb[sheet_name]
+        rows = [list(row) for row in ws.iter_rows(max_row=max_rows, values_only=True)]
+        total_rows = ws.max_row
+    finally:
+        wb.close()
+
+    # 与 pandas 读取结果一致：去掉每行末尾的空单元格和末尾的空行，整数值的浮点数转为整数
+    rows = [[int(v) if isinstance(v, float) and v.is_integer() else v for v in row] for row in rows]
+    for row in rows:
+        while row and row[-1] is None:
+            row.pop()
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows, total_rows
+
+
+def detect_header(full_path: Path, sheet_name: Optional[str], max_rows_to_check: int) -> Dict[str, Any]:
+    """
+    在前 max_rows_to_check 行中查找表头：非空单元格数量等于总列数的第一行。
+
+    结果（表头行号、列名、按样本推断的 dtype、数据行数）写入元数据索引，文件未变化时直接复用。
+
+    Returns:
+        Dict[str, Any]: header_row（未找到时为 None）、width、columns、dtypes、row_count。
+    """
+    sheet_key = get_sheet_key(full_path, sheet_name)
+    index = load_metadata_index(full_path)
+    sheet_index = index["sheets"].setdefault(sheet_key or "", {})
+    cached = sheet_index.get("headers", {}).get(str(max_rows_to_check))
+    if cached is not None:
+        return cached
+
+    rows, total_rows = read_head_rows(full_path, sheet_key, max_rows_to_check)
+    width = max((len(row) for row in rows), default=0)
+    if width == 0:
+        raise pd.errors.EmptyDataError("No columns to parse from file")
+    rows = [row + [None] * (width - len(row)) for row in rows]
+    header_row = next((i for i, row in enumerate(rows) if all(v is not None for v in row)), None)
+
+    result: Dict[str, Any] = {"header_row": header_row, "width": width, "columns": [], "dtypes": {}, "row_count": None}
+    if header_row is not None:
+        columns = [str(v).strip() for v in rows[header_row]]
+        if sheet_key is None:
+            # CSV 按无表头读取时整列都是字符串，需要从表头行开始重新读取样本才能得到真实类型
+            sample = pd.read_csv(full_path, encoding="utf-8", skiprows=header_row, nrows=max_rows_to_check)
+        else:
+            sample = pd.DataFrame(rows[header_row + 1 :], columns=columns).infer_objects()
+        result["columns"] = columns
+        result["dtypes"] = {col: str(dtype) for col, dtype in sample.dtypes.items()}
+        if total_rows is not None:
+            result["row_count"] = max(total_rows - header_row - 1, 0)
+    sheet_index.setdefault("headers", {})[str(max_rows_to_check)] = result
+    save_metadata_index(full_path, index)
+    return result
+
+
+def read_header_row(full_path: Path, sheet_name: Optional[str], skiprows: int) -> List[str]:
+    """读取第 skiprows 行（0 起始）的非空单元格，按 detect_header 的规则转换为列名。"""
+    rows, _ = read_head_rows(full_path, get_sheet_key(full_path, sheet_name), skiprows + 1)
+    return [str(v).strip() for v in rows[skiprows] if v is not None] if len(rows) > skiprows else []
+
+
+def record_header_skiprows(
+    full_path: Path, sheet_name: Optional[str], skiprows: int, columns: Optional[List[str]] = None
+) -> None:
+    """
+    在元数据索引中记录表头前需要跳过的行数及表头列名，其他工具读取时直接应用，不再重新检测或改写文件。
+
+    columns 为 None 时从文件中重新读取该行（用于写入工具改变了表头列之后刷新记录）。
+    """
+    index = load_metadata_index(full_path)
+    sheet_key = get_sheet_key(full_path, sheet_name) or ""
+    index.get("pending_header_offsets", {}).pop(sheet_key, None)
+    if columns is None:
+        columns = read_header_row(full_path, sheet_name, skiprows)
+    index.setdefault("header_offsets", {})[sheet_key] = {"skiprows": skiprows, "columns": columns}
+    save_metadata_index(full_path, index)
+
+
+def get_header_skiprows(full_path: Path, sheet_name: Optional[str]) -> int:
+    """
+    返回读取该工作表时表头前需要跳过的行数（由 get_column_names 记录），未记录时为 0。
+
+    文件修改后的记录需要重新校验：记录位置上的那一行仍是原表头时沿用，
+    否则（例如整表重写后表头已移到第一行）视为不再需要跳过。
+    """
+    sheet_key = get_sheet_key(full_path, sheet_name) or ""
+    index = load_metadata_index(full_path)
+    offset = index.get("header_offsets", {}).get(sheet_key)
+    if offset is not None:
+        return offset["skiprows"]
+
+    offset = index.get("pending_header_offsets", {}).pop(sheet_key, None)
+    if offset is None:
+        return 0
+    try:
+        is_valid = read_header_row(full_path, sheet_name, offset["skiprows"]) == offset["columns"]
+    except Exception:
+        is_valid = False
+    if is_valid:
+        index.setdefault("header_offsets", {})[sheet_key] = offset
+    save_metadata_index(full_path, index)
+    return offset["skiprows"] if is_valid else 0
+
+
+def get_sheet_key(full_path: Path, sheet_name: Optional[str]) -> Optional[str]:
+    """CSV 文件没有工作表概念，统一使用 None 作为工作表键。"""
+    return None if full_path.suffix.lower() == ".csv" else sheet_name
+
+
+def get_cache_key(full_path: Path, sheet_name: Optional[str]) -> Tuple[Any, ...]:
+    """构造 DataFrame 缓存键：(绝对路径, 工作表, mtime_ns, 文件大小)。"""
+    stat = full_path.stat()
+    return (str(full_path.resolve()), get_sheet_key(full_path, sheet_name), stat.st_mtime_ns, stat.st_size)
+
+
+def parse_source_file(full_path: Path, sheet_name: Optional[str], skiprows: int = 0) -> pd.DataFrame:
+    """解析原始 CSV/Excel 文件，跳过表头前的 skiprows 行。定义在模块顶层，以便提交到进程池执行。"""
+    if full_path.suffix.lower() == ".csv":
+        return pd.read_csv(full_path, encoding="utf-8", skiprows=skiprows)
+    return pd.read_excel(full_path, sheet_name=sheet_name, skiprows=skiprows, engine="openpyxl")
+
+
+def encode_categorical_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    把低基数的文本列转换为 category（字典编码），每行只保存整数编码，筛选、分组和排序都在编码上进行。
+
+    只转换全部非空值都是字符串、不同取值数不超过 min(行数 × CATEGORY_MAX_UNIQUE_RATIO, CATEGORY_MAX_CATEGORIES) 的对象列。
+    先在全表等间隔抽取约两倍上限的行：样本的不同取值数不会多于整列，样本已超过上限的列直接跳过，不做完整转换；
+    等间隔抽样也避免了按某列排序过的表只在开头看到少数取值。没有可转换的列时返回原对象。
+    """
+    if CATEGORY_MAX_UNIQUE_RATIO <= 0 or CATEGORY_MAX_CATEGORIES <= 0 or len(df) < CATEGORY_MIN_ROWS:
+        return df
+    max_categories = min(len(df) * CATEGORY_MAX_UNIQUE_RATIO, CATEGORY_MAX_CATEGORIES)
+    step = max(1, int(len(df) // (2 * max_categories)))
+    converted = {}
+    for position in range(df.shape[1]):
+        series = df.iloc[:, position]
+        if series.dtype != object:
+            continue
+        if series.iloc[::step].nunique() > max_categories:
+            continue
+        categorical = series.astype("category")
+        categories = categorical.cat.categories
+        if len(categories) > max_categories or pd.api.types.infer_dtype(categories, skipna=True) != "string":
+            continue
+        converted[position] = categorical
+    if not converted:
+        return df
+    df = df.copy(deep=False)
+    for position, categorical in converted.items():
+        df.isetitem(position, categorical)
+    return df
+
+
+def decode_categorical_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """把 category 列还原为对象列（合并等按原始取值比较 dtype/哈希的场景使用）；没有 category 列时返回原对象。"""
+    positions = [i for i, dtype in enumerate(df.dtypes) if isinstance(dtype, pd.CategoricalDtype)]
+    if not positions:
+        return df
+    df = df.copy(deep=False)
+    for position in positions:
+        df.isetitem(position, df.iloc[:, position].astype(object))
+    return df
+
+
+def get_column_dtypes(df: pd.DataFrame) -> Dict[str, str]:
+    """列名 → dtype 名称；字典编码列报告其取值的类型，与未编码时一致。"""
+    return {
+        column: str(dtype.categories.dtype) if isinstance(dtype, pd.CategoricalDtype) else str(dtype)
+        for column, dtype in df.dtypes.items()
+    }
+
+
+def load_dataframe(
+    full_path: Path, sheet_name: Optional[str] = "Sheet1", columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """
+    读取 Excel 工作表或 CSV 文件为 DataFrame。
+
+    依次尝试：进程内缓存 → Parquet 旁路文件 → 解析原文件（解析后回写旁路文件）。
+    get_column_names 记录过表头位置时，解析原文件会直接跳过表头前的行。
+    低基数文本列在放入缓存前转为 category（见 encode_categorical_columns），旁路文件中也以字典编码保存。
+
+    Args:
+        full_path (Path): 文件的绝对路径。
+        sheet_name (Optional[str]): Excel 工作表名称（CSV 文件忽略）。
+        columns (Optional[List[str]]): 仅需要的列。内存未命中时直接从旁路文件做列投影读取。
+
+    Returns:
+        pd.DataFrame: 解析后的数据。该对象可能与缓存共享，调用方如需原地修改，必须先 copy()。
+
+    Raises:
+        KeyError: 当 columns 中包含不存在的列时抛出。
+    """
+    sheet_key = get_sheet_key(full_path, sheet_name)
+    stat = full_path.stat()
+    key = (str(full_path.resolve()), sheet_key, stat.st_mtime_ns, stat.st_size)
+
+    started = time.perf_counter()
+    df = _dataframe_cache.get(key)
+    if df is None and columns:
+        # 列投影只读取需要的列，不放入整表缓存
+        projected = read_sidecar(full_path, sheet_key, columns)
+        if projected is not None:
+            record_parse(started, len(projected), cache_hit=False)
+            return projected
+
+    cache_hit = df is not None
+    if df is None:
+        df = read_sidecar(full_path, sheet_key)
+        if df is None:
+            skiprows = get_header_skiprows(full_path, sheet_key)
+            df = encode_categorical_columns(run_cpu_bound(parse_source_file, full_path, sheet_name, skiprows))
+            write_sidecar(full_path, sheet_key, df, stat, skiprows)
+        else:
+            df = encode_categorical_columns(df)
+        _dataframe_cache.put(key, df)
+    record_parse(started, len(df), cache_hit)
+
+    if columns:
+        missing_columns = [c for c in columns if c not in df.columns]
+        if missing_columns:
+            raise KeyError(f"列 {missing_columns} 不存在")
+        return df[columns]
+    return df
+
+
+def parse_workbook_sheets(full_path: Path, sheet_skiprows: Dict[str, int]) -> Dict[str, pd.DataFrame]:
+    """
+    只打开一次工作簿（openpyxl 只读流式模式），依次解析多个工作表，各自跳过表头前的行。
+
+    解析规则与 parse_source_file 相同；定义在模块顶层，以便提交到进程池执行。
+    """
+    with pd.ExcelFile(full_path, engine="openpyxl") as xls:
+        return {name: xls.parse(sheet_name=name, skiprows=skiprows) for name, skiprows in sheet_skiprows.items()}
+
+
+def load_workbook_dataframes(full_path: Path, sheet_names: List[str]) -> Dict[str, Tuple[pd.DataFrame, str]]:
+    """
+    批量读取工作簿中的多个工作表，并写入进程内缓存和 Parquet 旁路文件。
+
+    已缓存或旁路文件仍有效的工作表直接复用；其余工作表分组交给进程池并行解析，每组只打开一次工作簿，
+    不会像逐个调用 load_dataframe 那样为每个工作表重新打开、解析一遍压缩包。
+
+    Returns:
+        Dict[str, Tuple[pd.DataFrame, str]]: 工作表名 → (DataFrame, 来源)，来源为 cache、sidecar 或 parsed。
+    """
+    started = time.perf_counter()
+    stat = full_path.stat()
+    path_key = str(full_path.resolve())
+    frames: Dict[str, Tuple[pd.DataFrame, str]] = {}
+    pending: Dict[str, int] = {}
+    for sheet_name in sheet_names:
+        key = (path_key, sheet_name, stat.st_mtime_ns, stat.st_size)
+        df = _dataframe_cache.get(key)
+        if df is not None:
+            frames[sheet_name] = (df, "cache")
+            continue
+        df = read_sidecar(full_path, sheet_name)
+        if df is not None:
+            df = encode_categorical_columns(df)
+            _dataframe_cache.put(key, df)
+            frames[sheet_name] = (df, "sidecar")
+            continue
+        pending[sheet_name] = get_header_skiprows(full_path, sheet_name)
+
+    if pending:
+        # 待解析的工作表按进程池大小分组并行解析，每组只打开一次工作簿
+        group_count = max(1, min(PROCESS_WORKERS, len(pending)))
+        groups = [dict(list(pending.items())[i::group_count]) for i in range(group_count)]
+        parsed = {}
+        for group_result in run_cpu_bound_many(parse_workbook_sheets, [(full_path, group) for group in groups]):
+            parsed.update(group_result)
+        for sheet_name, df in parsed.items():
+            df = encode_categorical_columns(df)
+            write_sidecar(full_path, sheet_name, df, stat, pending[sheet_name])
+            _dataframe_cache.put((path_key, sheet_name, stat.st_mtime_ns, stat.st_size), df)
+            frames[sheet_name] = (df, "parsed")
+    metrics = _call_metrics.get()
+    if metrics is not None:
+        hits = sum(source == "cache" for _, source in frames.values())
+        metrics.cache_hits += hits
+        metrics.cache_misses += len(frames) - hits
+    record_parse(started, sum(len(df) for df, _ in frames.values()))
+    return {sheet_name: frames[sheet_name] for sheet_name in sheet_names}
+
+
+def count_csv_rows(full_path: Path, skiprows: int = 0) -> Tuple[int, bool]:
+    """
+    通过内存映射统计换行符数量，快速得到 CSV 数据行数（不含表头及表头前的行），返回 (行数, 是否精确)。
+
+    文件中含引号（字段内可能有换行）或空行（pandas 读取时会跳过）时，按物理行计算的结果只是估计值。
+    """
+    size = full_path.stat().st_size
+    if size == 0:
+        return 0, True
+    newline_count = 0
+    with open(full_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for start in range(0, size, CSV_BLOCK_BYTES):
+            newline_count += mm[start : start + CSV_BLOCK_BYTES].count(b"\n")
+        line_count = newline_count + (0 if mm[size - 1 : size] == b"\n" else 1)
+        exact = mm.find(b'"') == -1 and mm.find(b"\n\n") == -1 and mm.find(b"\n\r\n") == -1
+    return max(line_count - skiprows - 1, 0), exact
+
+
+def get_csv_row_count(full_path: Path, skiprows: int = 0) -> Tuple[int, bool]:
+    """返回 CSV 数据行数及是否精确，结果按文件指纹缓存在元数据索引中。"""
+    index = load_metadata_index(full_path)
+    sheet_index = index["sheets"].setdefault("", {})
+    cached = sheet_index.get("row_count")
+    if cached is not None and cached["skiprows"] == skiprows:
+        return cached["value"], cached["exact"]
+    row_count, exact = count_csv_rows(full_path, skiprows)
+    sheet_index["row_count"] = {"skiprows": skiprows, "value": row_count, "exact": exact}
+    save_metadata_index(full_path, index)
+    return row_count, exact
+
+
+def read_preview(full_path: Path, sheet_name: Optional[str], nrows: int) -> Tuple[pd.DataFrame, Optional[int], bool]:
+    """
+    读取工作表的前 nrows 行及总行数，不解析整个文件。
+
+    依次尝试：进程内缓存 → Parquet 旁路文件（行数取自文件元数据）→ 只解析前 nrows 行
+    （CSV 行数由换行符计数得到，Excel 行数取自工作表的 dimension 元素）。
+
+    Returns:
+        Tuple[pd.DataFrame, Optional[int], bool]: 前 nrows 行、总行数（未知时为 None）、总行数是否精确。
+    """
+    started = time.perf_counter()
+    sheet_key = get_sheet_key(full_path, sheet_name)
+    df = _dataframe_cache.peek(get_cache_key(full_path, sheet_name))
+    if df is not None:
+        record_parse(started, min(nrows, len(df)), cache_hit=True)
+        return df.head(nrows), len(df), True
+
+    sidecar_path = get_fresh_sidecar_path(full_path, sheet_key)
+    if sidecar_path is not None:
+        try:
+            parquet_file = pq.ParquetFile(sidecar_path, memory_map=True)
+            batch = next(parquet_file.iter_batches(batch_size=max(nrows, 1)), None)
+            table = pa.Table.from_batches([batch]) if batch is not None else parquet_file.schema_arrow.empty_table()
+            head = table.to_pandas().head(nrows)
+            record_parse(started, len(head), cache_hit=False)
+            return head, parquet_file.metadata.num_rows, True
+        except Exception:
+            pass
+
+    skiprows = get_header_skiprows(full_path, sheet_key)
+    if sheet_key is None:
+        head = pd.read_csv(full_path, encoding="utf-8", skiprows=skiprows, nrows=nrows)
+        row_count, exact = get_csv_row_count(full_path, skiprows)
+        record_parse(started, len(head), cache_hit=False)
+        return head, row_count, exact
+
+    # dimension 可能包含末尾只有格式没有数据的行，因此只作为估计值；
+    # pandas 解析只读工作表时会重置 dimension，需在解析前读取
+    with pd.ExcelFile(full_path, engine="openpyxl") as xls:
+        if sheet_name not in xls.sheet_names:
+            raise ValueError(f"Worksheet named '{sheet_name}' not found")
+        dimension_rows = xls.book[sheet_name].max_row
+        head = xls.parse(sheet_name=sheet_name, skiprows=skiprows, nrows=nrows)
+    row_count = max(dimension_rows - skiprows - 1, 0) if dimension_rows is not None else None
+    record_parse(started, len(head), cache_hit=False)
+    return head, row_count, False
+
+
+# 筛选条件支持的运算符
+CONDITION_OPERATORS = ["==", "!=", ">", ">=", "<", "<=", "in", "between", "contains", "isnull"]
+
+
+class ConditionError(ValueError):
+    """筛选条件不合法（列不存在、运算符不支持、取值格式错误等）。"""
+
+    def __init__(self, message: str, error_code: str = "INVALID_CONDITION"):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+def validate_condition_value(op: str, value: Any) -> None:
+    """
+    校验单个条件的取值格式。pandas 掩码与 DuckDB SQL 两条路径共用这一步，保证同一条件在两条路径上的报错一致。
+
+    Raises:
+        ConditionError: 取值格式与运算符不匹配时抛出。
+    """
+    if op == "in" and not isinstance(value, list):
+        raise ConditionError(f"in 运算的取值必须为列表: {value}")
+    if op == "between" and (not isinstance(value, list) or len(value) != 2):
+        raise ConditionError(f"between 运算的取值必须为 [下限, 上限]: {value}")
+
+
+def normalize_condition(condition: Any) -> Dict[str, Any]:
+    """
+    将筛选条件规范化为表达式树。
+
+    支持的写法：
+        - {"列名": 值}：等值筛选；值为列表时等价于 in。多个键之间为 AND。
+        - {"列名": {"op": ">", "value": 1000}}：带运算符的筛选。
+        - {"and": [条件, ...]} / {"or": [条件, ...]}：条件组合，可嵌套。
+
+    Returns:
+        Dict[str, Any]: 形如 {"and"/"or": [...]} 或 {"column", "op", "value"} 的节点。
+
+    Raises:
+        ConditionError: 条件格式不合法时抛出。
+    """
+    if not isinstance(condition, dict) or not condition:
+        raise ConditionError(f"筛选条件必须为非空字典: {condition}")
+
+    nodes = []
+    for key, value in condition.items():
+        if key in ("and", "or") and isinstance(value, list):
+            if not value:
+                raise ConditionError(f"{key} 条件列表不能为空")
+            nodes.append({key: [normalize_condition(item) for item in value]})
+        elif isinstance(value, dict):
+            op = value.get("op", "==")
+            if op not in CONDITION_OPERATORS:
+                raise ConditionError(
+                    f"不支持的运算符: {op}，支持: {', '.join(CONDITION_OPERATORS)}", "INVALID_OPERATOR"
+                )
+            validate_condition_value(op, value.get("value"))
+            nodes.append({"column": key, "op": op, "value": value.get("value")})
+        elif isinstance(value, list):
+            nodes.append({"column": key, "op": "in", "value": value})
+        else:
+            nodes.append({"column": key, "op": "==", "value": value})
+    return nodes[0] if len(nodes) == 1 else {"and": nodes}
+
+
+def get_condition_columns(node: Dict[str, Any]) -> List[str]:
+    """返回表达式树引用的全部列名（按首次出现顺序）。"""
+    if "column" in node:
+        return [node["column"]]
+    columns = []
+    for child in next(iter(node.values())):
+        columns.extend(c for c in get_condition_columns(child) if c not in columns)
+    return columns
+
+
+def build_condition_mask(df: pd.DataFrame, node: Dict[str, Any]) -> np.ndarray:
+    """
+    将表达式树编译为单个 NumPy 布尔掩码，对整张表只做一次筛选。
+
+    Raises:
+        ConditionError: 列不存在或取值与列类型不兼容时抛出。
+    """
+    if "and" in node or "or" in node:
+        combine = np.logical_and if "and" in node else np.logical_or
+        masks = [build_condition_mask(df, child) for child in next(iter(node.values()))]
+        return combine.reduce(masks)
+
+    column, op, value = node["column"], node["op"], node["value"]
+    if column not in df.columns:
+        raise ConditionError(f"筛选列 '{column}' 不存在", "INVALID_COLUMN")
+    series = df[column]
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # 字典编码列：只对各类别（及缺失值）求值一次，再按每行的整数编码取结果，编码 -1 表示缺失值
+        category_mask = build_condition_mask(pd.DataFrame({column: series.cat.categories.astype(object)}), node)
+        missing_mask = build_condition_mask(pd.DataFrame({column: pd.Series([np.nan], dtype=object)}), node)
+        return np.append(category_mask, missing_mask)[series.cat.codes.to_numpy()]
+
+    try:
+        if op == "in":
+            mask = series.isin(value)
+        elif op == "between":
+            mask = series.between(value[0], value[1])
+        elif op == "contains":
+            mask = series.astype("string").str.contains(str(value), regex=False).fillna(False)
+        elif op == "isnull":
+            mask = series.isna() if value is None or value else series.notna()
+        else:
+            mask = {
+                "==": series.__eq__,
+                "!=": series.__ne__,
+                ">": series.__gt__,
+                ">=": series.__ge__,
+                "<": series.__lt__,
+                "<=": series.__le__,
+            }[op](value)
+    except TypeError as e:
+        raise ConditionError(f"列 '{column}' 无法与 {value!r} 进行 {op} 比较: {str(e)}", "INVALID_CONDITION_VALUE")
+    return np.asarray(mask, dtype=bool)
+
+
+# 派生列表达式支持的函数：名称 -> (最少参数个数, 最多参数个数，None 表示不限)
+EXPRESSION_FUNCTIONS = {
+    "concat": (1, None),
+    "round": (1, 2),
+    "abs": (1, 1),
+    "upper": (1, 1),
+    "lower": (1, 1),
+    "strip": (1, 1),
+    "len": (1, 1),
+    "coalesce": (2, None),
+    "where": (3, 3),
+}
+
+# 表达式的规模上限：源码长度、语法树嵌套深度、幂运算的常量指数、整数结果的位数以及文本重复次数，
+# 避免 9**9**9、'x' * 10**9 这类表达式长时间占用 CPU 或内存
+EXPRESSION_MAX_LENGTH = 1000
+EXPRESSION_MAX_DEPTH = 32
+EXPRESSION_MAX_EXPONENT = 100
+EXPRESSION_MAX_INT_BITS = 1024
+EXPRESSION_MAX_REPEAT = 1000
+
+_EXPRESSION_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+_EXPRESSION_COMPARE_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+
+class ExpressionError(ValueError):
+    """派生列表达式不合法（语法错误、列不存在、函数不支持、类型不兼容等）。"""
+
+    def __init__(self, message: str, error_code: str = "INVALID_EXPRESSION"):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+def _expression_text(value: Any) -> Any:
+    """把表达式的值转换为文本：缺失值为空字符串，整数值的浮点列（如含空值的编号列）不带 .0。"""
+    if not isinstance(value, pd.Series):
+        return "" if value is None else str(value)
+    if pd.api.types.is_float_dtype(value.dtype) and value.dropna().mod(1).eq(0).all():
+        value = value.astype("Int64")
+    return value.astype("string").fillna("")
+
+
+def _call_expression_function(name: str, args: List[Any], index: pd.Index) -> Any:
+    """执行白名单函数；Series 参数按列向量化计算，标量参数按普通值计算。"""
+    if name == "concat":
+        return functools.reduce(operator.add, (_expression_text(arg) for arg in args))
+    if name == "round":
+        digits = args[1] if len(args) > 1 else 0
+        if not isinstance(digits, int):
+            raise ExpressionError(f"round 的第二个参数必须为整数: {digits!r}")
+        return args[0].round(digits) if isinstance(args[0], pd.Series) else round(args[0], digits)
+    if name == "abs":
+        return args[0].abs() if isinstance(args[0], pd.Series) else abs(args[0])
+    if name in ("upper", "lower", "strip", "len"):
+        text = args[0].astype("string") if isinstance(args[0], pd.Series) else pd.Series([args[0]], dtype="string")
+        result = getattr(text.str, name)()
+        return result if isinstance(args[0], pd.Series) else result.iloc[0]
+    if name == "coalesce":
+        result = args[0]
+        for arg in args[1:]:
+            if isinstance(result, pd.Series):
+                result = result.where(result.notna(), arg)
+            elif result is None:
+                result = arg
+        return result
+    # where(条件, 条件成立时的值, 否则的值)；条件为空值时视为不成立
+    condition = pd.Series(args[0], index=index) if not isinstance(args[0], pd.Series) else args[0]
+    mask = condition.fillna(False).astype(bool).to_numpy()
+    values = [arg.to_numpy() if isinstance(arg, pd.Series) else arg for arg in args[1:]]
+    return pd.Series(np.where(mask, values[0], values[1]), index=index)
+
+
+def _is_text_operand(value: Any) -> bool:
+    if isinstance(value, pd.Series):
+        return not pd.api.types.is_numeric_dtype(value.dtype) and pd.api.types.infer_dtype(value) == "string"
+    return isinstance(value, str)
+
+
+def _check_binary_operands(node: ast.BinOp, left: Any, right: Any) -> None:
+    """在计算前拒绝代价无界的运算：常量指数过大的幂运算，以及重复次数过多的文本乘法。"""
+    if isinstance(node.op, ast.Pow) and isinstance(right, (int, float)) and abs(right) > EXPRESSION_MAX_EXPONENT:
+        raise ExpressionError(f"{ast.unparse(node)} 的指数超过上限 {EXPRESSION_MAX_EXPONENT}", "EXPRESSION_TOO_LARGE")
+    if isinstance(node.op, ast.Mult):
+        for count, other in ((left, right), (right, left)):
+            if isinstance(count, int) and abs(count) > EXPRESSION_MAX_REPEAT and _is_text_operand(other):
+                raise ExpressionError(
+                    f"{ast.unparse(node)} 的文本重复次数超过上限 {EXPRESSION_MAX_REPEAT}", "EXPRESSION_TOO_LARGE"
+                )
+
+
+def _expression_depth(node: ast.AST) -> int:
+    return 1 + max((_expression_depth(child) for child in ast.iter_child_nodes(node)), default=0)
+
+
+def _evaluate_expression_node(node: ast.AST, df: pd.DataFrame, names: Dict[str, str]) -> Any:
+    if isinstance(node, ast.Constant):
+        if node.value is not None and not isinstance(node.value, (int, float, str)):
+            raise ExpressionError(f"不支持的常量: {node.value!r}")
+        return node.value
+
+    if isinstance(node, ast.Name):
+        column = names.get(node.id, node.id)
+        if column not in df.columns:
+            raise ExpressionError(f"表达式中的列 '{column}' 不存在", "INVALID_COLUMN")
+        series = df[column]
+        # 字典编码列按原始取值参与运算
+        return series.astype(object) if isinstance(series.dtype, pd.CategoricalDtype) else series
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _EXPRESSION_BINARY_OPERATORS:
+        left = _evaluate_expression_node(node.left, df, names)
+        right = _evaluate_expression_node(node.right, df, names)
+        _check_binary_operands(node, left, right)
+        try:
+            result = _EXPRESSION_BINARY_OPERATORS[type(node.op)](left, right)
+        except TypeError as e:
+            raise ExpressionError(
+                f"无法计算 {ast.unparse(node)}: {str(e)}（拼接文本请使用 concat）", "INVALID_EXPRESSION_VALUE"
+            )
+        if isinstance(result, int) and result.bit_length() > EXPRESSION_MAX_INT_BITS:
+            raise ExpressionError(f"{ast.unparse(node)} 的结果过大", "EXPRESSION_TOO_LARGE")
+        return result
+
+    if isinstance(node, ast.UnaryOp):
+        operand = _evaluate_expression_node(node.operand, df, names)
+        if isinstance(node.op, ast.USub):
+            return -operand
+        if isinstance(node.op, ast.UAdd):
+            return +operand
+        if isinstance(node.op, ast.Not):
+            return ~operand.fillna(False).astype(bool) if isinstance(operand, pd.Series) else not operand
+
+    if isinstance(node, ast.Compare) and all(type(op) in _EXPRESSION_COMPARE_OPERATORS for op in node.ops):
+        # a < b < c 等价于 (a < b) and (b < c)
+        left = _evaluate_expression_node(node.left, df, names)
+        result = True
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _evaluate_expression_node(comparator, df, names)
+            try:
+                result = result & _EXPRESSION_COMPARE_OPERATORS[type(op)](left, right)
+            except TypeError as e:
+                raise ExpressionError(f"无法比较 {ast.unparse(node)}: {str(e)}", "INVALID_EXPRESSION_VALUE")
+            left = right
+        return result
+
+    if isinstance(node, ast.BoolOp):
+        combine = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+        values = [_evaluate_expression_node(value, df, names) for value in node.values]
+        values = [v.fillna(False).astype(bool) if isinstance(v, pd.Series) else bool(v) for v in values]
+        return functools.reduce(combine, values)
+
+    if isinstance(node, ast.IfExp):
+        args = [_evaluate_expression_node(n, df, names) for n in (node.test, node.body, node.orelse)]
+        return _call_expression_function("where", args, df.index)
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        name = node.func.id
+        if name not in EXPRESSION_FUNCTIONS:
+            raise ExpressionError(
+                f"不支持的函数: {name}，支持: {', '.join(EXPRESSION_FUNCTIONS)}", "INVALID_EXPRESSION_FUNCTION"
+            )
+        min_args, max_args = EXPRESSION_FUNCTIONS[name]
+        if len(node.args) < min_args or (max_args is not None and len(node.args) > max_args):
+            raise ExpressionError(f"函数 {name} 的参数个数不正确: {len(node.args)}")
+        args = [_evaluate_expression_node(arg, df, names) for arg in node.args]
+        try:
+            return _call_expression_function(name, args, df.index)
+        except TypeError as e:
+            raise ExpressionError(f"无法计算 {ast.unparse(node)}: {str(e)}", "INVALID_EXPRESSION_VALUE")
+
+    raise ExpressionError(f"表达式中不支持的语法: {ast.unparse(node)}")
+
+
+def evaluate_expression(df: pd.DataFrame, expression: str) -> pd.Series:
+    """
+    在整张表上向量化计算派生列表达式，例如 "销售额 * 1.1"、"concat(学号, '_', 姓名)"。
+
+    只允许列名、常量、算术/比较/逻辑运算、条件表达式（a if 条件 else b）和 EXPRESSION_FUNCTIONS 中的函数，
+    不会执行任意代码。列名不是合法标识符（含空格、符号等）时用反引号括起，如 `单价(元)` * 数量。
+    表达式的长度、嵌套深度、幂运算指数和整数结果大小受 EXPRESSION_MAX_* 限制，超出时抛出 ExpressionError。
+
+    Returns:
+        pd.Series: 与 df 行一一对应的结果；表达式为常量时广播到每一行。
+
+    Raises:
+        ExpressionError: 表达式不合法或无法计算时抛出。
+    """
+    if not isinstance(expression, str) or not expression.strip():
+        raise ExpressionError("表达式必须为非空字符串")
+    if len(expression) > EXPRESSION_MAX_LENGTH:
+        raise ExpressionError(f"表达式长度超过上限 {EXPRESSION_MAX_LENGTH} 个字符", "EXPRESSION_TOO_LARGE")
+
+    names: Dict[str, str] = {}
+
+    def replace_quoted_name(match: "re.Match[str]") -> str:
+        placeholder = f"__column_{len(names)}"
+        names[placeholder] = match.group(1)
+        return placeholder
+
+    source = re.sub(r"`([^`]+)`", replace_quoted_name, expression.strip())
+    try:
+        tree = ast.parse(source, mode="eval")
+    except SyntaxError as e:
+        raise ExpressionError(f"表达式语法错误: {e.msg}")
+    except (ValueError, RecursionError, MemoryError):
+        raise ExpressionError("表达式无法解析")
+    if _expression_depth(tree.body) > EXPRESSION_MAX_DEPTH:
+        raise ExpressionError(f"表达式嵌套层数超过上限 {EXPRESSION_MAX_DEPTH}", "EXPRESSION_TOO_LARGE")
+
+    with np.errstate(all="ignore"):
+        result = _evaluate_expression_node(tree.body, df, names)
+    if not isinstance(result, pd.Series):
+        return pd.Series([result] * len(df), index=df.index)
+    if isinstance(result.dtype, pd.StringDtype):
+        # 与 read_csv/read_excel 读出的文本列一致：object 类型，缺失值为 NaN
+        result = result.astype(object).where(result.notna(), np.nan)
+    return result
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _condition_value_sql_type(column_type: str, value: Any) -> Optional[str]:
+    """
+    返回取值在 SQL 中绑定的类型；取值与列类型不属于同一类（如文本列与数字比较）时返回 None。
+
+    DuckDB 会把 '5' 隐式转换为 5 再比较，而 pandas 中 "5" == 5 为 False，这类条件交由 pandas 路径处理。
+    """
+    is_integer_column = column_type in _DUCKDB_INTEGER_TYPES and column_type != "BOOLEAN"
+    if isinstance(value, bool):
+        return "BOOLEAN" if column_type == "BOOLEAN" else None
+    if isinstance(value, (int, float, np.integer, np.floating)) and not pd.isna(value):
+        if is_integer_column or column_type.startswith("DECIMAL") or column_type in ("FLOAT", "DOUBLE"):
+            return "BIGINT" if isinstance(value, (int, np.integer)) and abs(int(value)) < 2**63 else "DOUBLE"
+        return None
+    if isinstance(value, str):
+        return "VARCHAR" if column_type == "VARCHAR" else None
+    return None
+
+
+def condition_sql_compatible(node: Dict[str, Any], column_types: Dict[str, str]) -> bool:
+    """判断表达式树能否在 DuckDB 上得到与 pandas 掩码完全相同的结果：列都存在，且取值不依赖隐式类型转换。"""
+    if "and" in node or "or" in node:
+        return all(condition_sql_compatible(child, column_types) for child in next(iter(node.values())))
+
+    column, op, value = node["column"], node["op"], node["value"]
+    if column not in column_types:
+        return False
+    column_type = column_types[column]
+    if op == "isnull":
+        return True
+    if op == "contains":
+        # 整数与文本转成字符串的结果与 pandas 一致，浮点数、日期等格式不同
+        return column_type == "VARCHAR" or (column_type in _DUCKDB_INTEGER_TYPES and column_type != "BOOLEAN")
+    values = value if op in ("in", "between") else [value]
+    return all(_condition_value_sql_type(column_type, item) is not None for item in values)
+
+
+def build_condition_sql(node: Dict[str, Any], params: List[Any], column_types: Dict[str, str]) -> str:
+    """
+    将表达式树编译为 DuckDB WHERE 子句，取值通过参数绑定传入 params，并显式转换为与取值一致的类型。
+
+    调用前须用 condition_sql_compatible 确认条件可以在 SQL 中求值；取值格式已在 normalize_condition 中校验。
+    """
+    if "and" in node or "or" in node:
+        keyword = " AND " if "and" in node else " OR "
+        return (
+            "("
+            + keyword.join(build_condition_sql(child, params, column_types) for child in next(iter(node.values())))
+            + ")"
+        )
+
+    column_type = column_types[node["column"]]
+    column, op, value = _quote_identifier(node["column"]), node["op"], node["value"]
+
+    def bind(item: Any) -> str:
+        params.append(item)
+        return f"CAST(? AS {_condition_value_sql_type(column_type, item)})"
+
+    if op == "in":
+        # 与 pandas 的 isin([]) 一致：空列表不匹配任何行
+        if not value:
+            return "FALSE"
+        return f"{column} IN ({', '.join(bind(item) for item in value)})"
+    if op == "between":
+        return f"{column} BETWEEN {bind(value[0])} AND {bind(value[1])}"
+    if op == "contains":
+        params.append(str(value))
+        return f"contains(CAST({column} AS VARCHAR), ?)"
+    if op == "isnull":
+        return f"{column} IS NULL" if value is None or value else f"{column} IS NOT NULL"
+    # pandas 中 NaN != x 为 True，对应 SQL 的 IS DISTINCT FROM
+    sql_op = {"==": "=", "!=": "IS DISTINCT FROM"}.get(op, op)
+    return f"{column} {sql_op} {bind(value)}"
+
+
+def query_sidecar(
+    full_path: Path,
+    sheet_name: Optional[str],
+    node: Dict[str, Any],
+    columns: Optional[List[str]] = None,
+    count_only: bool = False,
+) -> Optional[Union[pd.DataFrame, int]]:
+    """
+    直接在 Parquet 旁路文件上用 DuckDB 执行筛选，避免把整张表读入内存。
+
+    Returns:
+        Optional[Union[pd.DataFrame, int]]: 筛选结果（count_only 时为行数）；旁路文件不可用或条件需交由 pandas 求值时返回 None。
+    """
+    needed_columns = list(dict.fromkeys((columns or []) + get_condition_columns(node))) if columns else None
+    sidecar_path = get_fresh_sidecar_path(full_path, get_sheet_key(full_path, sheet_name), needed_columns)
+    if sidecar_path is None:
+        return None
+
+    params: List[Any] = [str(sidecar_path)]
+    select_sql = "count(*)" if count_only else (", ".join(_quote_identifier(c) for c in columns) if columns else "*")
+    try:
+        with duckdb.connect() as conn:
+            describe_sql = "DESCRIBE SELECT * FROM read_parquet(?)"
+            column_types = dict(row[:2] for row in conn.execute(describe_sql, params).fetchall())
+            if not condition_sql_compatible(node, column_types):
+                return None
+            where_sql = build_condition_sql(node, params, column_types)
+            relation = conn.execute(f"SELECT {select_sql} FROM read_parquet(?) WHERE {where_sql}", params)
+            return relation.fetchone()[0] if count_only else relation.df()
+    except duckdb.Error:
+        # 列名不存在、类型不兼容等情况交由 pandas 路径给出具体错误
+        return None
+
+
+def use_chunked_csv(full_path: Path) -> bool:
+    """大 CSV 且整表不在内存缓存中时，按块处理而不是整表加载。"""
+    return (
+        full_path.suffix.lower() == ".csv"
+        and full_path.stat().st_size > CHUNKED_CSV_THRESHOLD_BYTES
+        and not _dataframe_cache.contains(get_cache_key(full_path, None))
+    )
+
+
+def read_csv_columns(full_path: Path) -> List[str]:
+    """只读取 CSV 表头，列名与 pd.read_csv 的结果一致。"""
+    return pd.read_csv(
+        full_path, encoding="utf-8", skiprows=get_header_skiprows(full_path, None), nrows=0
+    ).columns.tolist()
+
+
+def get_csv_arrow_types(full_path: Path) -> Optional[Dict[str, Any]]:
+    """
+    返回 pyarrow 分块读取使用的列类型，结果缓存在元数据索引中（文件修改后重新计算）。
+
+    类型由第一块推断，随后用这些类型把整个文件解析一遍（不转换为 DataFrame）加以校验，保证每一块的列类型相同；
+    后续块与推断类型不符时返回 None，改用 pandas 读取。
+    """
+    index = load_metadata_index(full_path)
+    csv_index = index["sheets"].setdefault("", {})
+    if csv_index.get("arrow_types_unsafe"):
+        return None
+    if "arrow_types" not in csv_index:
+        read_options = pa_csv.ReadOptions(block_size=CSV_BLOCK_BYTES, skip_rows=get_header_skiprows(full_path, None))
+        with pa_csv.open_csv(full_path, read_options=read_options, convert_options=get_csv_convert_options()) as reader:
+            # 第一块全为空的列推断为 null 类型，按数值列处理，后续块出现文本时校验失败
+            arrow_types = {
+                field.name: "double" if pa.types.is_null(field.type) else str(field.type) for field in reader.schema
+            }
+        convert_options = get_csv_convert_options({name: pa.type_for_alias(t) for name, t in arrow_types.items()})
+        try:
+            with pa_csv.open_csv(full_path, read_options=read_options, convert_options=convert_options) as reader:
+                for _ in reader:
+                    pass
+            csv_index["arrow_types"] = arrow_types
+        except pa.ArrowInvalid:
+            csv_index["arrow_types_unsafe"] = True
+        save_metadata_index(full_path, index)
+        if csv_index.get("arrow_types_unsafe"):
+            return None
+    return {name: pa.type_for_alias(alias) for name, alias in csv_index["arrow_types"].items()}
+
+
+def get_csv_pandas_dtypes(full_path: Path) -> Dict[str, str]:
+    """
+    返回 pandas 分块读取时固定使用的列类型，结果缓存在元数据索引中（文件修改后重新计算）。
+
+    pandas 按块读取时每块单独推断类型（同一列可能这一块是 int64、下一块是 float64 或 object），
+    因此先逐块读一遍，合并出覆盖全部块的类型：整数与浮点数合并为 float64，其余不一致的合并为 object。
+    """
+    index = load_metadata_index(full_path)
+    csv_index = index["sheets"].setdefault("", {})
+    if "pandas_dtypes" not in csv_index:
+        dtypes: Dict[str, str] = {}
+        with pd.read_csv(
+            full_path, encoding="utf-8", skiprows=get_header_skiprows(full_path, None), chunksize=STREAM_CHUNK_ROWS
+        ) as reader:
+            for chunk in reader:
+                for name, dtype in chunk.dtypes.items():
+                    previous, current = dtypes.get(name), str(dtype)
+                    if previous is None or previous == current:
+                        dtypes[name] = current
+                    elif {previous, current} == {"int64", "float64"}:
+                        dtypes[name] = "float64"
+                    else:
+                        dtypes[name] = "object"
+        csv_index["pandas_dtypes"] = dtypes
+        save_metadata_index(full_path, index)
+    return csv_index["pandas_dtypes"]
+
+
+def get_csv_convert_options(
+    column_types: Optional[Dict[str, Any]] = None, columns: Optional[List[str]] = None
+) -> "pa_csv.ConvertOptions":
+    """pyarrow CSV 转换选项：与 pandas 一致，空字符串视为缺失值，不把文本自动解析为时间戳。"""
+    return pa_csv.ConvertOptions(
+        column_types=column_types, include_columns=columns, strings_can_be_null=True, timestamp_parsers=[]
+    )
+
+
+def iter_csv_chunks(full_path: Path, columns: Optional[List[str]] = None):
+    """
+    按块读取 CSV，内存占用与块大小成正比，而不是与文件大小成正比。
+
+    可用时使用 pyarrow 流式读取（列类型由第一块推断并对整个文件校验后缓存），否则使用 pandas 的 chunksize 迭代器
+    （列类型由预先读一遍合并得到）。两种方式下每块的列类型都相同，每块的索引为其在文件中的全局行号。
+
+    Raises:
+        KeyError: 当 columns 中包含不存在的列时抛出。
+    """
+    if columns:
+        missing_columns = [c for c in columns if c not in read_csv_columns(full_path)]
+        if missing_columns:
+            raise KeyError(f"列 {missing_columns} 不存在")
+
+    # 只统计读取与转换每一块的耗时，不含调用方处理这一块的时间
+    started = time.perf_counter()
+    rows_read = 0
+    header_skiprows = get_header_skiprows(full_path, None)
+    column_types = get_csv_arrow_types(full_path) if pa_csv is not None else None
+    if column_types is not None:
+        read_options = pa_csv.ReadOptions(block_size=CSV_BLOCK_BYTES, skip_rows=header_skiprows)
+        convert_options = get_csv_convert_options(column_types, columns)
+        try:
+            with pa_csv.open_csv(full_path, read_options=read_options, convert_options=convert_options) as reader:
+                for batch in reader:
+                    chunk = batch.to_pandas()
+                    chunk.index = pd.RangeIndex(rows_read, rows_read + len(chunk))
+                    rows_read += len(chunk)
+                    record_parse(started, len(chunk))
+                    yield chunk
+                    started = time.perf_counter()
+            return
+        except pa.ArrowInvalid:
+            # 列类型已对整个文件校验过，只有文件在校验之后被改写才会走到这里：记录下来，下次改用 pandas。
+            # 已经交给调用方的块不能换成另一种类型，因此只在尚未读出任何行时从头改用 pandas 读取
+            index = load_metadata_index(full_path)
+            index["sheets"].setdefault("", {})["arrow_types_unsafe"] = True
+            save_metadata_index(full_path, index)
+            if rows_read:
+                raise
+
+    # 每块使用相同的列类型，与 pyarrow 路径一样不会出现同一列在不同块中类型不同的情况
+    with pd.read_csv(
+        full_path,
+        encoding="utf-8",
+        usecols=columns,
+        skiprows=header_skiprows,
+        dtype=get_csv_pandas_dtypes(full_path),
+        chunksize=STREAM_CHUNK_ROWS,
+    ) as reader:
+        for chunk in reader:
+            chunk.index = pd.RangeIndex(rows_read, rows_read + len(chunk))
+            rows_read += len(chunk)
+            record_parse(started, len(chunk))
+            yield chunk[columns] if columns else chunk
+            started = time.perf_counter()
+
+
+def filter_csv_chunks(
+    full_path: Path, columns: Optional[List[str]], node: Optional[Dict[str, Any]], count_only: bool
+) -> Union[pd.DataFrame, int]:
+    """select_rows 的分块版本：逐块计算筛选掩码，只保留匹配的行（或只累计匹配行数）。"""
+    needed_columns = list(dict.fromkeys((columns or []) + get_condition_columns(node))) if columns and node else columns
+    if count_only and node is None:
+        first_column = read_csv_columns(full_path)[:1]
+        return sum(len(chunk) for chunk in iter_csv_chunks(full_path, first_column))
+
+    matched_count = 0
+    matched_chunks = []
+    for chunk in iter_csv_chunks(full_path, needed_columns):
+        if node is not None:
+            mask = build_condition_mask(chunk, node)
+            if count_only:
+                matched_count += int(mask.sum())
+                continue
+            chunk = chunk[mask]
+        matched_chunks.append(chunk[columns] if columns and node else chunk)
+    if count_only:
+        return matched_count
+    if not matched_chunks:
+        return pd.DataFrame(columns=columns or read_csv_columns(full_path))
+    return pd.concat(matched_chunks)
+
+
+def select_rows(
+    full_path: Path,
+    sheet_name: Optional[str],
+    columns: Optional[List[str]] = None,
+    condition: Optional[Dict[str, Any]] = None,
+    count_only: bool = False,
+) -> Union[pd.DataFrame, int]:
+    """
+    读取并筛选数据：整表已在内存缓存中时使用 NumPy 掩码，否则优先在旁路文件上执行 DuckDB 查询；
+    大 CSV 没有旁路文件时按块筛选。
+
+    Returns:
+        Union[pd.DataFrame, int]: 筛选后的数据；count_only 为 True 时仅返回匹配行数。
+
+    Raises:
+        ConditionError: 筛选条件不合法时抛出。
+        KeyError: columns 中包含不存在的列时抛出。
+    """
+    node = normalize_condition(condition) if condition else None
+    if node is not None and not _dataframe_cache.contains(get_cache_key(full_path, sheet_name)):
+        result = query_sidecar(full_path, sheet_name, node, columns, count_only)
+        if result is not None:
+            return result
+    if use_chunked_csv(full_path):
+        return filter_csv_chunks(full_path, columns, node, count_only)
+
+    needed_columns = list(dict.fromkeys(columns + get_condition_columns(node))) if columns and node else columns
+    df = load_dataframe(full_path, sheet_name, columns=needed_columns)
+    if node is not None:
+        mask = build_condition_mask(df, node)
+        if count_only:
+            return int(mask.sum())
+        df = df[mask]
+    if count_only:
+        return len(df)
+    return df[columns] if columns and node else df
+
+
+# 聚合工具支持的统计函数，及其对应的 DuckDB 表达式
+AGGREGATE_FUNCTIONS = {
+    "sum": "coalesce(sum({column}), 0)",
+    "mean": "avg({column})",
+    "count": "count({column})",
+    "min": "min({column})",
+    "max": "max({column})",
+    "median": "median({column})",
+    "std": "stddev_samp({column})",
+    "nunique": "count(DISTINCT {column})",
+}
+NUMERIC_AGGREGATE_FUNCTIONS = ["sum", "mean", "median", "std"]
+
+# DuckDB 中的整数/布尔类型：sum 结果转回 BIGINT，与 pandas 对整数列求和的结果类型一致
+_DUCKDB_INTEGER_TYPES = {
+    "BOOLEAN",
+    "TINYINT",
+    "SMALLINT",
+    "INTEGER",
+    "BIGINT",
+    "HUGEINT",
+    "UTINYINT",
+    "USMALLINT",
+    "UINTEGER",
+    "UBIGINT",
+}
+
+
+class AggregateError(ValueError):
+    """聚合参数不合法（统计函数不支持、列不存在、对非数值列求和等）。"""
+
+    def __init__(self, message: str, error_code: str = "INVALID_METRIC"):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+def normalize_metrics(metrics: Optional[Dict[str, Union[str, List[str]]]]) -> List[Tuple[str, str]]:
+    """把 {"列名": "sum" 或 ["sum", "mean"]} 规范化为 (列名, 统计函数) 列表。"""
+    if metrics is None:
+        return []
+    if not isinstance(metrics, dict):
+        raise AggregateError(f"metrics 必须为 {{列名: 统计函数或函数列表}} 的字典: {metrics}")
+    pairs = []
+    for column, funcs in metrics.items():
+        for func in [funcs] if isinstance(funcs, str) else funcs:
+            if func not in AGGREGATE_FUNCTIONS:
+                raise AggregateError(f"不支持的统计函数: {func}，支持: {', '.join(AGGREGATE_FUNCTIONS)}")
+            pairs.append((column, func))
+    return pairs
+
+
+def aggregate_dataframe(df: pd.DataFrame, group_by: List[str], metrics: List[Tuple[str, str]]) -> pd.DataFrame:
+    """
+    用 pandas 向量化分组聚合。结果列名为 "列名_统计函数"；未指定 metrics 时只统计每组行数（count 列）。
+
+    分组键为空值的行单独成组，按分组键升序排列，空值组排在最后。
+    """
+    for column, func in metrics:
+        series = df[column]
+        if func in NUMERIC_AGGREGATE_FUNCTIONS and not pd.api.types.is_numeric_dtype(series.dtype):
+            raise AggregateError(f"列 '{column}' 不是数值列，无法计算 {func}", "INVALID_METRIC_COLUMN")
+    # 无序 category 不支持 min/max，统计列按原始取值计算；分组键保持字典编码，在整数编码上分组
+    categorical_metrics = {column for column, _ in metrics if isinstance(df[column].dtype, pd.CategoricalDtype)}
+    if categorical_metrics:
+        df = df.astype({column: object for column in categorical_metrics})
+
+    if not group_by:
+        if not metrics:
+            return pd.DataFrame({"count": [len(df)]})
+        return pd.DataFrame([{f"{column}_{func}": getattr(df[column], func)() for column, func in metrics}])
+
+    grouped = df.groupby(group_by, dropna=False, sort=True, observed=True)
+    if not metrics:
+        return grouped.size().reset_index(name="count")
+    named_aggs = {f"{column}_{func}": pd.NamedAgg(column=column, aggfunc=func) for column, func in metrics}
+    return grouped.agg(**named_aggs).reset_index()
+
+
+def query_aggregate(
+    full_path: Path,
+    sheet_name: Optional[str],
+    group_by: List[str],
+    metrics: List[Tuple[str, str]],
+    node: Optional[Dict[str, Any]],
+) -> Optional[pd.DataFrame]:
+    """
+    用 DuckDB 执行分组聚合，只扫描涉及的列：优先使用 Parquet 旁路文件，未加载的大 CSV 直接扫描原文件。
+
+    Returns:
+        Optional[pd.DataFrame]: 聚合结果（与 aggregate_dataframe 一致）；没有可用的数据源或筛选条件需交由 pandas 求值时返回 None。
+
+    Raises:
+        AggregateError / ConditionError: 列不存在、统计函数与列类型不兼容或筛选条件不合法时抛出。
+    """
+    needed_columns = list(
+        dict.fromkeys(group_by + [column for column, _ in metrics] + (get_condition_columns(node) if node else []))
+    )
+    params: List[Any] = []
+    if use_chunked_csv(full_path):
+        source_sql = f"read_csv(?, header = true, skip = {int(get_header_skiprows(full_path, None))})"
+        params.append(str(full_path))
+    else:
+        sidecar_path = get_fresh_sidecar_path(full_path, get_sheet_key(full_path, sheet_name))
+        if sidecar_path is None:
+            return None
+        source_sql = "read_parquet(?)"
+        params.append(str(sidecar_path))
+
+    with duckdb.connect() as conn:
+        column_types = dict(row[:2] for row in conn.execute(f"DESCRIBE SELECT * FROM {source_sql}", params).fetchall())
+        missing_columns = [column for column in needed_columns if column not in column_types]
+        if missing_columns:
+            raise AggregateError(f"列 {missing_columns} 不存在", "INVALID_COLUMN")
+        if node is not None and not condition_sql_compatible(node, column_types):
+            return None
+
+        select_items = [_quote_identifier(column) for column in group_by]
+        for column, func in metrics:
+            column_type = column_types[column]
+            is_numeric = column_type in _DUCKDB_INTEGER_TYPES or column_type.startswith("DECIMAL")
+            is_numeric = is_numeric or column_type in ("FLOAT", "DOUBLE")
+            if func in NUMERIC_AGGREGATE_FUNCTIONS and not is_numeric:
+                raise AggregateError(f"列 '{column}' 不是数值列，无法计算 {func}", "INVALID_METRIC_COLUMN")
+            column_sql = _quote_identifier(column)
+            if column_type == "BOOLEAN" and func in NUMERIC_AGGREGATE_FUNCTIONS:
+                column_sql = f"CAST({column_sql} AS INTEGER)"
+            item_sql = AGGREGATE_FUNCTIONS[func].format(column=column_sql)
+            if func == "sum" and column_type in _DUCKDB_INTEGER_TYPES:
+                item_sql = f"CAST({item_sql} AS BIGINT)"
+            select_items.append(f"{item_sql} AS {_quote_identifier(f'{column}_{func}')}")
+        if not metrics:
+            select_items.append('count(*) AS "count"')
+
+        sql = f"SELECT {', '.join(select_items)} FROM {source_sql}"
+        if node is not None:
+            sql += f" WHERE {build_condition_sql(node, params, column_types)}"
+        if group_by:
+            keys_sql = ", ".join(_quote_identifier(column) for column in group_by)
+            order_sql = ", ".join(f"{_quote_identifier(column)} ASC NULLS LAST" for column in group_by)
+            sql += f" GROUP BY {keys_sql} ORDER BY {order_sql}"
+        try:
+            return conn.execute(sql, params).df()
+        except duckdb.Error as e:
+            raise AggregateError(f"聚合计算失败: {str(e)}", "AGGREGATE_ERROR")
+
+
+def aggregate_rows(
+    full_path: Path,
+    sheet_name: Optional[str],
+    group_by: List[str],
+    metrics: List[Tuple[str, str]],
+    condition: Optional[Dict[str, Any]] = None,
+) -> Tuple[pd.DataFrame, str]:
+    """
+    分组聚合：整表已在内存缓存中时用 pandas，否则在旁路文件或大 CSV 上用 DuckDB，只返回聚合结果。
+
+    Returns:
+        Tuple[pd.DataFrame, str]: 聚合结果，以及执行方式（"in_memory" 或 "duckdb"）。
+    """
+    node = normalize_condition(condition) if condition else None
+    if not _dataframe_cache.contains(get_cache_key(full_path, sheet_name)):
+        result = query_aggregate(full_path, sheet_name, group_by, metrics, node)
+        if result is not None:
+            return result, "duckdb"
+
+    needed_columns = list(
+        dict.fromkeys(group_by + [column for column, _ in metrics] + (get_condition_columns(node) if node else []))
+    )
+    try:
+        df = load_dataframe(full_path, sheet_name, columns=needed_columns or None)
+    except KeyError as e:
+        raise AggregateError(str(e.args[0]), "INVALID_COLUMN")
+    if node is not None:
+        df = df[build_condition_mask(df, node)]
+    return aggregate_dataframe(df, group_by, metrics), "in_memory"
+
+
+class CursorError(ValueError):
+    """分页游标无效或对应的结果集已过期。"""
+
+    def __init__(self, message: str, error_code: str = "INVALID_CURSOR"):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+class ResultSetCache:
+    """
+    分页查询的服务端结果集缓存。
+
+    首页查询时保存筛选/排序后的 DataFrame 及源文件状态，后续页通过游标按偏移切片，只把当前页转换为记录；
+    结果集超过存活时间或数量上限，或源文件在此之后被修改时被丢弃。
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[pd.DataFrame, str, Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _file_state(source: str) -> Optional[Tuple[int, int, int]]:
+        """源文件的大小、修改时间与 inode；写入工具都会原子替换文件，三者不变即内容未变。"""
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def store(self, df: pd.DataFrame, source: str) -> str:
+        result_id = uuid.uuid4().hex
+        state = self._file_state(source)
+        with self._lock:
+            self._expire()
+            self._entries[result_id] = (df, source, state, time.monotonic() + self.ttl_seconds)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result_id
+
+    def load(self, result_id: str, source: str) -> pd.DataFrame:
+        state = self._file_state(source)
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(result_id)
+            if entry is None:
+                raise CursorError("游标对应的结果集已过期，请重新查询", "CURSOR_EXPIRED")
+            df, entry_source, entry_state, _ = entry
+            if entry_source != source:
+                raise CursorError(f"游标不属于文件 {source}")
+            if entry_state is None or entry_state != state:
+                del self._entries[result_id]
+                raise CursorError("文件在首次查询之后已被修改，游标已失效，请重新查询", "CURSOR_EXPIRED")
+            # 续期：正在翻页的结果集不应中途过期
+            self._entries[result_id] = (df, entry_source, entry_state, time.monotonic() + self.ttl_seconds)
+        return df
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for result_id in [rid for rid, (_, _, _, expires_at) in self._entries.items() if expires_at <= now]:
+            del self._entries[result_id]
+
+
+_result_sets = ResultSetCache(RESULT_SET_TTL_SECONDS, RESULT_SET_MAX_ENTRIES)
+
+
+def encode_cursor(result_id: str, offset: int, page_size: int) -> str:
+    payload = json.dumps({"r": result_id, "o": offset, "n": page_size}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int, int]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(payload["r"]), int(payload["o"]), int(payload["n"])
+    except Exception:
+        raise CursorError(f"无法解析游标: {cursor}")
+
+
+def resume_result_set(cursor: str, source: str) -> Tuple[pd.DataFrame, int, int, str]:
+    """根据游标取回结果集，返回 (结果集, 偏移量, 页大小, 结果集 ID)。"""
+    result_id, offset, page_size = decode_cursor(cursor)
+    return _result_sets.load(result_id, source), offset, page_size, result_id
+
+
+def paginate_dataframe(
+    df: pd.DataFrame, source: str, page_size: Optional[int], offset: int = 0, result_id: Optional[str] = None
+) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    截取一页数据，并在还有剩余行时生成下一页游标。
+
+    Args:
+        df (pd.DataFrame): 完整结果集。
+        source (str): 结果集所属文件，用于校验游标。
+        page_size (Optional[int]): 页大小，None 表示使用默认页大小。
+        offset (int): 当前页起始行。
+        result_id (Optional[str]): 已缓存结果集的 ID；首页时为 None，需要翻页时才写入缓存。
+
+    Returns:
+        Tuple[pd.DataFrame, Dict[str, Any]]: 当前页数据与分页信息。
+    """
+    if page_size is None:
+        page_size = DEFAULT_PAGE_SIZE
+    if page_size <= 0:
+        raise CursorError("page_size 必须为正整数", "INVALID_PAGE_SIZE")
+    page = df.iloc[offset : offset + page_size]
+    next_offset = offset + len(page)
+    has_more = next_offset < len(df)
+    next_cursor = None
+    if has_more:
+        result_id = result_id or _result_sets.store(df, source)
+        next_cursor = encode_cursor(result_id, next_offset, page_size)
+    return page, {"offset": offset, "returned_rows": len(page), "has_more": has_more, "next_cursor": next_cursor}
+
+
+# 结果编码：records 为逐行字典（默认），columnar 只输出一次列名，csv / markdown 为文本表格
+OUTPUT_FORMATS = ["records", "columnar", "csv", "markdown"]
+
+
+class OutputFormatError(ValueError):
+    """结果编码参数不合法。"""
+
+    def __init__(self, message: str, error_code: str = "INVALID_OUTPUT_FORMAT"):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+def normalize_output_options(output_format: Optional[str], precision: Optional[int]) -> Tuple[str, Optional[int]]:
+    """校验并规范化结果编码参数，返回 (格式, 小数位数)。"""
+    output_format = (output_format or "records").lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise OutputFormatError(f"不支持的结果格式: {output_format}，支持: {', '.join(OUTPUT_FORMATS)}")
+    if precision is not None and (isinstance(precision, bool) or not isinstance(precision, int) or precision < 0):
+        raise OutputFormatError("precision 必须为非负整数", "INVALID_PRECISION")
+    return output_format, precision
+
+
+def get_datetime_unit(values: np.ndarray) -> str:
+    """返回能无损表示整列日期时间的最粗单位：全是整日时只输出日期，否则精确到秒/毫秒/微秒/纳秒。"""
+    ticks = values.astype("datetime64[ns]").view("int64")
+    for unit, nanoseconds in (("D", 86_400_000_000_000), ("s", 1_000_000_000), ("ms", 1_000_000), ("us", 1_000)):
+        if not (ticks % nanoseconds).any():
+            return unit
+    return "ns"
+
+
+def column_to_json_values(series: pd.Series) -> List[Any]:
+    """
+    把一列转换为可直接 JSON 序列化的 Python 值列表。
+
+    按列整体转换：数值列用 ndarray.tolist()，日期列用 np.datetime_as_string 生成 ISO 8601 文本，
+    缺失值统一为 None，避免 to_dict 逐个单元格装箱为 NumPy 标量 / Timestamp 再由 JSON 层二次转换。
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # 字典编码列只转换各类别一次，再按整数编码取值（编码 -1 对应末尾的 None）
+        lookup = np.array(column_to_json_values(pd.Series(series.cat.categories)) + [None], dtype=object)
+        return lookup[series.cat.codes.to_numpy()].tolist()
+    values = series.to_numpy()
+    kind = values.dtype.kind
+    if kind == "M":
+        missing = np.isnat(values)
+        result = np.datetime_as_string(values, unit=get_datetime_unit(values[~missing])).astype(object)
+    elif kind in "iub":
+        return values.tolist()
+    elif kind == "f":
+        missing = np.isnan(values)
+        result = values
+    else:
+        missing = series.isna().to_numpy()
+        result = series.astype(str) if kind == "m" else series
+    result = result.tolist()
+    for position in np.flatnonzero(missing).tolist():
+        result[position] = None
+    return result
+
+
+def encode_rows(df: pd.DataFrame, output_format: str = "records", precision: Optional[int] = None) -> Any:
+    """
+    按指定格式编码一页结果，作为响应中的 data 字段。
+
+    Args:
+        df (pd.DataFrame): 当前页数据。
+        output_format (str): records（逐行字典）、columnar（二维数组，列名见响应的 columns）、csv 或 markdown。
+        precision (Optional[int]): 浮点列保留的小数位数，None 表示不做舍入。
+
+    Returns:
+        Any: records 为字典列表，columnar 为行数组列表，csv / markdown 为字符串。
+    """
+    started = time.perf_counter()
+    try:
+        if precision is not None:
+            df = df.round(precision)
+        if output_format == "csv":
+            return df.to_csv(index=False, lineterminator="\n")
+        columns = [column_to_json_values(df.iloc[:, position]) for position in range(df.shape[1])]
+        if output_format == "records":
+            names = df.columns.tolist()
+            return [dict(zip(names, row)) for row in zip(*columns)] if columns else [{} for _ in range(len(df))]
+        rows = [list(row) for row in zip(*columns)] if columns else [[] for _ in range(len(df))]
+        if output_format == "columnar":
+            return rows
+
+        def markdown_cell(value: Any) -> str:
+            text = "" if value is None else str(value)
+            return text.replace("|", "\\|").replace("\r\n", " ").replace("\n", " ")
+
+        lines = [
+            "| " + " | ".join(markdown_cell(column) for column in df.columns) + " |",
+            "| " + " | ".join("---" for _ in df.columns) + " |",
+        ]
+        lines.extend("| " + " | ".join(markdown_cell(value) for value in row) + " |" for row in rows)
+        return "\n".join(lines)
+    finally:
+        record_serialize(started)
+
+
+def get_sort_rank_key(series: pd.Series, ascending: bool) -> np.ndarray:
+    """
+    把排序列转换为 float64 排序键：值越小排序越靠前，缺失值为 +inf（与 sort_values 一样排在最后）。
+
+    非数值列按排序后的唯一值编码，只需对唯一值排序。
+    """
+    if pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+        values = series.to_numpy(dtype="float64", na_value=np.nan)
+    elif pd.api.types.is_datetime64_any_dtype(series.dtype):
+        values = series.to_numpy(dtype="datetime64[ns]").view("int64").astype("float64")
+    else:
+        values = pd.factorize(series, sort=True)[0].astype("float64")
+    key = values if ascending else -values
+    key[series.isna().to_numpy()] = np.inf
+    return key
+
+
+def get_sort_index_name(sort_cols: List[str], asc: List[bool]) -> str:
+    """排序置换在缓存条目中的名称。"""
+    return "sort:" + json.dumps([sort_cols, asc], ensure_ascii=False)
+
+
+def get_sort_permutation(
+    df: pd.DataFrame, sort_cols: List[str], asc: List[bool], cache_key: Optional[Tuple[Any, ...]]
+) -> np.ndarray:
+    """返回按 sort_cols 稳定排序后的行位置数组，并挂到缓存条目上供后续查询直接复用。"""
+    name = get_sort_index_name(sort_cols, asc)
+    permutation = _dataframe_cache.get_derived(cache_key, df, name) if cache_key else None
+    if permutation is None:
+        permutation = df.reset_index(drop=True).sort_values(by=sort_cols, ascending=asc, kind="stable").index.to_numpy()
+        if cache_key:
+            _dataframe_cache.put_derived(cache_key, df, name, permutation, permutation.nbytes)
+    return permutation
+
+
+def select_top_rows(
+    df: pd.DataFrame,
+    sort_cols: List[str],
+    asc: List[bool],
+    top_n: Optional[int],
+    cache_key: Optional[Tuple[Any, ...]] = None,
+) -> pd.DataFrame:
+    """
+    返回排序后的前 top_n 行（top_n 为 None 时返回全部），结果与稳定排序后 head(top_n) 一致。
+
+    - 已缓存排序置换时直接按置换取行；
+    - 同一排序第一次查询小 top_n 时做部分选择：单个数值列用 nsmallest/nlargest，否则用 np.partition
+      找出首列的第 top_n 个值作为阈值，只对不超过阈值的候选行排序；
+    - 同一排序被重复查询或需要完整排序时，计算并缓存排序置换。
+    """
+    name = get_sort_index_name(sort_cols, asc)
+    if cache_key and _dataframe_cache.get_derived(cache_key, df, name) is not None:
+        return df.iloc[get_sort_permutation(df, sort_cols, asc, cache_key)[:top_n]]
+
+    repeated = bool(cache_key) and _dataframe_cache.get_derived(cache_key, df, f"{name}:seen") is not None
+    if top_n is None or top_n * 4 >= len(df) or repeated:
+        return df.iloc[get_sort_permutation(df, sort_cols, asc, cache_key)[:top_n]]
+    if cache_key:
+        _dataframe_cache.put_derived(cache_key, df, f"{name}:seen", True)
+
+    first_col = df[sort_cols[0]]
+    is_numeric = pd.api.types.is_numeric_dtype(first_col.dtype) and not pd.api.types.is_bool_dtype(first_col.dtype)
+    if len(sort_cols) == 1 and is_numeric:
+        picked = df.nsmallest(top_n, sort_cols[0]) if asc[0] else df.nlargest(top_n, sort_cols[0])
+        if len(picked) < top_n:
+            # nsmallest/nlargest 会丢弃缺失值，排序时缺失值排在最后
+            picked = pd.concat([picked, df[first_col.isna()].head(top_n - len(picked))])
+        return picked
+
+    key = get_sort_rank_key(first_col, asc[0])
+    threshold = np.partition(key, top_n - 1)[top_n - 1]
+    candidates = df[key <= threshold]
+    return candidates.sort_values(by=sort_cols, ascending=asc, kind="stable").head(top_n)
+
+
+def select_top_rows_chunked(full_path: Path, sort_cols: List[str], asc: List[bool], top_n: int) -> pd.DataFrame:
+    """select_top_rows 的 CSV 分块版本：每读入一块，与已有的前 top_n 行合并后重新选出前 top_n 行。"""
+    top = None
+    for chunk in iter_csv_chunks(full_path):
+        top = select_top_rows(chunk if top is None else pd.concat([top, chunk]), sort_cols, asc, top_n)
+    return top if top is not None else pd.DataFrame(columns=read_csv_columns(full_path))
+
+
+def rewrite_csv_in_chunks(
+    full_path: Path,
+    columns: List[str],
+    transform: Callable[[pd.DataFrame], pd.DataFrame],
+    should_commit: Callable[[], bool] = lambda: True,
+) -> int:
+    """
+    逐块读取 CSV、经 transform 处理后写入临时文件，再原子替换原文件。
+
+    Args:
+        columns (List[str]): 输出文件的表头（即使所有行都被删除也会写出）。
+        transform (Callable): 处理单个块，返回要保留的数据。
+        should_commit (Callable): 全部块处理完后调用；返回 False 时放弃写入，原文件保持不变。
+
+    Returns:
+        int: 写出的行数。
+    """
+    tmp_path = get_temp_path(full_path)
+    written_rows = 0
+    try:
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            pd.DataFrame(columns=columns).to_csv(f, index=False)
+            for chunk in iter_csv_chunks(full_path):
+                chunk = transform(chunk)
+                chunk.to_csv(f, index=False, header=False)
+                written_rows += len(chunk)
+        if should_commit():
+            replace_atomic(tmp_path, full_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return written_rows
+
+
+def compile_delete_criteria(condition: Dict[str, Any]) -> List[Tuple[Dict[str, Any], str]]:
+    """
+    把删除条件编译为若干表达式树，返回 [(表达式树, 描述)]。
+
+    与筛选不同，删除条件顶层的多个键之间为 OR（满足任一条件的行都会被删除），与原有行为保持一致；
+    每个键的写法与 read_range_sheet_data 相同（等值、列表即 in、{"op": ...}、and/or 组合）。
+
+    Raises:
+        ConditionError: 条件格式不合法时抛出。
+    """
+    if not isinstance(condition, dict) or not condition:
+        raise ConditionError(f"删除条件必须为非空字典: {condition}")
+
+    criteria = []
+    for key, value in condition.items():
+        node = normalize_condition({key: value})
+        if "column" not in node:
+            label = f"满足条件 {json.dumps({key: value}, ensure_ascii=False, default=str)}"
+        elif node["op"] == "==":
+            label = f"列 {key} 中值为 {value}"
+        else:
+            label = f"列 {key} {node['op']} {node['value']}"
+        criteria.append((node, label))
+    return criteria
+
+
+def build_delete_mask(
+    df: pd.DataFrame,
+    row_positions: np.ndarray,
+    criteria: List[Tuple[Dict[str, Any], str]],
+    matched: List[int],
+    newly_deleted: List[int],
+) -> np.ndarray:
+    """
+    把行号和全部删除条件合成一个布尔掩码（True 表示删除），整表只计算一次。
+
+    df 的索引须为其在文件中的行号。matched / newly_deleted 按条件累加：
+    条件匹配的行数，以及其中未被行号或前面的条件删除、由该条件新增删除的行数（分块处理时逐块累加）。
+    """
+    mask = np.isin(df.index.to_numpy(), row_positions)
+    for i, (node, _) in enumerate(criteria):
+        condition_mask = build_condition_mask(df, node)
+        matched[i] += int(condition_mask.sum())
+        newly_deleted[i] += int((condition_mask & ~mask).sum())
+        mask |= condition_mask
+    return mask
+
+
+def delete_from_csv_chunked(
+    full_path: Path,
+    row_positions: List[int],
+    columns_to_delete: List[str],
+    criteria: List[Tuple[Dict[str, Any], str]],
+    remaining_columns: List[str],
+    operation: List[str],
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """
+    delete_excel_row_or_column 的大 CSV 分支：逐块计算删除掩码，一次过滤行和列后写回文件。
+
+    任一条件没有匹配的行时不修改文件，返回与整表处理一致的警告；dry_run 时只读取条件列统计删除行数。
+    """
+    row_positions = np.unique(np.asarray(row_positions, dtype=np.int64))
+    matched = [0] * len(criteria)
+    newly_deleted = [0] * len(criteria)
+    counts = {"total": 0, "deleted": 0}
+
+    def drop_rows(chunk: pd.DataFrame) -> pd.DataFrame:
+        mask = build_delete_mask(chunk, row_positions, criteria, matched, newly_deleted)
+        counts["total"] += len(chunk)
+        counts["deleted"] += int(mask.sum())
+        return chunk.iloc[np.flatnonzero(~mask), np.flatnonzero(~chunk.columns.isin(columns_to_delete))]
+
+    def all_conditions_matched() -> bool:
+        return all(matched)
+
+    if dry_run:
+        condition_columns = []
+        for node, _ in criteria:
+            condition_columns.extend(c for c in get_condition_columns(node) if c not in condition_columns)
+        for chunk in iter_csv_chunks(full_path, condition_columns or read_csv_columns(full_path)[:1]):
+            drop_rows(chunk)
+    else:
+        _dataframe_cache.invalidate(full_path)
+        rewrite_csv_in_chunks(full_path, remaining_columns, drop_rows, all_conditions_matched)
+
+    unmatched = [label for (_, label), n in zip(criteria, matched) if n == 0]
+    if unmatched:
+        return {"status": "warning", "message": f"未找到{unmatched[0]} 的行", "error_code": "NO_MATCHING_ROWS"}
+
+    operation = operation + [f"{n} 行（{label}）" for (_, label), n in zip(criteria, newly_deleted)]
+    return get_delete_result(
+        full_path, None, operation, counts["deleted"], columns_to_delete, counts["total"] - counts["deleted"], dry_run
+    )
+
+
+def get_delete_result(
+    full_path: Path,
+    sheet_name: Optional[str],
+    operation: List[str],
+    deleted_rows: int,
+    deleted_columns: List[str],
+    remaining_rows: int,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """生成 delete_excel_row_or_column 的成功结果（dry_run 时说明文件未被修改）。"""
+    target = f"工作表 {sheet_name} " if sheet_name is not None else " CSV 文件"
+    if dry_run:
+        message = f"预计从{target}删除 {', '.join(operation)}（dry_run，未修改文件）"
+    else:
+        message = f"成功从{target}删除 {', '.join(operation)}"
+    result = {"status": "success", "message": message, "file_path": str(full_path)}
+    if sheet_name is not None:
+        result["sheet_name"] = sheet_name
+    result.update(
+        {
+            "operations": operation,
+            "deleted_rows": deleted_rows,
+            "deleted_columns": deleted_columns,
+            "remaining_rows": remaining_rows,
+            "dry_run": dry_run,
+        }
+    )
+    return result
+
+
+def read_csv_header(full_path: Path) -> List[str]:
+    """只读取 CSV 文件的表头行作为列名（跳过 get_column_names 记录的表头前的行）。"""
+    skiprows = get_header_skiprows(full_path, None)
+    with open(full_path, "r", encoding="utf-8-sig", newline="") as f:
+        header = next(itertools.islice(csv.reader(f), skiprows, None), None)
+    if not header:
+        raise pd.errors.EmptyDataError(f"CSV 文件 {full_path} 没有表头")
+    return header
+
+
+def append_rows_to_csv(full_path: Path, header: List[str], rows: List[Dict[str, Any]], fsync: bool = False) -> None:
+    """
+    以追加模式把新行写到 CSV 文件末尾，开销只与新增行数有关，与文件大小无关。
+
+    Args:
+        full_path (Path): CSV 文件的绝对路径。
+        header (List[str]): 文件现有列名，新行按此顺序写出，缺失的键写为空值。
+        rows (List[Dict[str, Any]]): 待追加的行。
+        fsync (bool): 是否在返回前调用 fsync 确保数据落盘。
+    """
+    # 文件末尾缺少换行符时先补一个，避免新行拼接到最后一行上
+    needs_newline = False
+    with open(full_path, "rb") as f:
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+
+    with open(full_path, "a", encoding="utf-8", newline="") as f:
+        if needs_newline:
+            f.write("\n")
+        writer = csv.writer(f, lineterminator="\n")
+        for row in rows:
+            values = (row.get(col) for col in header)
+            writer.writerow(
+                ["" if value is None or (isinstance(value, float) and np.isnan(value)) else value for value in values]
+            )
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def get_line_index_path(full_path: Path) -> Path:
+    """返回 CSV 行偏移索引（二进制 uint64 数组）的路径，与 Parquet 旁路文件放在同一目录。"""
+    sidecar_path = get_sidecar_path(full_path, None)
+    return sidecar_path.with_name(sidecar_path.name.replace(".parquet", ".lines.idx"))
+
+
+def build_line_index(full_path: Path, skiprows: int = 0) -> np.ndarray:
+    """
+    内存映射扫描 CSV 文件，生成每条数据记录的字节范围。
+
+    引号内的换行不作为记录边界（按引号奇偶判断，"" 转义不影响奇偶）；空行与 pandas 一样不计为数据行。
+    表头为跳过 skiprows 条记录后的第一条非空记录。
+
+    Returns:
+        np.ndarray: uint64 数组 [表头起点, 表头终点, 第 0..n-1 行起点..., 第 0..n-1 行终点...]，终点不含（指向换行符之后）。
+    """
+    size = full_path.stat().st_size
+    if size == 0:
+        raise pd.errors.EmptyDataError(f"CSV 文件 {full_path} 为空")
+    with open(full_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = np.frombuffer(mm, dtype=np.uint8)
+        boundaries = []
+        quote_parity = 0
+        for start in range(0, size, CSV_BLOCK_BYTES):
+            block = data[start : start + CSV_BLOCK_BYTES]
+            newlines = np.flatnonzero(block == ord("\n"))
+            quotes = np.flatnonzero(block == ord('"'))
+            if len(quotes):
+                newlines = newlines[(quote_parity + np.searchsorted(quotes, newlines)) % 2 == 0]
+                quote_parity = (quote_parity + len(quotes)) % 2
+            boundaries.append(newlines.astype(np.uint64) + np.uint64(start + 1))
+        ends = np.concatenate(boundaries)
+        if not len(ends) or ends[-1] != size:
+            ends = np.append(ends, np.uint64(size))
+        starts = np.concatenate([np.zeros(1, dtype=np.uint64), ends[:-1]])
+        # 空行：只有 \n 或 \r\n（文件末尾可能没有换行符，长度为 0）
+        lengths = ends - starts
+        blank = lengths <= 1
+        candidates = np.flatnonzero(lengths == 2)
+        blank[candidates] = data[starts[candidates]] == ord("\r")
+        del data, block
+    blank[:skiprows] = True
+    non_blank = np.flatnonzero(~blank)
+    if not len(non_blank):
+        raise pd.errors.EmptyDataError(f"CSV 文件 {full_path} 没有表头")
+    header = non_blank[0]
+    rows = non_blank[1:]
+    return np.concatenate([[starts[header], ends[header]], starts[rows], ends[rows]]).astype(np.uint64)
+
+
+def get_line_index(full_path: Path) -> Tuple[Tuple[int, int], np.ndarray, np.ndarray]:
+    """
+    返回 CSV 的 (表头字节范围, 各数据行起点, 各数据行终点)。
+
+    索引按文件指纹记录在元数据索引中，文件未变化时以内存映射方式直接读取持久化的索引，只在首次使用或文件修改后重建。
+    """
+    skiprows = get_header_skiprows(full_path, None)
+    index = load_metadata_index(full_path)
+    index_path = get_line_index_path(full_path)
+    meta = index.get("line_index")
+    offsets = None
+    if meta is not None and meta["skiprows"] == skiprows:
+        try:
+            offsets = np.memmap(index_path, dtype=np.uint64, mode="r")
+            if len(offsets) != 2 + 2 * meta["rows"]:
+                offsets = None
+        except (OSError, ValueError):
+            offsets = None
+    if offsets is None:
+        offsets = build_line_index(full_path, skiprows)
+        save_line_index(full_path, offsets, skiprows, index)
+    row_count = (len(offsets) - 2) // 2
+    return (int(offsets[0]), int(offsets[1])), offsets[2 : 2 + row_count], offsets[2 + row_count :]
+
+
+def save_line_index(
+    full_path: Path, offsets: np.ndarray, skiprows: int, index: Optional[Dict[str, Any]] = None
+) -> None:
+    """持久化行偏移索引，并在元数据索引中登记（随文件指纹一起失效）；失败时忽略，下次重新扫描。"""
+    if not SIDECAR_ENABLED:
+        return
+    index = index if index is not None else load_metadata_index(full_path)
+    index_path = get_line_index_path(full_path)
+    tmp_path = index_path.with_name(index_path.name + ".tmp")
+    try:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        np.asarray(offsets, dtype=np.uint64).tofile(tmp_path)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        return
+    index["line_index"] = {"skiprows": skiprows, "rows": (len(offsets) - 2) // 2}
+    save_metadata_index(full_path, index)
+
+
+def read_csv_row_range(full_path: Path, start: int, stop: int) -> pd.DataFrame:
+    """
+    通过行偏移索引直接定位并解析第 start..stop-1 行（0 起始，与 DataFrame 行号一致），其余行不读取。
+
+    列类型只根据读取到的行推断；返回的 DataFrame 行索引为原文件中的行号。
+    """
+    started = time.perf_counter()
+    (header_start, header_end), starts, ends = get_line_index(full_path)
+    stop = min(stop, len(starts))
+    with open(full_path, "rb") as f:
+        f.seek(header_start)
+        header = f.read(header_end - header_start)
+        body = b""
+        if start < stop:
+            f.seek(int(starts[start]))
+            body = f.read(int(ends[stop - 1]) - int(starts[start]))
+    if not header.endswith(b"\n"):
+        header += b"\n"
+    df = pd.read_csv(io.BytesIO(header + body), encoding="utf-8")
+    df.index = pd.RangeIndex(start, start + len(df))
+    record_parse(started, len(df))
+    return df
+
+
+def delete_csv_rows_by_offset(full_path: Path, positions: List[int]) -> int:
+    """
+    按行偏移索引删除 CSV 中的若干数据行：只按字节范围拼接保留的部分，其他行不经过 pandas 解码。
+
+    写入临时文件后原子替换，并同步平移、保存新文件的行偏移索引。
+
+    Returns:
+        int: 删除后剩余的数据行数。
+    """
+    (header_start, header_end), starts, ends = get_line_index(full_path)
+    starts, ends = np.array(starts), np.array(ends)
+    deleted = np.unique(np.asarray(positions, dtype=np.int64))
+    size = full_path.stat().st_size
+
+    tmp_path = get_temp_path(full_path)
+    try:
+        with open(full_path, "rb") as src, open(tmp_path, "wb") as dst:
+            cursor = 0
+            for position in deleted.tolist():
+                copy_byte_range(src, dst, cursor, int(starts[position]))
+                cursor = int(ends[position])
+            copy_byte_range(src, dst, cursor, size)
+        replace_atomic(tmp_path, full_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    # 保留行的新偏移 = 原偏移 - 之前被删除的字节数
+    removed_bytes = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(ends[deleted] - starts[deleted])])
+    keep = np.ones(len(starts), dtype=bool)
+    keep[deleted] = False
+    shift = removed_bytes[np.searchsorted(deleted, np.flatnonzero(keep))]
+    header = np.array([header_start, header_end], dtype=np.uint64)
+    offsets = np.concatenate([header, starts[keep] - shift, ends[keep] - shift])
+    save_line_index(full_path, offsets, get_header_skiprows(full_path, None))
+    return int(keep.sum())
+
+
+def copy_byte_range(src: Any, dst: Any, start: int, stop: int) -> None:
+    """把 src 中 [start, stop) 的字节分块复制到 dst。"""
+    src.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+        chunk = src.read(min(remaining, CSV_BLOCK_BYTES))
+        if not chunk:
+            break
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def to_cell_value(value: Any) -> Any:
+    """把 pandas/NumPy 标量转换为 openpyxl 可写入的单元格值，缺失值写为空单元格。"""
+    if value is None or (not isinstance(value, (str, bytes, list, dict)) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def load_worksheet(full_path: Path, sheet_name: str) -> Tuple[Any, Any]:
+    """
+    以可写模式打开工作簿并返回 (workbook, worksheet)，其他工作表原样保留。
+
+    Raises:
+        ValueError: 工作表不存在时抛出。
+    """
+    workbook = openpyxl.load_workbook(full_path)
+    if sheet_name not in workbook.sheetnames:
+        raise ValueError(f"Worksheet named '{sheet_name}' not found")
+    return workbook, workbook[sheet_name]
+
+
+def get_worksheet_layout(worksheet: Any, header_row: int = 1) -> Tuple[List[Any], List[int]]:
+    """
+    返回表头（第 header_row 行，1 起始）与其后全部非空数据行的行号。
+
+    pandas 读取时会跳过整行为空的行，因此第 i 条记录对应 data_rows[i]，不能简单按 i + header_row + 1 计算。
+    """
+    header = [cell.value for cell in next(worksheet.iter_rows(min_row=header_row, max_row=header_row), ())]
+    while header and header[-1] is None:
+        header.pop()
+    data_rows = [
+        row_idx
+        for row_idx, values in enumerate(
+            worksheet.iter_rows(min_row=header_row + 1, values_only=True), start=header_row + 1
+        )
+        if any(value is not None for value in values)
+    ]
+    return header, data_rows
+
+
+def append_rows_to_worksheet(
+    full_path: Path, sheet_name: str, rows: List[Dict[str, Any]], header_row: int = 1
+) -> Tuple[List[Any], Optional[int]]:
+    """
+    在工作表最后一条数据之后写入新行，只触及新增的单元格。header_row 为表头所在行（1 起始）。
+
+    Returns:
+        Tuple[List[Any], Optional[int]]: 表头，以及写入后的数据总行数；列名不匹配时总行数为 None 且不写入。
+    """
+    workbook, worksheet = load_worksheet(full_path, sheet_name)
+    header, data_rows = get_worksheet_layout(worksheet, header_row)
+    if set(key for row in rows for key in row) != set(header):
+        return header, None
+
+    next_row = (data_rows[-1] if data_rows else header_row) + 1
+    for offset, row in enumerate(rows):
+        for col_idx, col in enumerate(header, start=1):
+            worksheet.cell(row=next_row + offset, column=col_idx, value=to_cell_value(row.get(col)))
+    save_workbook_atomic(workbook, full_path)
+    return header, len(data_rows) + len(rows)
+
+
+def write_columns_to_worksheet(
+    full_path: Path, sheet_name: str, columns: Dict[str, List[Any]], header_row: int = 1
+) -> None:
+    """
+    写入整列数据：已存在的列原位覆盖，新列追加在表头末尾。
+
+    Args:
+        columns (Dict[str, List[Any]]): 列名到取值列表的映射，取值与数据行一一对应。
+        header_row (int): 表头所在行（1 起始）。
+    """
+    workbook, worksheet = load_worksheet(full_path, sheet_name)
+    header, data_rows = get_worksheet_layout(worksheet, header_row)
+    for name, values in columns.items():
+        if name in header:
+            col_idx = header.index(name) + 1
+        else:
+            header.append(name)
+            col_idx = len(header)
+            worksheet.cell(row=header_row, column=col_idx, value=name)
+        for row_idx, value in zip(data_rows, values):
+            worksheet.cell(row=row_idx, column=col_idx, value=to_cell_value(value))
+    save_workbook_atomic(workbook, full_path)
+
+
+def delete_from_worksheet(
+    full_path: Path,
+    sheet_name: str,
+    row_positions: List[int],
+    column_names: Optional[List[Any]] = None,
+    header_row: int = 1,
+) -> None:
+    """
+    在工作表中删除数据行（按 0 起始的记录位置）和整列，其余单元格与其他工作表保持不变。
+
+    header_row 为表头所在行（1 起始）。
+    """
+    workbook, worksheet = load_worksheet(full_path, sheet_name)
+    header, data_rows = get_worksheet_layout(worksheet, header_row)
+
+    for col_idx in sorted((header.index(name) + 1 for name in column_names or []), reverse=True):
+        worksheet.delete_cols(col_idx)
+    delete_worksheet_rows(worksheet, [data_rows[pos] for pos in row_positions])
+    save_workbook_atomic(workbook, full_path)
+
+
+def delete_worksheet_rows(worksheet: Any, excel_rows: List[int]) -> None:
+    """按 Excel 行号（1 起始）删除整行：连续的行合并为一次 delete_rows 调用，并从下往上删除，避免行号错位。"""
+    excel_rows = sorted(excel_rows, reverse=True)
+    run_start, run_length = None, 0
+    for row_idx in excel_rows:
+        if run_start is not None and row_idx == run_start - 1:
+            run_start, run_length = row_idx, run_length + 1
+            continue
+        if run_start is not None:
+            worksheet.delete_rows(run_start, run_length)
+        run_start, run_length = row_idx, 1
+    if run_start is not None:
+        worksheet.delete_rows(run_start, run_length)
+
+
+def write_frame_to_worksheet(worksheet: Any, df: pd.DataFrame, header_row: int = 1) -> None:
+    """
+    把 df 原位写回第 header_row 行（1 起始）的表头及其下方的数据区，表头之上的行保持不变。
+
+    只改写单元格的值，原有的字体、数字格式和列宽都保留；多出的旧数据行整行删除，多出的旧列清空表头及以下的单元格。
+    """
+    for col_idx, name in enumerate(df.columns, start=1):
+        cell = worksheet.cell(row=header_row, column=col_idx)
+        # pandas 为空表头生成的 "Unnamed: n" 不写回
+        if not (cell.value is None and str(name).startswith("Unnamed: ")):
+            cell.value = name
+    for row_idx, values in enumerate(df.itertuples(index=False, name=None), start=header_row + 1):
+        for col_idx, value in enumerate(values, start=1):
+            # worksheet.cell(value=None) 不会清空单元格，需直接赋值
+            worksheet.cell(row=row_idx, column=col_idx).value = to_cell_value(value)
+
+    last_row = header_row + len(df)
+    if worksheet.max_column > df.shape[1]:
+        for row in worksheet.iter_rows(min_row=header_row, max_row=last_row, min_col=df.shape[1] + 1):
+            for cell in row:
+                cell.value = None
+    if worksheet.max_row > last_row:
+        worksheet.delete_rows(last_row + 1, worksheet.max_row - last_row)
+
+
+def apply_edits_to_worksheet(
+    full_path: Path,
+    sheet_name: str,
+    columns: List[Any],
+    edits: List[Optional[Dict[str, Any]]],
+    df: pd.DataFrame,
+    header_row: int = 1,
+) -> None:
+    """
+    把 apply_operations 各步的修改依次应用到工作表，最后只保存一次；表头之上的行、单元格格式和其他工作表保持不变。
+
+    Args:
+        columns (List[Any]): 执行前 DataFrame 的列名，与工作表的列按位置一一对应。
+        edits (List[Optional[Dict[str, Any]]]): 各步的修改，键为 append_rows（追加的行）、columns（整列写入）、
+            update_rows/values（把指定行的列改为新值）、delete_rows/delete_columns（删除的行位置和列名）。
+            排序会移动整行，记为 None，此时改为用执行后的 df 原位重写表头及以下的数据区。
+        df (pd.DataFrame): 全部操作执行后的数据。
+        header_row (int): 表头所在行（1 起始）。
+    """
+    workbook, worksheet = load_worksheet(full_path, sheet_name)
+    if any(edit is None for edit in edits):
+        write_frame_to_worksheet(worksheet, df, header_row)
+        save_workbook_atomic(workbook, full_path)
+        return
+
+    columns = list(columns)
+    _, data_rows = get_worksheet_layout(worksheet, header_row)
+    for edit in edits:
+        if "append_rows" in edit:
+            next_row = (data_rows[-1] if data_rows else header_row) + 1
+            for row_idx, values in enumerate(edit["append_rows"].itertuples(index=False, name=None), start=next_row):
+                for col_idx, value in enumerate(values, start=1):
+                    worksheet.cell(row=row_idx, column=col_idx).value = to_cell_value(value)
+                data_rows.append(row_idx)
+        for name, values in edit.get("columns", {}).items():
+            if name not in columns:
+                columns.append(name)
+                worksheet.cell(row=header_row, column=len(columns)).value = name
+            col_idx = columns.index(name) + 1
+            for row_idx, value in zip(data_rows, values):
+                worksheet.cell(row=row_idx, column=col_idx).value = to_cell_value(value)
+        for name, value in edit.get("values", {}).items():
+            col_idx = columns.index(name) + 1
+            for pos in edit["update_rows"]:
+                worksheet.cell(row=data_rows[pos], column=col_idx).value = to_cell_value(value)
+        if "delete_rows" in edit:
+            removed = sorted(data_rows[pos] for pos in edit["delete_rows"])
+            delete_worksheet_rows(worksheet, removed)
+            removed_set = set(removed)
+            data_rows = [
+                row_idx - bisect.bisect_left(removed, row_idx) for row_idx in data_rows if row_idx not in removed_set
+            ]
+        for col_idx in sorted((columns.index(name) + 1 for name in edit.get("delete_columns", [])), reverse=True):
+            worksheet.delete_cols(col_idx)
+            del columns[col_idx - 1]
+    save_workbook_atomic(workbook, full_path)
+
+
+def get_temp_path(full_path: Path) -> Path:
+    """在目标文件同目录下生成临时文件路径（保留扩展名，openpyxl 依赖扩展名识别格式）。"""
+    return full_path.with_name(f".{full_path.stem}.{uuid.uuid4().hex[:8]}.tmp{full_path.suffix}")
+
+
+def replace_atomic(tmp_path: Path, full_path: Path) -> None:
+    """把写完的临时文件刷到磁盘（fsync）后原子替换目标文件，并同步目录项；中途崩溃时目标文件保持原样。"""
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, full_path)
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(full_path.parent, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def save_workbook_atomic(workbook: Any, full_path: Path) -> None:
+    """openpyxl 工作簿先保存到临时文件，再原子替换原文件。"""
+    tmp_path = get_temp_path(full_path)
+    try:
+        workbook.save(tmp_path)
+        replace_atomic(tmp_path, full_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def write_dataframe_atomic(
+    full_path: Path, sheet_name: Optional[str], df: pd.DataFrame, replace_file: bool = False
+) -> None:
+    """
+    把整张表写入临时文件后再原子替换目标文件，写入中途失败不会损坏原文件。
+
+    Excel 文件先复制原工作簿，再只替换目标工作表，其他工作表保持不变；
+    replace_file=True 时直接生成只包含该工作表的新工作簿。
+    """
+    tmp_path = get_temp_path(full_path)
+    try:
+        if full_path.suffix.lower() == ".csv":
+            df.to_csv(tmp_path, index=False, encoding="utf-8")
+        elif full_path.exists() and not replace_file:
+            shutil.copy2(full_path, tmp_path)
+            with pd.ExcelWriter(tmp_path, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+        else:
+            df.to_excel(tmp_path, sheet_name=sheet_name, index=False, engine="openpyxl")
+        replace_atomic(tmp_path, full_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+class JournalError(ValueError):
+    """撤销操作无法执行（没有可撤销的操作、文件已被外部修改等）。"""
+
+    def __init__(self, message: str, error_code: str = "UNDO_ERROR"):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+def get_journal_path(full_path: Path) -> Path:
+    """返回文件操作日志（JSON Lines）的路径，与 Parquet 旁路文件放在同一目录。"""
+    sidecar_path = get_sidecar_path(full_path, None)
+    return sidecar_path.with_name(sidecar_path.name.replace(".parquet", ".journal.jsonl"))
+
+
+def get_snapshot_path(full_path: Path, name: str) -> Path:
+    """返回撤销快照的路径；name 为日志中记录的快照文件名。"""
+    return get_journal_path(full_path).with_name(name)
+
+
+def summarize_journal_args(value: Any) -> Any:
+    """日志只记录参数摘要：超过 10 个元素的列表记为元素个数，避免日志随写入的数据量增长。"""
+    if isinstance(value, dict):
+        return {k: summarize_journal_args(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return {"items": len(value)} if len(value) > 10 else [summarize_journal_args(v) for v in value]
+    return value
+
+
+def read_journal(full_path: Path) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    读取操作日志，按 seq 合并同一操作的多条记录。
+
+    Returns:
+        Tuple[List[Dict[str, Any]], int]: 仍可撤销的操作（pending/committed，按时间顺序），以及下一个序号。
+    """
+    entries: Dict[int, Dict[str, Any]] = {}
+    next_seq = 1
+    try:
+        with open(get_journal_path(full_path), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时可能留下写了一半的最后一行
+                    continue
+                entries.setdefault(record["seq"], {}).update(record)
+                next_seq = max(next_seq, record["seq"] + 1)
+    except FileNotFoundError:
+        pass
+    live = [entry for _, entry in sorted(entries.items()) if entry.get("status") in ("pending", "committed")]
+    return live, next_seq
+
+
+def append_journal_records(full_path: Path, records: List[Dict[str, Any]]) -> None:
+    """向操作日志追加记录，并在返回前 fsync，保证记录先于文件修改落盘。"""
+    journal_path = get_journal_path(full_path)
+    journal_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(journal_path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def prune_journal(full_path: Path) -> None:
+    """可撤销的操作超过 JOURNAL_MAX_DEPTH 时删除最早的快照，并把日志压缩为仍有效的记录。"""
+    entries, _ = read_journal(full_path)
+    if len(entries) <= JOURNAL_MAX_DEPTH:
+        return
+    expired = entries[: len(entries) - JOURNAL_MAX_DEPTH]
+    for entry in expired:
+        if "snapshot" in entry:
+            get_snapshot_path(full_path, entry["snapshot"]).unlink(missing_ok=True)
+
+    journal_path = get_journal_path(full_path)
+    tmp_path = journal_path.with_name(journal_path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in entries[len(expired) :]:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+    replace_atomic(tmp_path, journal_path)
+
+
+def get_undo_snapshot_name(full_path: Path, seq: int) -> str:
+    """第 seq 步操作的撤销快照文件名：与源文件同扩展名的原始文件副本。"""
+    return get_journal_path(full_path).name.replace(".journal.jsonl", f".undo-{seq}{full_path.suffix.lower()}")
+
+
+def write_undo_snapshot(full_path: Path, seq: int) -> str:
+    """
+    保存修改前的文件，返回快照文件名。
+
+    CSV 与 Excel 的改写都是"临时文件 + 重命名"（CSV 原地追加不生成快照），原文件的 inode 不会被改动，
+    直接建立硬链接即可，不解析、不复制文件内容（跨文件系统时才复制）。
+    """
+    get_journal_path(full_path).parent.mkdir(parents=True, exist_ok=True)
+    snapshot_path = get_snapshot_path(full_path, get_undo_snapshot_name(full_path, seq))
+    try:
+        os.link(full_path, snapshot_path)
+    except OSError:
+        shutil.copy2(full_path, snapshot_path)
+    return snapshot_path.name
+
+
+def get_journal_fingerprint(stat: os.stat_result) -> Dict[str, Any]:
+    """
+    日志记录的文件状态：大小、修改时间与 inode。
+
+    工具的改写都会原子替换文件，写入后 inode 必然变化，三者相同即可判定文件未变，无需计算内容哈希。
+    """
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "ino": stat.st_ino}
+
+
+def resolve_pending_entries(full_path: Path, entries: List[Dict[str, Any]]) -> None:
+    """
+    处理上次崩溃留下的 pending 记录：文件未变化时作废该记录，已变化时按已完成处理（仍可撤销）。
+
+    否则 CSV 的硬链接快照可能被之后的原地追加改动。
+    """
+    stat = full_path.stat()
+    for entry in entries:
+        if entry["status"] != "pending":
+            continue
+        if "csv_offset" in entry:
+            unchanged = stat.st_size == entry["csv_offset"]
+        else:
+            unchanged = get_journal_fingerprint(stat) == entry["before"]
+        if unchanged:
+            abort_journal_entry(full_path, entry)
+        else:
+            after = get_journal_fingerprint(stat)
+            append_journal_records(full_path, [{"seq": entry["seq"], "status": "committed", "after": after}])
+
+
+def begin_journal_entry(
+    full_path: Path,
+    sheet_name: Optional[str],
+    op: str,
+    args: Dict[str, Any],
+    before_row_count: Optional[int] = None,
+    append_only: bool = False,
+) -> Optional[Dict[str, Any]]:
+    """
+    在修改文件之前写入日志记录（write-ahead）：操作名、参数摘要、修改前的行数与文件状态，以及撤销快照。
+
+    append_only 用于 CSV 原地追加：不生成快照，只记录追加前的文件长度，撤销时截断即可。
+    """
+    if not JOURNAL_ENABLED:
+        return None
+    entries, seq = read_journal(full_path)
+    resolve_pending_entries(full_path, entries)
+
+    stat = full_path.stat()
+    entry: Dict[str, Any] = {
+        "seq": seq,
+        "op": op,
+        "sheet_name": get_sheet_key(full_path, sheet_name),
+        "args": summarize_journal_args(args),
+        "before_row_count": before_row_count,
+        "timestamp": time.time(),
+    }
+    if append_only:
+        entry["csv_offset"] = stat.st_size
+    else:
+        entry["before"] = get_journal_fingerprint(stat)
+        entry["snapshot"] = write_undo_snapshot(full_path, seq)
+    append_journal_records(full_path, [{**entry, "status": "pending"}])
+    return entry
+
+
+def commit_journal_entry(full_path: Path, entry: Optional[Dict[str, Any]]) -> None:
+    """修改完成后提交日志记录；文件实际未变化（如校验失败未写入）时作废该记录。"""
+    if entry is None:
+        return
+    after = get_journal_fingerprint(full_path.stat())
+    if "csv_offset" in entry:
+        changed = after["size"] != entry["csv_offset"]
+    else:
+        changed = after != entry["before"]
+    if not changed:
+        abort_journal_entry(full_path, entry)
+        return
+    append_journal_records(full_path, [{"seq": entry["seq"], "status": "committed", "after": after}])
+    prune_journal(full_path)
+
+
+def abort_journal_entry(full_path: Path, entry: Optional[Dict[str, Any]]) -> None:
+    """作废日志记录并删除其快照。"""
+    if entry is None:
+        return
+    append_journal_records(full_path, [{"seq": entry["seq"], "status": "aborted"}])
+    if "snapshot" in entry:
+        get_snapshot_path(full_path, entry["snapshot"]).unlink(missing_ok=True)
+
+
+@contextlib.contextmanager
+def journal_operation(
+    full_path: Path,
+    sheet_name: Optional[str],
+    op: str,
+    args: Dict[str, Any],
+    before_row_count: Optional[int] = None,
+    append_only: bool = False,
+):
+    """把一次文件修改记入操作日志：修改前写入记录与快照，成功后提交，抛出异常时作废。"""
+    entry = begin_journal_entry(full_path, sheet_name, op, args, before_row_count, append_only)
+    try:
+        yield entry
+    except BaseException:
+        abort_journal_entry(full_path, entry)
+        raise
+    commit_journal_entry(full_path, entry)
+
+
+def undo_journal_entry(full_path: Path) -> Tuple[Dict[str, Any], int]:
+    """
+    撤销文件最近一次记录在日志中的操作。
+
+    Returns:
+        Tuple[Dict[str, Any], int]: 被撤销的日志记录，以及剩余可撤销的步数。
+
+    Raises:
+        JournalError: 没有可撤销的操作，或文件在该操作之后被外部修改时抛出。
+    """
+    entries, _ = read_journal(full_path)
+    if not entries:
+        raise JournalError(f"文件 {full_path} 没有可撤销的操作", "NOTHING_TO_UNDO")
+    entry = entries[-1]
+    # pending 记录说明上次修改中途崩溃，直接回滚到修改前的状态
+    if entry["status"] == "committed" and get_journal_fingerprint(full_path.stat()) != entry["after"]:
+        raise JournalError("文件在最近一次操作之后已被其他程序修改，无法安全撤销", "UNDO_CONFLICT")
+
+    _dataframe_cache.invalidate(full_path)
+    if "csv_offset" in entry:
+        with open(full_path, "rb+") as f:
+            f.truncate(entry["csv_offset"])
+            f.flush()
+            os.fsync(f.fileno())
+    else:
+        # 日志与快照所在目录可能被他人写入：只接受按本服务命名规则生成的原始文件快照，不反序列化任何内容
+        if entry["snapshot"] != get_undo_snapshot_name(full_path, entry["seq"]):
+            raise JournalError(f"撤销快照 {entry['snapshot']} 不是本服务生成的文件快照，拒绝恢复", "SNAPSHOT_INVALID")
+        snapshot_path = get_snapshot_path(full_path, entry["snapshot"])
+        if not snapshot_path.exists():
+            raise JournalError(f"撤销快照 {snapshot_path} 不存在", "SNAPSHOT_MISSING")
+        # 快照就是修改前的文件本身，恢复后标题行、格式和其他工作表都与修改前逐字节一致
+        tmp_path = get_temp_path(full_path)
+        try:
+            try:
+                os.link(snapshot_path, tmp_path)
+            except OSError:
+                shutil.copy2(snapshot_path, tmp_path)
+            replace_atomic(tmp_path, full_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    _dataframe_cache.invalidate(full_path)
+
+    records = [{"seq": entry["seq"], "status": "undone"}]
+    if len(entries) > 1:
+        # 恢复后的内容与上一步操作完成时一致，但文件已被替换，更新其状态以便继续撤销
+        records.append(
+            {"seq": entries[-2]["seq"], "status": "committed", "after": get_journal_fingerprint(full_path.stat())}
+        )
+    append_journal_records(full_path, records)
+    if "snapshot" in entry:
+        get_snapshot_path(full_path, entry["snapshot"]).unlink(missing_ok=True)
+    return entry, len(entries) - 1
+
+
+def plan_join_order(input_columns: List[List[str]], sizes: List[int], keys: List[str]) -> List[int]:
+    """
+    为多路外连接确定连接顺序：从最小的表开始，使中间结果尽量小。
+
+    各表的非键列同名时，连接会按顺序添加 _x/_y 后缀，此时保持输入顺序，避免改变结果列名。
+    """
+    seen_columns: set = set()
+    for columns in input_columns:
+        value_columns = set(columns) - set(keys)
+        if seen_columns & value_columns:
+            return list(range(len(input_columns)))
+        seen_columns |= value_columns
+    return sorted(range(len(input_columns)), key=lambda i: sizes[i])
+
+
+def join_frames(frames: List[pd.DataFrame], keys: List[str]) -> pd.DataFrame:
+    """按 plan_join_order 的顺序依次外连接，结果列顺序与输入顺序一致。"""
+    input_columns = [df.columns.tolist() for df in frames]
+    order = plan_join_order(input_columns, [len(df) for df in frames], keys)
+    merged_df = frames[order[0]]
+    for i in order[1:]:
+        merged_df = pd.merge(merged_df, frames[i], on=keys, how="outer")
+    if order != sorted(order):
+        merged_df = merged_df[list(dict.fromkeys(col for columns in input_columns for col in columns))]
+    return merged_df
+
+
+def find_duplicate_columns(df: pd.DataFrame, exclude: List[str]) -> List[str]:
+    """
+    找出与前面某一列内容完全相同的列。
+
+    先按 (dtype, 列内容哈希) 分桶，只在同一桶内用 Series.equals 精确比较，避免对所有列两两比较。
+    """
+    buckets: Dict[Tuple[str, bytes], List[str]] = {}
+    duplicates = []
+    for col in df.columns:
+        if col in exclude:
+            continue
+        series = df[col]
+        column_hash = pd.util.hash_pandas_object(series, index=False).to_numpy()
+        bucket_key = (str(series.dtype), hashlib.blake2b(column_hash.tobytes(), digest_size=16).digest())
+        bucket = buckets.setdefault(bucket_key, [])
+        if any(df[kept].equals(series) for kept in bucket):
+            duplicates.append(col)
+        else:
+            bucket.append(col)
+    return duplicates
+
+
+def iter_input_chunks(full_path: Path, df: Optional[pd.DataFrame], chunk_rows: int):
+    """逐块产出输入数据：未加载的 CSV 按块读取，已加载的 DataFrame 按行切片。"""
+    if df is None:
+        skiprows = get_header_skiprows(full_path, None)
+        with pd.read_csv(full_path, encoding="utf-8", skiprows=skiprows, chunksize=chunk_rows) as reader:
+            yield from reader
+        return
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start : start + chunk_rows]
+
+
+def read_input_columns(full_path: Path, sheet_name: Optional[str], df: Optional[pd.DataFrame]) -> List[str]:
+    """读取输入的列名：已加载时直接取列，否则只读 CSV 表头或 Parquet 旁路文件的 schema。"""
+    if df is not None:
+        return df.columns.tolist()
+    if full_path.suffix.lower() == ".csv":
+        return read_csv_columns(full_path)
+    return pq.read_schema(get_fresh_sidecar_path(full_path, sheet_name)).names
+
+
+# 流式去重时暂存文件中记录全局行号的列，用于在 DuckDB 中保留每组重复行的首次出现位置
+_STREAM_ROW_COLUMN = "__excel_mcp_row"
+
+
+def stream_concat_to_csv(
+    inputs: List[Tuple[Path, Optional[pd.DataFrame]]], output_path: Path, columns: List[str], distinct: bool
+) -> int:
+    """
+    把多个输入逐块按列对齐后写入 CSV，不在内存中构造完整的合并结果。
+
+    去重时先把带行号的合并结果写入暂存文件，再由 DuckDB 按整行分组（内存不足时溢写到临时目录），
+    保留每组的首次出现位置并按原顺序写出，内存占用不随不重复的行数增长。
+
+    Args:
+        inputs (List[Tuple[Path, Optional[pd.DataFrame]]]): (文件路径, 已加载的数据)；CSV 输入为 None 时按块读取。
+        output_path (Path): 输出 CSV 路径，先写临时文件再原子替换。
+        columns (List[str]): 输出列（各输入列的并集，按首次出现顺序）。
+        distinct (bool): 是否按整行去重（保留首次出现的行）。
+
+    Returns:
+        int: 写出的行数。
+    """
+    tmp_path = get_temp_path(output_path)
+    staging_path = get_temp_path(output_path) if distinct else tmp_path
+    written_rows = 0
+    try:
+        with open(staging_path, "w", encoding="utf-8", newline="") as f:
+            header = [_STREAM_ROW_COLUMN] + columns if distinct else columns
+            pd.DataFrame(columns=header).to_csv(f, index=False)
+            for full_path, df in inputs:
+                for chunk in iter_input_chunks(full_path, df, STREAM_CHUNK_ROWS):
+                    chunk = chunk.reindex(columns=columns)
+                    if distinct:
+                        chunk.insert(0, _STREAM_ROW_COLUMN, np.arange(written_rows, written_rows + len(chunk)))
+                    chunk.to_csv(f, index=False, header=False)
+                    written_rows += len(chunk)
+        if distinct:
+            written_rows = distinct_csv_rows(staging_path, tmp_path, columns)
+        replace_atomic(tmp_path, output_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+        staging_path.unlink(missing_ok=True)
+    return written_rows
+
+
+def distinct_csv_rows(staging_path: Path, output_path: Path, columns: List[str]) -> int:
+    """
+    用 DuckDB 对 stream_concat_to_csv 的暂存文件按整行去重，保留首次出现的行并按原顺序写入 output_path。
+
+    类型按整个暂存文件推断，来自不同输入的 1 与 1.0 视为同一个值，与 pd.concat 后 drop_duplicates 的结果一致。
+
+    Returns:
+        int: 写出的行数。
+    """
+    columns_sql = ", ".join(_quote_identifier(c) for c in columns)
+    row_sql = _quote_identifier(_STREAM_ROW_COLUMN)
+    source_sql = "read_csv(?, header = true, delim = ',', quote = '\"', escape = '\"', sample_size = -1)"
+    # COPY 的目标路径不支持参数绑定，以转义后的字符串字面量传入
+    target_sql = "'" + str(output_path).replace("'", "''") + "'"
+    sql = (
+        f"COPY (SELECT {columns_sql} FROM (SELECT {columns_sql}, min({row_sql}) AS first_row FROM {source_sql} "
+        f"GROUP BY ALL) ORDER BY first_row) TO {target_sql} (HEADER, DELIMITER ',')"
+    )
+    with duckdb.connect() as conn:
+        return conn.execute(sql, [str(staging_path)]).fetchone()[0]
+
+
+def find_duplicate_columns_sql(
+    conn: "duckdb.DuckDBPyConnection", columns: List[str], types: List[str], exclude: List[str]
+) -> List[str]:
+    """find_duplicate_columns 的 DuckDB 版本：按 (类型, 各行哈希之和) 分桶，桶内逐列精确比较。"""
+    candidates = [(col, col_type) for col, col_type in zip(columns, types) if col not in exclude]
+    if not candidates:
+        return []
+    hash_sql = ", ".join(f"sum(hash({_quote_identifier(col)})::HUGEINT)" for col, _ in candidates)
+    column_hashes = conn.execute(f"SELECT {hash_sql} FROM merged").fetchone()
+
+    buckets: Dict[Tuple[str, Any], List[str]] = {}
+    duplicates = []
+    for (col, col_type), column_hash in zip(candidates, column_hashes):
+        bucket = buckets.setdefault((col_type, column_hash), [])
+        for kept in bucket:
+            same_sql = f"{_quote_identifier(kept)} IS NOT DISTINCT FROM {_quote_identifier(col)}"
+            if conn.execute(f"SELECT coalesce(bool_and({same_sql}), true) FROM merged").fetchone()[0]:
+                duplicates.append(col)
+                break
+        else:
+            bucket.append(col)
+    return duplicates
+
+
+def build_join_sql(views: List[str], view_columns: List[List[str]], keys: List[str]) -> Tuple[str, List[str]]:
+    """
+    生成与 pd.merge 语义一致的多表连接 SQL。
+
+    键列用 IS NOT DISTINCT FROM 比较，缺失值之间互相匹配；两侧同名的非键列与 pandas 一样加 _x/_y 后缀。
+    指定 keys 时为外连接，否则以两侧全部同名列为键做内连接（即 intersection）。
+
+    Returns:
+        Tuple[str, List[str]]: (SQL, 结果列)。
+
+    Raises:
+        ValueError: 内连接时两侧没有同名列。
+    """
+    sql = f"SELECT * FROM {views[0]}"
+    columns = list(view_columns[0])
+    for view, right_columns in zip(views[1:], view_columns[1:]):
+        on_columns = keys or [c for c in columns if c in right_columns]
+        if not on_columns:
+            raise ValueError("输入之间没有同名列，无法执行 intersection 合并")
+        overlap = (set(columns) & set(right_columns)) - set(on_columns)
+        select_sql, next_columns = [], []
+        for col in columns:
+            name = f"{col}_x" if col in overlap else col
+            expr = f"l.{_quote_identifier(col)}"
+            if col in on_columns and keys:
+                expr = f"coalesce(l.{_quote_identifier(col)}, r.{_quote_identifier(col)})"
+            select_sql.append(f"{expr} AS {_quote_identifier(name)}")
+            next_columns.append(name)
+        for col in right_columns:
+            if col not in on_columns:
+                name = f"{col}_y" if col in overlap else col
+                select_sql.append(f"r.{_quote_identifier(col)} AS {_quote_identifier(name)}")
+                next_columns.append(name)
+        on_sql = " AND ".join(
+            f"l.{_quote_identifier(c)} IS NOT DISTINCT FROM r.{_quote_identifier(c)}" for c in on_columns
+        )
+        join_sql = "FULL OUTER JOIN" if keys else "JOIN"
+        sql = f"SELECT {', '.join(select_sql)} FROM ({sql}) AS l {join_sql} {view} AS r ON {on_sql}"
+        columns = next_columns
+    return sql, columns
+
+
+def merge_out_of_core(
+    inputs: List[Tuple[Path, Optional[str]]],
+    output_path: Path,
+    output_sheet_name: str,
+    merge_type: str,
+    merge_keys: List[str],
+    replace_file: bool = True,
+) -> Tuple[int, List[str], List[str]]:
+    """
+    用 DuckDB 在外存中执行合并：CSV 与 Parquet 旁路文件直接扫描，中间结果超出内存时溢写到临时目录。
+
+    Returns:
+        Tuple[int, List[str], List[str]]: (结果行数, 结果列, 被移除的重复列)。
+    """
+    with duckdb.connect() as conn:
+        views = []
+        for i, (full_path, sheet_name) in enumerate(inputs):
+            view = f"input_{i}"
+            if full_path.suffix.lower() == ".csv":
+                skiprows = get_header_skiprows(full_path, None)
+                conn.read_csv(str(full_path), header=True, skiprows=skiprows).create_view(view)
+            else:
+                sidecar_path = get_fresh_sidecar_path(full_path, sheet_name)
+                if sidecar_path is not None:
+                    conn.read_parquet(str(sidecar_path)).create_view(view)
+                else:
+                    conn.register(view, load_dataframe(full_path, sheet_name))
+            views.append(view)
 
-# Initialize FastMCP
-mcp = FastMCP("excel-operate-mcp")
+        if merge_type in ("append", "union"):
+            set_operator = " UNION ALL BY NAME " if merge_type == "append" else " UNION BY NAME "
+            merged_sql = set_operator.join(f"SELECT * FROM {view}" for view in views)
+        elif merge_type == "merge":
+            # 外存模式下无法廉价获得行数，以文件大小近似表大小
+            view_columns = [conn.table(view).columns for view in views]
+            order = plan_join_order(view_columns, [path.stat().st_size for path, _ in inputs], merge_keys)
+            merged_sql, _ = build_join_sql([views[i] for i in order], [view_columns[i] for i in order], merge_keys)
+        else:
+            merged_sql, _ = build_join_sql(views, [conn.table(view).columns for view in views], [])
+        conn.execute(f"CREATE TEMP TABLE merged AS {merged_sql}")
+
+        merged = conn.table("merged")
+        columns = merged.columns
+        removed_columns: List[str] = []
+        order_sql = ""
+        if merge_type == "merge":
+            if order != sorted(order):
+                columns = list(dict.fromkeys(col for i in range(len(views)) for col in view_columns[i]))
+            removed_columns = find_duplicate_columns_sql(
+                conn, merged.columns, [str(t) for t in merged.types], merge_keys
+            )
+            # 与 pandas 外连接一致，结果按键排序
+            order_sql = " ORDER BY " + ", ".join(_quote_identifier(k) for k in merge_keys)
+        columns = [c for c in columns if c not in removed_columns]
+        result = conn.sql("SELECT " + ", ".join(_quote_identifier(c) for c in columns) + " FROM merged" + order_sql)
+        row_count = conn.execute("SELECT count(*) FROM merged").fetchone()[0]
+
+        if output_path.suffix.lower() == ".csv":
+            tmp_path = get_temp_path(output_path)
+            try:
+                result.write_csv(str(tmp_path), header=True)
+                replace_atomic(tmp_path, output_path)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+        else:
+            # Excel 最多约 100 万行，结果本身可以放入内存
+            run_cpu_bound(write_dataframe_atomic, output_path, output_sheet_name, result.df(), replace_file)
+    return row_count, columns, removed_columns
 
-# Supported file formats
-SUPPORTED_FORMATS = [".csv", ".xlsx", ".xls"]
 
+@mcp.tool()
+async def get_cache_stats() -> Dict[str, Any]:
+    """
+    Returns hit/miss counters and memory usage of the server's parsed-DataFrame cache.
+
+    Description:
+        Every read and write tool loads worksheets through a shared in-process LRU cache keyed by
+        (absolute path, sheet name, modification time, file size). This tool reports how effective that cache is.
 
-def get_excel_path(filename: str) -> Path:
+    Returns:
+        Dict[str, Any]: Dictionary containing cache statistics.
     """
-    获取 Excel 或 CSV 文件的绝对路径。
+    return {"status": "success", **_dataframe_cache.stats()}
 
-    Args:
-        filename (str): 文件的绝对路径。
+
+@mcp.tool()
+async def get_executor_stats() -> Dict[str, Any]:
+    """
+    Returns queue depth and concurrency settings of the server's tool executor.
+
+    Description:
+        Tool calls run in a bounded worker pool so that parsing or writing a large workbook does not block
+        other connected clients. Workbook parsing and serialization are further offloaded to worker processes.
+        Writes to the same file are serialized; calls touching different files run in parallel.
 
     Returns:
-        Path: 文件的绝对路径 Path 对象。
+        Dict[str, Any]: Dictionary containing:
+            - status (str): "success".
+            - max_concurrency (int): Maximum number of tool calls executing at once.
+            - process_workers (int): Size of the parsing process pool (0 means parsing runs in the worker threads).
+            - waiting (int): Tool calls currently queued for a free slot.
+            - running (int): Tool calls currently executing.
+            - max_waiting (int): Highest queue depth observed since startup.
+            - completed (int): Tool calls finished since startup.
+            - cpu_tasks (int): Parse/serialize jobs submitted to the process pool.
+            - locked_files (int): Files that currently have a write lock object.
+    """
+    return {
+        "status": "success",
+        "max_concurrency": MAX_CONCURRENCY,
+        "process_workers": PROCESS_WORKERS,
+        **_executor_stats,
+        "locked_files": len(_file_locks),
+    }
 
-    Raises:
-        ValueError: 当文件名为空、不是字符串或不是绝对路径时抛出。
+
+@mcp.tool()
+async def get_cluster_stats() -> Dict[str, Any]:
     """
-    if not filename or not isinstance(filename, str):
-        raise ValueError("文件名不能为空且必须为字符串")
+    Returns per-worker load and cache occupancy of the server.
 
-    # 移除不可见控制字符（如 \t \n \r），以及前后空白字符
-    cleaned_filename = re.sub(r"[\x00-\x1F]+", "", filename).strip()
+    Description:
+        When the server runs with several worker processes (--workers N), requests are routed to workers by a
+        consistent hash of their file path, so each file's cache and write lock live on exactly one worker.
+        This tool reports, for every worker, its executor load (as in get_executor_stats) and cache usage
+        (as in get_cache_stats). In single-process mode it reports the one process.
 
-    # 使用 Path 处理路径，跨平台兼容
-    file_path = Path(cleaned_filename)
+    Returns:
+        Dict[str, Any]: Dictionary containing:
+            - mode (str): "single" or "sharded".
+            - workers (List[Dict[str, Any]]): For each worker: worker id, pid, executor load, cache statistics and,
+              in sharded mode, the number of calls routed to it and currently in flight.
+    """
+    return {"status": "success", "mode": "single", "workers": [get_local_worker_stats()]}
 
-    # 验证是否为绝对路径
-    if not file_path.is_absolute():
-        raise ValueError(f"期望绝对路径，但收到相对路径: {filename}")
 
-    return file_path
+@mcp.tool()
+async def get_server_metrics(metrics_format: str = "json") -> Dict[str, Any]:
+    """
+    Returns per-tool latency, payload-size and cache statistics collected since the server started.
+
+    Description:
+        Every tool call is timed and split into queue_wait (waiting for the file's write lock, a free slot and a
+        worker thread), parse (reading workbooks, sidecars or cached frames), compute (filtering, sorting,
+        aggregating, writing) and serialize (encoding rows and converting the response to JSON). The server also records the response size,
+        the number of rows read and the DataFrame cache hits/misses of each call. Values are kept in fixed-bucket
+        histograms, so percentiles are bucket-upper-bound estimates. Use this to find slow tools or calls that
+        return very large payloads.
+
+    Args:
+        metrics_format (str, optional): "json" (default) for a per-tool summary, or "prometheus" for the
+            Prometheus text exposition format (the same text is served at GET /metrics on HTTP transports).
+
+    Returns:
+        Dict[str, Any]: Dictionary containing:
+            - status (str): "success" or "error".
+            - format (str): The format used.
+            - uptime_seconds (float): Seconds since metrics collection started (json only).
+            - tools (Dict[str, Dict[str, Any]]): For each tool called so far (json only): calls, errors,
+              cache_hits, cache_misses, cache_hit_rate, duration_ms per phase (total/queue_wait/parse/compute/serialize)
+              and response_bytes / rows_scanned, each with mean, p50, p95 and max (plus total for sizes).
+            - text (str): Prometheus exposition text (prometheus only).
+    """
+    return format_server_metrics(_tool_metrics.snapshot(), metrics_format)
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Any) -> Any:
+    """Prometheus 抓取入口（sse / streamable-http 传输时可用）。"""
+    from starlette.responses import PlainTextResponse
+
+    return PlainTextResponse(
+        render_prometheus_metrics(_tool_metrics.snapshot()), media_type="text/plain; version=0.0.4"
+    )
+
+
+@mcp.custom_route("/metrics/snapshot", methods=["GET"])
+async def metrics_snapshot_endpoint(request: Any) -> Any:
+    """可合并的原始指标快照，供分片模式的前端进程汇总各 worker。"""
+    from starlette.responses import JSONResponse
+
+    return JSONResponse(_tool_metrics.snapshot())
+
+
+def get_local_worker_stats() -> Dict[str, Any]:
+    """当前进程的负载与缓存占用，供 get_cluster_stats 汇总。"""
+    return {
+        "worker": int(os.getenv("EXCEL_MCP_WORKER_ID", "0")),
+        "pid": os.getpid(),
+        "executor": {
+            "max_concurrency": MAX_CONCURRENCY,
+            "process_workers": PROCESS_WORKERS,
+            **_executor_stats,
+            "locked_files": len(_file_locks),
+        },
+        "cache": _dataframe_cache.stats(),
+    }
 
 
 @mcp.tool()
-async def get_excel_sheet_name(file_path: str) -> Dict[str, Any]:
+@offload_to_executor()
+def get_excel_sheet_name(file_path: str) -> Dict[str, Any]:
     """
     Retrieves the list of sheet names from an Excel file (.xlsx or .xls format).
 
     Description:
         This function reads an Excel file and returns the names of all worksheets contained within it.
+        Names are read from the workbook manifest without loading any sheet data, and cached per file fingerprint.
         It supports .xlsx and .xls file formats and performs validation to ensure the file exists and is in a supported format.
 
     Args:
@@ -69,16 +3761,15 @@ async def get_excel_sheet_name(file_path: str) -> Dict[str, Any]:
                 "error_code": "INVALID_FORMAT",
             }
 
-        with pd.ExcelFile(full_path, engine="openpyxl") as xls:
-            sheet_names = xls.sheet_names
-        return {"status": "success", "file_path": str(full_path), "sheet_names": sheet_names}
+        return {"status": "success", "file_path": str(full_path), "sheet_names": get_sheet_names(full_path)}
 
     except Exception as e:
         return {"status": "error", "message": f"获取工作表名称时发生错误: {str(e)}", "error_code": "SHEET_NAMES_ERROR"}
 
 
 @mcp.tool()
-async def get_column_names(
+@offload_to_executor(lock_arg="file_path")
+def get_column_names(
     file_path: str, sheet_name: str = "Sheet1", max_rows_to_check: int = 10, skip_non_header_rows: bool = True
 ) -> Dict[str, Any]:
     """
@@ -86,16 +3777,21 @@ async def get_column_names(
 
     Description:
         This function identifies the header row in an Excel (.xlsx, .xls) or CSV file by finding the first row where the number of non-empty cells equals the total number of columns.
-        It supports automatic header detection and optionally removes rows before the header.
+        It supports automatic header detection and optionally skips rows before the header.
+        Only the first rows are streamed from the file; the detected header, column names, sampled dtypes and row count
+        are cached in a persistent index keyed by the file's fingerprint, so repeated calls do not reopen the workbook.
 
     Args:
         file_path (str): Absolute path to the file (.xlsx, .xls, or .csv).
         sheet_name (str, optional): Name of the Excel worksheet (ignored for CSV). Defaults to "Sheet1".
         max_rows_to_check (int, optional): Maximum rows to scan for header detection. Defaults to 5.
-        skip_non_header_rows (bool, optional): If True, skips rows before the header row. Defaults to True.
+        skip_non_header_rows (bool, optional): If True, records the header offset in the file's index so that all
+            other tools skip the rows before the header when reading. The file itself is not modified. Defaults to True.
 
     Returns:
-        Dict[str, Any]: Dictionary containing column names or error information.
+        Dict[str, Any]: Dictionary containing column names or error information, including:
+            - dtypes (Dict[str, str]): Column dtypes inferred from the rows sampled below the header.
+            - row_count (Optional[int]): Number of data rows from the worksheet's dimension (None for CSV or when unknown).
     """
 
     full_path = Path(get_excel_path(file_path))
@@ -111,41 +3807,24 @@ async def get_column_names(
                 "error_code": "INVALID_FORMAT",
             }
 
-        # 读取列名（仅加载表头）
-        if file_extension == ".csv":
-            df = pd.read_csv(full_path, encoding="utf-8", header=None, nrows=max_rows_to_check)
-        else:
-            df = pd.read_excel(
-                full_path, sheet_name=sheet_name, header=None, nrows=max_rows_to_check, engine="openpyxl"
-            )
-
-        # 查找标题行：非空单元格数量等于总列数的第一行
-        total_columns = df.shape[1]
-        header_row_idx = next((idx for idx, row in df.iterrows() if row.dropna().count() == total_columns), None)
+        # 查找标题行（只流式读取前几行，结果缓存在元数据索引中）
+        header = detect_header(full_path, sheet_name, max_rows_to_check)
+        header_row_idx = header["header_row"]
         if header_row_idx is None:
             return {
                 "status": "error",
-                "message": f"未找到有效的标题行（列数为 {total_columns}）。请检查文件格式。",
+                "message": f"未找到有效的标题行（列数为 {header['width']}）。请检查文件格式。",
                 "error_code": "NO_HEADER_FOUND",
             }
 
-        # 提取标题行作为列名
-        columns = df.iloc[header_row_idx].dropna().astype(str).str.strip().tolist()
+        columns = header["columns"]
         if not columns:
             return {"status": "error", "message": "未找到列名", "error_code": "NO_COLUMNS_FOUND"}
 
-        # 如果需要，跳过非标题行
-        if skip_non_header_rows and header_row_idx > 0:
-            if file_extension == ".csv":
-                df_clean = pd.read_csv(full_path, encoding="utf-8", skiprows=header_row_idx)
-            else:
-                df_clean = pd.read_excel(full_path, sheet_name=sheet_name, skiprows=header_row_idx, engine="openpyxl")
-
-            # Save cleaned file
-            if file_extension == ".csv":
-                df_clean.to_csv(full_path, index=False, encoding="utf-8")
-            else:
-                df_clean.to_excel(full_path, sheet_name=sheet_name, index=False, engine="openpyxl")
+        # 如果需要，跳过非标题行：只记录表头位置，其他工具读取时直接跳过，不改写原文件
+        if skip_non_header_rows and header_row_idx > 0 and get_header_skiprows(full_path, sheet_name) != header_row_idx:
+            record_header_skiprows(full_path, sheet_name, header_row_idx, columns)
+            _dataframe_cache.invalidate(full_path)
 
         return {
             "status": "success",
@@ -153,6 +3832,8 @@ async def get_column_names(
             "sheet_name": sheet_name if file_extension != ".csv" else None,
             "columns_count": len(columns),
             "columns": columns,
+            "dtypes": header["dtypes"],
+            "row_count": header["row_count"],
         }
 
     except pd.errors.EmptyDataError:
@@ -162,20 +3843,37 @@ async def get_column_names(
 
 
 @mcp.tool()
-async def read_sheet_data(file_path: str, sheet_name: str = "Sheet1") -> Dict[str, Any]:
+@offload_to_executor()
+def read_sheet_data(
+    file_path: str,
+    sheet_name: str = "Sheet1",
+    preview_rows: int = 5,
+    output_format: str = "records",
+    precision: Optional[int] = None,
+) -> Dict[str, Any]:
     """
     Reads the first 5 rows of an Excel or CSV file to provide a preview of its structure and content.
 
     Description:
         This function retrieves the first 5 rows of data from a specified Excel worksheet (.xlsx or .xls) or CSV file, including column names and their respective data types.
         It is primarily used to allow the model to understand the file's structure, content, and purpose by providing a concise data sample.
+        Only the preview rows are parsed, so the call stays fast on large files. The total row count comes from the
+        server cache when the sheet was read before (exact), otherwise from a newline count (CSV) or the worksheet's
+        dimension (Excel); rows_exact tells whether it is exact or an estimate.
+        Data types are inferred from the preview rows unless the sheet is already cached.
 
     Args:
         file_path (str): Absolute path to the file (.xlsx, .xls, or .csv).
         sheet_name (str, optional): Name of the Excel worksheet (ignored for CSV). Defaults to "Sheet1".
+        preview_rows (int, optional): Number of leading rows to return. Defaults to 5.
+        output_format (str, optional): Encoding of "data": "records" (list of row objects), "columnar" (list of row arrays
+            in the order of "columns", without repeating column names), "csv" text or a "markdown" table. Defaults to "records".
+        precision (Optional[int], optional): Round float values to this many decimal places. Defaults to None (no rounding).
 
     Returns:
-        Dict[str, Any]: Dictionary containing file data or error information.
+        Dict[str, Any]: Dictionary containing file data or error information, including:
+            - rows (Optional[int]): Total number of data rows (None when unknown).
+            - rows_exact (bool): True if rows is exact, False if it is an estimate.
     """
 
     full_path = Path(get_excel_path(file_path))
@@ -192,18 +3890,21 @@ async def read_sheet_data(file_path: str, sheet_name: str = "Sheet1") -> Dict[st
                 "error_code": "INVALID_FORMAT",
             }
 
-        if file_extension == ".csv":
-            result = pd.read_csv(full_path, encoding="utf-8")
-        else:
-            result = pd.read_excel(full_path, sheet_name=sheet_name, engine="openpyxl")
+        output_format, precision = normalize_output_options(output_format, precision)
+        if isinstance(preview_rows, bool) or not isinstance(preview_rows, int) or preview_rows < 0:
+            return {"status": "error", "message": "preview_rows 必须为非负整数", "error_code": "INVALID_PREVIEW_ROWS"}
+
+        # 只读取预览行；总行数来自缓存、换行符计数或工作表 dimension，不解析整个文件
+        result, row_count, row_count_exact = read_preview(full_path, sheet_name, preview_rows)
 
-        if result.empty:
+        if result.empty and row_count == 0:
             return {
                 "status": "warning",
                 "message": "文件中未找到数据",
                 "data": [],
                 "rows": 0,
-                "columns": [],
+                "rows_exact": row_count_exact,
+                "columns": result.columns.tolist(),
                 "file_path": str(full_path),
                 "sheet_name": sheet_name if file_extension != ".csv" else None,
             }
@@ -212,12 +3913,16 @@ async def read_sheet_data(file_path: str, sheet_name: str = "Sheet1") -> Dict[st
             "status": "success",
             "file_path": str(full_path),
             "sheet_name": sheet_name if file_extension != ".csv" else None,
-            "rows": result.shape[0],
+            "rows": row_count,
+            "rows_exact": row_count_exact,
             "columns": result.columns.tolist(),
-            "data": result[:5].to_dict(orient="records"),
-            "data_types": result.dtypes.astype(str).to_dict(),
+            "data": encode_rows(result, output_format, precision),
+            "format": output_format,
+            "data_types": get_column_dtypes(result),
         }
 
+    except OutputFormatError as fe:
+        return {"status": "error", "message": str(fe), "error_code": fe.error_code}
     except pd.errors.EmptyDataError:
         return {"status": "error", "message": "文件为空或格式不正确。", "error_code": "EMPTY_DATA"}
     except Exception as e:
@@ -225,11 +3930,103 @@ async def read_sheet_data(file_path: str, sheet_name: str = "Sheet1") -> Dict[st
 
 
 @mcp.tool()
-async def read_range_sheet_data(
+@offload_to_executor()
+def read_workbook(
+    file_path: str,
+    sheets: Optional[Union[str, List[str]]] = None,
+    preview_rows: int = 5,
+    output_format: str = "records",
+    precision: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Reads several worksheets of an Excel workbook in one call and returns each sheet's schema, row count and preview.
+
+    Description:
+        This function opens the workbook once in streaming read-only mode and parses every requested sheet in the same pass,
+        instead of one read_sheet_data call (and one full re-parse of the file) per sheet.
+        All parsed sheets are cached on the server, so follow-up calls on any of these sheets do not parse the file again.
+
+    Args:
+        file_path (str): Absolute path to the file (.xlsx or .xls).
+        sheets (Optional[Union[str, List[str]]], optional): Worksheet name(s) to read. Defaults to None (all worksheets).
+        preview_rows (int, optional): Number of leading rows returned per sheet. Defaults to 5.
+        output_format (str, optional): Encoding of each sheet's "data": "records", "columnar", "csv" or "markdown". Defaults to "records".
+        precision (Optional[int], optional): Round float values to this many decimal places. Defaults to None (no rounding).
+
+    Returns:
+        Dict[str, Any]: Dictionary containing per-sheet results or error information, including:
+            - sheet_names (List[str]): All worksheet names of the workbook.
+            - sheets (List[Dict[str, Any]]): For each requested sheet: sheet_name, rows, columns, data_types and data (the preview).
+    """
+
+    full_path = Path(get_excel_path(file_path))
+    if not full_path.exists():
+        return {"status": "error", "message": f"文件未找到: {full_path}", "error_code": "FILE_NOT_FOUND"}
+
+    try:
+        if full_path.suffix.lower() not in [".xlsx", ".xls"]:
+            return {
+                "status": "error",
+                "message": f"不支持的文件格式: {full_path.suffix}",
+                "error_code": "INVALID_FORMAT",
+            }
+
+        output_format, precision = normalize_output_options(output_format, precision)
+        if isinstance(preview_rows, bool) or not isinstance(preview_rows, int) or preview_rows < 0:
+            return {"status": "error", "message": "preview_rows 必须为非负整数", "error_code": "INVALID_PREVIEW_ROWS"}
+
+        sheet_names = get_sheet_names(full_path)
+        requested = sheet_names if sheets is None else [sheets] if isinstance(sheets, str) else list(sheets)
+        missing_sheets = [name for name in requested if name not in sheet_names]
+        if missing_sheets:
+            return {
+                "status": "error",
+                "message": f"工作表 {missing_sheets} 不存在，可用工作表: {sheet_names}",
+                "error_code": "SHEET_NOT_FOUND",
+            }
+
+        # 一次打开工作簿解析全部所需工作表，并预热缓存
+        frames = load_workbook_dataframes(full_path, list(dict.fromkeys(requested)))
+        results = []
+        for sheet_name, (df, _) in frames.items():
+            results.append(
+                {
+                    "sheet_name": sheet_name,
+                    "rows": df.shape[0],
+                    "columns": df.columns.tolist(),
+                    "data_types": get_column_dtypes(df),
+                    "data": encode_rows(df.head(preview_rows), output_format, precision),
+                }
+            )
+
+        return {
+            "status": "success",
+            "file_path": str(full_path),
+            "sheet_names": sheet_names,
+            "format": output_format,
+            "sheets": results,
+        }
+
+    except OutputFormatError as fe:
+        return {"status": "error", "message": str(fe), "error_code": fe.error_code}
+    except pd.errors.EmptyDataError:
+        return {"status": "error", "message": "文件为空或格式不正确。", "error_code": "EMPTY_DATA"}
+    except Exception as e:
+        return {"status": "error", "message": f"读取工作簿时发生错误: {str(e)}", "error_code": "READ_ERROR"}
+
+
+@mcp.tool()
+@offload_to_executor()
+def read_range_sheet_data(
     file_path: str,
     sheet_name: str = "Sheet1",
     columns: Optional[Union[str, List[str]]] = None,
     condition: Optional[Dict[str, Any]] = None,
+    count_only: bool = False,
+    page_size: Optional[int] = None,
+    cursor: Optional[str] = None,
+    output_format: str = "records",
+    precision: Optional[int] = None,
 ) -> Dict[str, Any]:
     """
     Retrieves specific data from an Excel or CSV file with optional column selection and filtering conditions.
@@ -237,12 +4034,23 @@ async def read_range_sheet_data(
     Description:
         This function extracts data from an Excel (.xlsx, .xls) or CSV file, allowing users to specify a subset of columns to include and apply filtering conditions to select rows based on column values.
         It is designed for flexible data extraction, enabling targeted data retrieval for further processing or analysis.
+        Set count_only to probe how many rows a condition matches without transferring the rows themselves.
+        Results are paginated: when has_more is true, call again with the returned next_cursor to fetch the next page.
 
     Args:
         file_path (str): Absolute path to the file (.xlsx, .xls, or .csv).
         sheet_name (str, optional): Name of the Excel worksheet (ignored for CSV). Defaults to "Sheet1".
         columns (Optional[Union[str, List[str]]], optional): List of column names to read (all columns if None).
-        condition (Optional[Dict[str, Any]], optional): Filter conditions, e.g., {"Column_Name": "Value"}.
+        condition (Optional[Dict[str, Any]], optional): Filter conditions. Supported forms:
+            - {"Column_Name": "Value"}: equality; a list value means "in". Multiple keys are combined with AND.
+            - {"Column_Name": {"op": ">", "value": 1000}}: op is one of ==, !=, >, >=, <, <=, in, between ([low, high]), contains, isnull (true/false).
+            - {"and": [condition, ...]} or {"or": [condition, ...]}: nested combinations.
+        count_only (bool, optional): If True, returns only the number of matching rows. Defaults to False.
+        page_size (Optional[int], optional): Maximum rows per page. Defaults to the server page size (500).
+        cursor (Optional[str], optional): next_cursor from a previous call; columns and condition are ignored when set.
+        output_format (str, optional): Encoding of "data": "records" (list of row objects), "columnar" (list of row arrays
+            in the order of "columns", without repeating column names), "csv" text or a "markdown" table. Defaults to "records".
+        precision (Optional[int], optional): Round float values to this many decimal places. Defaults to None (no rounding).
 
     Returns:
         Dict[str, Any]: Dictionary containing filtered data or error information.
@@ -263,13 +4071,39 @@ async def read_range_sheet_data(
                 "error_code": "INVALID_FORMAT",
             }
 
-        # 读取数据
-        if file_extension == ".csv":
-            df = pd.read_csv(full_path, encoding="utf-8", usecols=columns)
-        else:  # xlsx 或 xls
-            df = pd.read_excel(full_path, sheet_name=sheet_name, usecols=columns, engine="openpyxl")
+        output_format, precision = normalize_output_options(output_format, precision)
+
+        # 续取下一页：直接从服务端结果集切片
+        if cursor:
+            df, offset, cursor_page_size, result_id = resume_result_set(cursor, str(full_path))
+            page, page_info = paginate_dataframe(
+                df, str(full_path), cursor_page_size if page_size is None else page_size, offset, result_id
+            )
+            return {
+                "status": "success",
+                "file_path": str(full_path),
+                "sheet_name": sheet_name if file_extension != ".csv" else None,
+                "row_count": len(df),
+                "columns": page.columns.tolist(),
+                "data": encode_rows(page, output_format, precision),
+                "format": output_format,
+                **page_info,
+            }
 
-        if df.empty:
+        # 读取并筛选数据（一次性掩码；旁路文件可用时直接在 DuckDB 中筛选）
+        selected_columns = [columns] if isinstance(columns, str) else columns
+        result = select_rows(full_path, sheet_name, selected_columns, condition, count_only)
+
+        if count_only:
+            return {
+                "status": "success",
+                "file_path": str(full_path),
+                "sheet_name": sheet_name if file_extension != ".csv" else None,
+                "row_count": result,
+            }
+
+        df = result
+        if df.empty and not condition:
             return {
                 "status": "warning",
                 "message": "文件中未找到数据",
@@ -280,22 +4114,23 @@ async def read_range_sheet_data(
                 "sheet_name": sheet_name if file_extension != ".csv" else None,
             }
 
-        # 应用筛选条件
-        if condition:
-            for column, value in condition.items():
-                if column not in df.columns:
-                    return {"status": "error", "message": f"筛选列 '{column}' 不存在", "error_code": "INVALID_COLUMN"}
-                df = df[df[column] == value]
-
+        # 只把当前页转换为记录，其余行留在服务端结果集中
+        page, page_info = paginate_dataframe(df, str(full_path), page_size)
         return {
             "status": "success",
             "file_path": str(full_path),
             "sheet_name": sheet_name if file_extension != ".csv" else None,
             "row_count": len(df),
             "columns": df.columns.tolist(),
-            "data": df.to_dict(orient="records"),
+            "data": encode_rows(page, output_format, precision),
+            "format": output_format,
+            **page_info,
         }
 
+    except (ConditionError, CursorError, OutputFormatError) as ce:
+        return {"status": "error", "message": str(ce), "error_code": ce.error_code}
+    except KeyError as ke:
+        return {"status": "error", "message": str(ke.args[0]), "error_code": "INVALID_COLUMN"}
     except ValueError as ve:
         return {"status": "error", "message": f"工作表 {sheet_name} 不存在: {str(ve)}", "error_code": "SHEET_NOT_FOUND"}
     except Exception as e:
@@ -303,13 +4138,111 @@ async def read_range_sheet_data(
 
 
 @mcp.tool()
-async def merge_multiple_data(
+@offload_to_executor()
+def read_row_range(
+    file_path: str,
+    sheet_name: str = "Sheet1",
+    start_row: int = 0,
+    num_rows: int = 100,
+    output_format: str = "records",
+    precision: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Reads a contiguous range of rows by position from an Excel or CSV file, e.g. rows 1000-1099.
+
+    Description:
+        This function returns the rows start_row .. start_row + num_rows - 1 (0-based, same numbering as row deletion).
+        For CSV files a persistent byte-offset index of the rows is built once and reused, so only the requested rows
+        are read from disk regardless of file size. Excel sheets are read through the server cache.
+        For CSV files that are not cached, data types are inferred from the returned rows only.
+
+    Args:
+        file_path (str): Absolute path to the file (.xlsx, .xls, or .csv).
+        sheet_name (str, optional): Name of the Excel worksheet (ignored for CSV). Defaults to "Sheet1".
+        start_row (int, optional): Index of the first row to return (0-based). Defaults to 0.
+        num_rows (int, optional): Number of rows to return. Defaults to 100.
+        output_format (str, optional): Encoding of "data": "records", "columnar", "csv" or "markdown". Defaults to "records".
+        precision (Optional[int], optional): Round float values to this many decimal places. Defaults to None (no rounding).
+
+    Returns:
+        Dict[str, Any]: Dictionary containing the rows or error information, including:
+            - total_rows (int): Number of data rows in the sheet.
+            - returned_rows (int): Number of rows in data (fewer than num_rows at the end of the sheet).
+    """
+    full_path = Path(get_excel_path(file_path))
+    if not full_path.exists():
+        return {"status": "error", "message": f"文件未找到: {full_path}", "error_code": "FILE_NOT_FOUND"}
+
+    try:
+        file_extension = full_path.suffix.lower()
+        if file_extension not in SUPPORTED_FORMATS:
+            return {
+                "status": "error",
+                "message": f"不支持的文件格式: {file_extension}，支持的格式为: {', '.join(SUPPORTED_FORMATS)}",
+                "error_code": "INVALID_FORMAT",
+            }
+
+        output_format, precision = normalize_output_options(output_format, precision)
+        if isinstance(start_row, bool) or not isinstance(start_row, int) or start_row < 0:
+            return {"status": "error", "message": "start_row 必须为非负整数", "error_code": "INVALID_ROW_INDEX"}
+        if isinstance(num_rows, bool) or not isinstance(num_rows, int) or num_rows <= 0:
+            return {"status": "error", "message": "num_rows 必须为正整数", "error_code": "INVALID_ROW_COUNT"}
+
+        # CSV 未缓存时按行偏移索引直接定位读取；其余情况从缓存的 DataFrame 中切片
+        cached = _dataframe_cache.peek(get_cache_key(full_path, sheet_name))
+        if file_extension == ".csv" and cached is None:
+            total_rows = len(get_line_index(full_path)[1])
+            if start_row >= total_rows and total_rows:
+                return {
+                    "status": "error",
+                    "message": f"起始行 {start_row} 超出范围（共 {total_rows} 行）",
+                    "error_code": "INVALID_ROW_INDEX",
+                }
+            rows = read_csv_row_range(full_path, start_row, start_row + num_rows)
+        else:
+            df = cached if cached is not None else load_dataframe(full_path, sheet_name)
+            total_rows = len(df)
+            if start_row >= total_rows and total_rows:
+                return {
+                    "status": "error",
+                    "message": f"起始行 {start_row} 超出范围（共 {total_rows} 行）",
+                    "error_code": "INVALID_ROW_INDEX",
+                }
+            rows = df.iloc[start_row : start_row + num_rows]
+            if cached is not None:
+                # 直接从缓存切片，没有读取耗时，只记录缓存命中与取出的行数
+                record_parse(time.perf_counter(), len(rows), cache_hit=True)
+
+        return {
+            "status": "success",
+            "file_path": str(full_path),
+            "sheet_name": sheet_name if file_extension != ".csv" else None,
+            "total_rows": total_rows,
+            "start_row": start_row,
+            "returned_rows": len(rows),
+            "columns": rows.columns.tolist(),
+            "data": encode_rows(rows, output_format, precision),
+            "format": output_format,
+        }
+
+    except OutputFormatError as fe:
+        return {"status": "error", "message": str(fe), "error_code": fe.error_code}
+    except pd.errors.EmptyDataError:
+        return {"status": "error", "message": "文件为空或格式不正确。", "error_code": "EMPTY_DATA"}
+    except Exception as e:
+        return {"status": "error", "message": f"读取数据时发生错误: {str(e)}", "error_code": "DATA_READ_ERROR"}
+
+
+@mcp.tool()
+@offload_to_executor(lock_arg="output_filepath")
+def merge_multiple_data(
     file_configs: List[Dict[str, Any]],
     output_filepath: str,
     output_type: str = "file",
     output_sheet_name: str = "MergedSheet",
     merge_type: str = "append",
     merge_key: Optional[Union[str, List[str]]] = None,
+    out_of_core: Optional[bool] = None,
 ) -> Dict[str, Any]:
     """
     Merges multiple Excel or CSV files into a single output file or appends to an existing Excel file.
@@ -318,6 +4251,9 @@ async def merge_multiple_data(
         This function combines data from multiple Excel (.xlsx, .xls) or CSV files based on the specified merge type (append, merge, union, or intersection).
         It supports creating a new file or appends to an existing Excel file as a new sheet.
         The function validates input files, handles different merge strategies, and removes duplicate columns when necessary.
+        For "merge", inputs are outer-joined smallest-first and duplicate columns are found by hashing each column.
+        "append" and "union" into a CSV output are streamed chunk by chunk instead of building the merged table in memory.
+        Inputs larger than memory can be merged out-of-core with DuckDB (see out_of_core).
 
     Args:
         file_configs (List[Dict[str, Any]]): A list of dictionaries specifying input files and their sheets. Each dictionary must contain:
@@ -336,9 +4272,16 @@ async def merge_multiple_data(
             - "intersection": Keeps only rows present in all files (based on all columns).
             Defaults to "append".
         merge_key (Optional[Union[str, List[str]]], optional): Column(s) to use as keys for "merge" merge_type.
+        out_of_core (Optional[bool], optional): Run the merge in DuckDB, scanning CSV files and cached Parquet copies
+            from disk and spilling to temporary files when the result exceeds memory. Row order of "union" results
+            is not preserved in this mode. A "union" written to CSV without this mode also removes duplicates in
+            DuckDB, so its memory use does not grow with the number of distinct rows. Defaults to None (enabled automatically when the inputs total more than
+            EXCEL_MCP_OUT_OF_CORE_BYTES, 1 GiB by default).
 
     Returns:
-        Dict[str, Any]: Dictionary with merge result or error information.
+        Dict[str, Any]: Dictionary with merge result or error information, including:
+            - execution (str): How the merge ran: "in_memory", "streaming" or "out_of_core".
+            - removed_columns (List[str]): Duplicate columns dropped by a "merge".
     """
     if not file_configs:
         return {"status": "error", "message": "必须提供至少一个输入文件", "error_code": "INSUFFICIENT_FILES"}
@@ -361,8 +4304,41 @@ async def merge_multiple_data(
                 "error_code": "INVALID_OUTPUT_TYPE",
             }
 
-        # Read all dataframes
-        dfs = []
+        if merge_type not in ["append", "merge", "union", "intersection"]:
+            return {
+                "status": "error",
+                "message": f"不支持的合并类型: {merge_type}. 支持类型: append, merge, union, intersection",
+                "error_code": "INVALID_MERGE_TYPE",
+            }
+
+        merge_keys: List[str] = []
+        if merge_type == "merge":
+            if not merge_key:
+                return {
+                    "status": "error",
+                    "message": "merge_type 为 'merge' 时必须提供 merge_key",
+                    "error_code": "MISSING_MERGE_KEY",
+                }
+            merge_keys = [merge_key] if isinstance(merge_key, str) else merge_key
+
+        if output_type == "sheet":
+            if output_ext == ".csv":
+                return {
+                    "status": "error",
+                    "message": "CSV 文件不支持追加到特定 sheet",
+                    "error_code": "INVALID_OUTPUT_TYPE_FOR_CSV",
+                }
+            if output_path.exists():
+                with pd.ExcelFile(output_path, engine="openpyxl") as xls:
+                    if output_sheet_name in xls.sheet_names:
+                        return {
+                            "status": "error",
+                            "message": f"工作表 {output_sheet_name} 已存在于 {output_path}",
+                            "error_code": "SHEET_ALREADY_EXISTS",
+                        }
+
+        # Validate input files
+        inputs: List[Tuple[Path, Optional[str]]] = []
         input_configs = []
         for config in file_configs:
             file_path = config.get("file_path")
@@ -374,10 +4350,8 @@ async def merge_multiple_data(
             if not path.exists():
                 return {"status": "error", "message": f"文件 {path} 不存在", "error_code": "FILE_NOT_FOUND"}
 
-            ext = path.suffix.lower()
-            if ext == ".csv":
-                df = pd.read_csv(path, encoding="utf-8")
-                dfs.append(df)
+            if path.suffix.lower() == ".csv":
+                inputs.append((path, None))
                 input_configs.append({"file_path": str(path), "sheet_name": None})
             else:
                 if not sheet_name:
@@ -386,116 +4360,96 @@ async def merge_multiple_data(
                         "message": f"Excel 文件 {path} 必须指定 sheet_name",
                         "error_code": "MISSING_SHEET_NAME",
                     }
-
-                try:
-                    df = pd.read_excel(path, sheet_name=sheet_name, engine="openpyxl")
-                    dfs.append(df)
-                    input_configs.append({"file_path": str(path), "sheet_name": sheet_name})
-
-                except ValueError as ve:
-                    return {
-                        "status": "error",
-                        "message": f"工作表 {sheet_name} 在文件 {path} 中不存在: {str(ve)}",
-                        "error_code": "SHEET_NOT_FOUND",
-                    }
-
-        if not dfs:
-            return {"status": "error", "message": "未读取到有效的数据表", "error_code": "NO_VALID_DATA"}
-
-        # Perform merge based on merge_type
-        removed_columns = []
-        if merge_type == "append":
+                inputs.append((path, sheet_name))
+                input_configs.append({"file_path": str(path), "sheet_name": sheet_name})
+
+        if out_of_core is None:
+            out_of_core = sum(path.stat().st_size for path, _ in inputs) > OUT_OF_CORE_THRESHOLD_BYTES
+        # 追加/去重合并写入 CSV 时逐块写出；CSV 输入此时不整表加载
+        streaming = not out_of_core and merge_type in ("append", "union") and output_ext == ".csv"
+
+        # Read all dataframes (Excel inputs are always parsed here so that a missing sheet is reported up front)
+        # 合并时按原始取值比较列类型与内容哈希，字典编码列先还原为对象列
+        dfs: List[Optional[pd.DataFrame]] = []
+        for path, sheet_name in inputs:
+            if sheet_name is None:
+                dfs.append(None if streaming or out_of_core else decode_categorical_columns(load_dataframe(path)))
+                continue
+            if out_of_core and get_fresh_sidecar_path(path, sheet_name) is not None:
+                dfs.append(None)
+                continue
             try:
-                merged_df = pd.concat(dfs, ignore_index=True)
-            except ValueError as e:
+                dfs.append(decode_categorical_columns(load_dataframe(path, sheet_name)))
+            except ValueError as ve:
                 return {
                     "status": "error",
-                    "message": f"列名不一致，无法执行 append 合并: {str(e)}",
-                    "error_code": "COLUMN_MISMATCH",
+                    "message": f"工作表 {sheet_name} 在文件 {path} 中不存在: {str(ve)}",
+                    "error_code": "SHEET_NOT_FOUND",
                 }
 
-        elif merge_type == "merge":
-            if not merge_key:
+        input_columns = [read_input_columns(path, sheet_name, df) for (path, sheet_name), df in zip(inputs, dfs)]
+        for columns in input_columns:
+            invalid_keys = [k for k in merge_keys if k not in columns]
+            if invalid_keys:
                 return {
                     "status": "error",
-                    "message": "merge_type 为 'merge' 时必须提供 merge_key",
-                    "error_code": "MISSING_MERGE_KEY",
+                    "message": f"合并键 {invalid_keys} 在某些文件中不存在",
+                    "error_code": "INVALID_MERGE_KEY",
                 }
-            merge_keys = [merge_key] if isinstance(merge_key, str) else merge_key
-            for df in dfs:
-                invalid_keys = [k for k in merge_keys if k not in df.columns]
-                if invalid_keys:
-                    return {
-                        "status": "error",
-                        "message": f"合并键 {invalid_keys} 在某些文件中不存在",
-                        "error_code": "INVALID_MERGE_KEY",
-                    }
-            merged_df = dfs[0]
-            for df in dfs[1:]:
-                merged_df = pd.merge(merged_df, df, on=merge_keys, how="outer")
-
-            # Detect and remove duplicate columns
-            columns = merged_df.columns.tolist()
-            for i, col1 in enumerate(columns):
-                for col2 in columns[i + 1 :]:
-                    if col1 not in merge_keys and col2 not in merge_keys:  # Skip merge keys
-                        if col1 not in removed_columns and col2 not in removed_columns:
-                            if merged_df[col1].equals(merged_df[col2]):
-                                removed_columns.append(col2)
-            if removed_columns:
-                merged_df = merged_df.drop(columns=removed_columns)
-
-        elif merge_type == "union":
-            merged_df = pd.concat(dfs, ignore_index=True).drop_duplicates()
-
-        elif merge_type == "intersection":
-            merged_df = dfs[0]
-            for df in dfs[1:]:
-                merged_df = pd.merge(merged_df, df, how="inner")
-        else:
-            return {
-                "status": "error",
-                "message": f"不支持的合并类型: {merge_type}. 支持类型: append, merge, union, intersection",
-                "error_code": "INVALID_MERGE_TYPE",
-            }
 
-        # Save merged file based on output_type
-        if output_type == "file":
-            if output_ext == ".csv":
-                merged_df.to_csv(output_path, index=False, encoding="utf-8")
-            else:
-                merged_df.to_excel(output_path, sheet_name=output_sheet_name, index=False, engine="openpyxl")
-        elif output_type == "sheet":
-            if output_ext == ".csv":
-                return {
-                    "status": "error",
-                    "message": "CSV 文件不支持追加到特定 sheet",
-                    "error_code": "INVALID_OUTPUT_TYPE_FOR_CSV",
-                }
-            # Append to existing Excel file
-            if output_path.exists():
-                with pd.ExcelFile(output_path, engine="openpyxl") as xls:
-                    if output_sheet_name in xls.sheet_names:
-                        return {
-                            "status": "error",
-                            "message": f"工作表 {output_sheet_name} 已存在于 {output_path}",
-                            "error_code": "SHEET_ALREADY_EXISTS",
-                        }
-                with pd.ExcelWriter(output_path, engine="openpyxl", mode="a") as writer:
-                    merged_df.to_excel(writer, sheet_name=output_sheet_name, index=False)
+        removed_columns: List[str] = []
+        if out_of_core:
+            execution = "out_of_core"
+            row_count, columns, removed_columns = merge_out_of_core(
+                inputs, output_path, output_sheet_name, merge_type, merge_keys, output_type == "file"
+            )
+        elif streaming:
+            execution = "streaming"
+            columns = list(dict.fromkeys(col for input_cols in input_columns for col in input_cols))
+            row_count = stream_concat_to_csv(
+                [(path, df) for (path, _), df in zip(inputs, dfs)], output_path, columns, merge_type == "union"
+            )
+        else:
+            execution = "in_memory"
+            # Perform merge based on merge_type
+            if merge_type == "append":
+                try:
+                    merged_df = pd.concat(dfs, ignore_index=True)
+                except ValueError as e:
+                    return {
+                        "status": "error",
+                        "message": f"列名不一致，无法执行 append 合并: {str(e)}",
+                        "error_code": "COLUMN_MISMATCH",
+                    }
+            elif merge_type == "merge":
+                merged_df = join_frames(dfs, merge_keys)
+                # Detect and remove duplicate columns
+                removed_columns = find_duplicate_columns(merged_df, merge_keys)
+                if removed_columns:
+                    merged_df = merged_df.drop(columns=removed_columns)
+            elif merge_type == "union":
+                merged_df = pd.concat(dfs, ignore_index=True).drop_duplicates()
             else:
-                # Create new Excel file if it doesn't exist
-                merged_df.to_excel(output_path, sheet_name=output_sheet_name, index=False, engine="openpyxl")
+                merged_df = dfs[0]
+                for df in dfs[1:]:
+                    merged_df = pd.merge(merged_df, df, how="inner")
+
+            # Save merged file based on output_type: a new file, or a new sheet in an existing workbook
+            run_cpu_bound(write_dataframe_atomic, output_path, output_sheet_name, merged_df, output_type == "file")
+            row_count, columns = len(merged_df), merged_df.columns.tolist()
+        _dataframe_cache.invalidate(output_path)
 
         return {
             "status": "success",
-            "message": f"成功合并 {len(dfs)} 个数据集到 {output_path} ({output_type}: {output_sheet_name if output_ext != '.csv' else 'CSV'})",
+            "message": f"成功合并 {len(inputs)} 个数据集到 {output_path} ({output_type}: {output_sheet_name if output_ext != '.csv' else 'CSV'})",
             "file_path": str(output_path),
             "sheet_name": output_sheet_name if output_ext != ".csv" else None,
-            "rows": len(merged_df),
-            "columns": merged_df.columns.tolist(),
+            "rows": row_count,
+            "columns": columns,
             "merge_type": merge_type,
             "input_configs": input_configs,
+            "execution": execution,
+            "removed_columns": removed_columns,
         }
 
     except pd.errors.EmptyDataError:
@@ -507,19 +4461,22 @@ async def merge_multiple_data(
 
 
 @mcp.tool()
-async def insert_row_to_excel(
-    file_path: str, sheet_name: str = "Sheet1", data: List[Dict[str, Any]] = None
+@offload_to_executor(lock_arg="file_path")
+def insert_row_to_excel(
+    file_path: str, sheet_name: str = "Sheet1", data: List[Dict[str, Any]] = None, fsync: bool = False
 ) -> Dict[str, Any]:
     """
     Appends one or more rows of data to an existing Excel or CSV file.
 
     Description:
         This function adds new rows to an existing Excel (.xlsx, .xls) or CSV file. The new data must match the column structure of the existing file.
+        For CSV files only the header line is read and the new rows are appended in place, so the cost depends on the number of rows added, not on the file size.
 
     Args:
         file_path (str): Absolute path to the file (.xlsx, .xls, or .csv).
         sheet_name (str, optional): Name of the Excel worksheet (ignored for CSV). Defaults to "Sheet1".
         data (List[Dict[str, Any]]): Data to append as a list of dictionaries (single or multiple rows).
+        fsync (bool, optional): For CSV files, flush the appended rows to disk before returning. Defaults to False.
 
     Returns:
         Dict[str, Any]: Dictionary containing operation result or error information.
@@ -541,44 +4498,58 @@ async def insert_row_to_excel(
                 "error_code": "INVALID_FORMAT",
             }
 
-        # Read existing file
-        if file_extension == ".csv":
-            existing_df = pd.read_csv(full_path, encoding="utf-8")
-        else:
-            existing_df = pd.read_excel(full_path, sheet_name=sheet_name, engine="openpyxl")
-
-        # Convert new data to DataFrame
-        new_row = pd.DataFrame(data)
-        if set(new_row.columns) != set(existing_df.columns):
-            return {
-                "status": "error",
-                "message": "新数据的列名与现有文件不匹配",
-                "error_code": "COLUMN_MISMATCH",
-                "expected_columns": list(existing_df.columns),
-                "provided_columns": list(new_row.columns),
-            }
-
-        # Append new row
-        updated_df = pd.concat([existing_df, new_row], ignore_index=True)
+        # CSV fast path: validate against the header line only and append in place
         if file_extension == ".csv":
-            updated_df.to_csv(full_path, index=False, encoding="utf-8")
+            header = read_csv_header(full_path)
+            provided_columns = list(dict.fromkeys(key for row in data for key in row))
+            if set(provided_columns) != set(header):
+                return {
+                    "status": "error",
+                    "message": "新数据的列名与现有文件不匹配",
+                    "error_code": "COLUMN_MISMATCH",
+                    "expected_columns": header,
+                    "provided_columns": provided_columns,
+                }
+            # 已缓存的整表可直接给出总行数，否则不为此扫描全文件
+            cached_df = _dataframe_cache.peek(get_cache_key(full_path, None))
+            before_row_count = len(cached_df) if cached_df is not None else None
+            with journal_operation(
+                full_path, None, "insert_row_to_excel", {"data": data}, before_row_count, append_only=True
+            ):
+                append_rows_to_csv(full_path, header, data, fsync=fsync)
+            _dataframe_cache.invalidate(full_path)
             return {
                 "status": "success",
                 "message": "成功向 CSV 文件追加数据",
                 "file_path": str(full_path),
-                "rows_added": len(new_row),
-                "total_rows": len(updated_df),
+                "rows_added": len(data),
+                "total_rows": len(cached_df) + len(data) if cached_df is not None else None,
             }
-        else:
-            updated_df.to_excel(full_path, sheet_name=sheet_name, index=False, engine="openpyxl")
+
+        # Excel: write only the new cells; other worksheets are left untouched
+        cached_df = _dataframe_cache.peek(get_cache_key(full_path, sheet_name))
+        before_row_count = len(cached_df) if cached_df is not None else None
+        with journal_operation(full_path, sheet_name, "insert_row_to_excel", {"data": data}, before_row_count):
+            header, total_rows = run_cpu_bound(
+                append_rows_to_worksheet, full_path, sheet_name, data, get_header_skiprows(full_path, sheet_name) + 1
+            )
+        if total_rows is None:
             return {
-                "status": "success",
-                "message": f"成功向工作表 {sheet_name} 追加数据",
-                "file_path": str(full_path),
-                "sheet_name": sheet_name,
-                "rows_added": len(new_row),
-                "total_rows": len(updated_df),
+                "status": "error",
+                "message": "新数据的列名与现有文件不匹配",
+                "error_code": "COLUMN_MISMATCH",
+                "expected_columns": header,
+                "provided_columns": list(dict.fromkeys(key for row in data for key in row)),
             }
+        _dataframe_cache.invalidate(full_path)
+        return {
+            "status": "success",
+            "message": f"成功向工作表 {sheet_name} 追加数据",
+            "file_path": str(full_path),
+            "sheet_name": sheet_name,
+            "rows_added": len(data),
+            "total_rows": total_rows,
+        }
 
     except pd.errors.EmptyDataError:
         return {"status": "error", "message": f"文件或工作表 {sheet_name} 为空或无法读取", "error_code": "EMPTY_DATA"}
@@ -589,11 +4560,13 @@ async def insert_row_to_excel(
 
 
 @mcp.tool()
-async def append_column_to_excel(
+@offload_to_executor(lock_arg="file_path")
+def append_column_to_excel(
     file_path: str,
     sheet_name: str = "Sheet1",
     column_name: Optional[Union[str, List[str]]] = None,
     column_data: Optional[Union[Any, List[Any]]] = None,
+    expression: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     Adds one or more new columns to an existing Excel or CSV file.
@@ -601,6 +4574,8 @@ async def append_column_to_excel(
     Description:
         This function appends new column(s) to an existing Excel (.xlsx, .xls) or CSV file.
         The new column(s) can be filled with a single value, a list of values matching the row count, or NaN if no data is provided.
+        Derived columns should use `expression` instead of column_data: it is evaluated server-side over whole columns,
+        so the values never need to be read and sent back.
 
     Args:
         file_path (str): Absolute path to the file (.xlsx, .xls, or .csv).
@@ -610,12 +4585,24 @@ async def append_column_to_excel(
             - None: Fills the column with NaN.
             - Single value: Applies the same value to all rows.
             - List: Must match the number of rows in the file.
+        expression (Optional[str], optional): Expression computed from existing columns, e.g. "销售额 * 1.1" or
+            "concat(学号, '_', 姓名)". Cannot be combined with column_data. Supports:
+            - Column names (wrap names with spaces or symbols in backticks, e.g. `单价(元)`), numbers and 'strings'.
+            - Arithmetic + - * / // % **, comparisons == != > >= < <=, and / or / not, and `a if condition else b`.
+            - Functions: concat, round, abs, upper, lower, strip, len, coalesce, where(condition, a, b).
+            - Limits: at most 1000 characters and 32 levels of nesting; ** exponents up to 100.
 
     Returns:
         Dict[str, Any]: Dictionary containing operation result or error information.
     """
     if not column_name:
         return {"status": "error", "message": "必须提供新列的名称", "error_code": "NO_COLUMN_NAME"}
+    if expression is not None and column_data is not None:
+        return {
+            "status": "error",
+            "message": "column_data 与 expression 不能同时提供",
+            "error_code": "CONFLICTING_ARGUMENTS",
+        }
 
     try:
         full_path = Path(get_excel_path(file_path))
@@ -632,10 +4619,7 @@ async def append_column_to_excel(
             }
 
         # Read existing file
-        if file_extension == ".csv":
-            df = pd.read_csv(full_path, encoding="utf-8")
-        else:
-            df = pd.read_excel(full_path, sheet_name=sheet_name, engine="openpyxl")
+        df = load_dataframe(full_path, sheet_name)
 
         # Handle single or multiple column names
         column_names = [column_name] if isinstance(column_name, str) else column_name
@@ -660,18 +4644,26 @@ async def append_column_to_excel(
                 "provided_length": len(column_data),
             }
 
-        # Add columns
-        for col in column_names:
-            if column_data is None:
-                df[col] = np.nan
-            elif isinstance(column_data, list):
-                df[col] = column_data
-            else:
-                df[col] = column_data
+        # Build column values
+        if expression is not None:
+            try:
+                values = evaluate_expression(df, expression).tolist()
+            except ExpressionError as e:
+                return {"status": "error", "message": str(e), "error_code": e.error_code, "expression": expression}
+        elif column_data is None:
+            values = [None] * row_count
+        elif isinstance(column_data, list):
+            values = column_data
+        else:
+            values = [column_data] * row_count
 
         # Save updated file
+        journal_args = {"column_name": column_name, "column_data": column_data, "expression": expression}
         if file_extension == ".csv":
-            df.to_csv(full_path, index=False, encoding="utf-8")
+            df = df.assign(**{col: values for col in column_names})
+            with journal_operation(full_path, None, "append_column_to_excel", journal_args, row_count):
+                _dataframe_cache.invalidate(full_path)
+                run_cpu_bound(write_dataframe_atomic, full_path, None, df)
             return {
                 "status": "success",
                 "message": f"成功向 CSV 文件添加列 {', '.join(column_names)}",
@@ -679,7 +4671,20 @@ async def append_column_to_excel(
                 "new_column_names": column_names,
             }
         else:
-            df.to_excel(full_path, sheet_name=sheet_name, index=False, engine="openpyxl")
+            # Excel: write only the new column cells; other worksheets are left untouched
+            skiprows = get_header_skiprows(full_path, sheet_name)
+            with journal_operation(full_path, sheet_name, "append_column_to_excel", journal_args, row_count):
+                _dataframe_cache.invalidate(full_path)
+                run_cpu_bound(
+                    write_columns_to_worksheet,
+                    full_path,
+                    sheet_name,
+                    {col: values for col in column_names},
+                    skiprows + 1,
+                )
+            if skiprows:
+                # 表头新增了列，刷新记录，避免重新校验时判定表头位置失效
+                record_header_skiprows(full_path, sheet_name, skiprows)
             return {
                 "status": "success",
                 "message": f"成功向工作表 {sheet_name} 添加列 {', '.join(column_names)}",
@@ -697,28 +4702,40 @@ async def append_column_to_excel(
 
 
 @mcp.tool()
-async def delete_excel_row_or_column(
+@offload_to_executor(lock_arg="file_path")
+def delete_excel_row_or_column(
     file_path: str,
     sheet_name: str = "Sheet1",
     row: Optional[Union[int, List[int]]] = None,
     column: Optional[Union[str, List[str]]] = None,
     condition: Optional[Dict[str, Any]] = None,
+    dry_run: bool = False,
 ) -> Dict[str, Any]:
     """
     Deletes specific rows, columns, or rows matching a condition from an Excel or CSV file.
 
     Description:
         This function removes specified rows (by index), columns (by name), or rows matching a given condition from an Excel (.xlsx, .xls) or CSV file.
+        Row indexes and all condition criteria are combined into one mask and applied in a single pass.
+        Use dry_run=True to get the number of rows that would be deleted without modifying the file.
 
     Args:
         file_path (str): Absolute path to the file (.xlsx, .xls, or .csv).
         sheet_name (str, optional): Name of the Excel worksheet (ignored for CSV). Defaults to "Sheet1".
         row (Optional[Union[int, List[int]]], optional): Row index(es) to delete (0-based). Defaults to None.
         column (Optional[Union[str, List[str]]], optional): Column name(s) to delete. Defaults to None.
-        condition (Optional[Dict[str, Any]], optional): Filter condition, e.g., {"Column_Name": "Value"}.
+        condition (Optional[Dict[str, Any]], optional): Rows to delete by value. Each key is one criterion and a row is
+            deleted if it matches any of them. Criteria use the read_range_sheet_data syntax:
+            - {"Column_Name": "Value"}: equality; a list value means "in".
+            - {"Column_Name": {"op": "between", "value": [low, high]}}: op is one of ==, !=, >, >=, <, <=, in, between, contains, isnull.
+            - {"and": [condition, ...]} or {"or": [condition, ...]}: nested combinations.
+        dry_run (bool, optional): If True, only reports deleted_rows and remaining_rows; the file is not changed. Defaults to False.
 
     Returns:
-        Dict[str, Any]: Dictionary containing operation result or error information.
+        Dict[str, Any]: Dictionary containing operation result or error information, including:
+            - deleted_rows (int): Number of rows deleted (or that would be deleted in dry_run mode).
+            - deleted_columns (List[str]): Columns deleted.
+            - remaining_rows (int): Number of rows left after the deletion.
     """
     # 验证输入参数
     if row is None and column is None and condition is None:
@@ -742,16 +4759,22 @@ async def delete_excel_row_or_column(
                 "error_code": "INVALID_FORMAT",
             }
 
-        # 读取文件
-        if file_extension == ".csv":
-            df = pd.read_csv(full_path, encoding="utf-8")
-        else:
-            df = pd.read_excel(full_path, sheet_name=sheet_name, engine="openpyxl")
+        # 读取文件（CSV 只按行号删除时借助行偏移索引直接拼接字节范围，不解码为 DataFrame；
+        # 大 CSV 不整表加载，只读取表头，删除时逐块改写）
+        splice_rows = file_extension == ".csv" and row is not None and column is None and condition is None
+        chunked = not splice_rows and use_chunked_csv(full_path)
+        df = None if chunked or splice_rows else load_dataframe(full_path, sheet_name)
+        remaining_columns = read_csv_columns(full_path) if chunked else [] if splice_rows else df.columns.tolist()
 
         # 处理行删除（支持负索引）
         operation = []
-        row_count = len(df)
+        normalized_rows = []
+        row_count = len(df) if df is not None else None
         if row is not None:
+            if row_count is None and splice_rows:
+                row_count = len(get_line_index(full_path)[1])
+            elif row_count is None:
+                row_count = filter_csv_chunks(full_path, None, None, count_only=True)
             rows_to_delete = [row] if isinstance(row, int) else row
             # 将负索引转换为正索引
             normalized_rows = []
@@ -776,63 +4799,97 @@ async def delete_excel_row_or_column(
                     "message": f"行索引 {invalid_rows} 超出范围（有效范围: 0 到 {row_count-1}）",
                     "error_code": "INVALID_ROW_INDEX",
                 }
-            # 使用转换后的正索引进行删除
-            df = df.drop(index=normalized_rows).reset_index(drop=True)
             operation.append(f"行 {rows_to_delete}")
 
         # 处理列删除
+        columns_to_delete = []
         if column is not None:
             columns_to_delete = [column] if isinstance(column, str) else column
-            invalid_columns = [c for c in columns_to_delete if c not in df.columns]
+            invalid_columns = [c for c in columns_to_delete if c not in remaining_columns]
             if invalid_columns:
                 return {
                     "status": "error",
                     "message": f"列名 {invalid_columns} 不存在于文件",
                     "error_code": "COLUMN_NOT_FOUND",
                 }
-            df = df.drop(columns=columns_to_delete)
             operation.append(f"列 {columns_to_delete}")
 
-        # 根据条件删除行
-        if condition is not None:
-            for col, val in condition.items():
-                if col not in df.columns:
-                    return {"status": "error", "message": f"列名 {col} 不存在于文件", "error_code": "COLUMN_NOT_FOUND"}
-                initial_rows = len(df)
-                df = df[df[col] != val].reset_index(drop=True)
-                deleted_rows = initial_rows - len(df)
-                if deleted_rows == 0:
-                    return {
-                        "status": "warning",
-                        "message": f"未找到列 {col} 中值为 {val} 的行",
-                        "error_code": "NO_MATCHING_ROWS",
-                    }
-                operation.append(f"{deleted_rows} 行（列 {col} 中值为 {val}）")
+        # 根据条件删除行：顶层每个键编译为一个表达式树，与行号一起合成一个删除掩码
+        criteria = compile_delete_criteria(condition) if condition is not None else []
+        for node, _ in criteria:
+            missing_columns = [col for col in get_condition_columns(node) if col not in remaining_columns]
+            if missing_columns:
+                col = missing_columns[0]
+                return {"status": "error", "message": f"列名 {col} 不存在于文件", "error_code": "COLUMN_NOT_FOUND"}
 
-        if not operation:
+        if not operation and not criteria:
             return {"status": "error", "message": "无效的操作组合", "error_code": "INVALID_OPERATION"}
 
-        # 将更新后的 DataFrame 写回文件
+        remaining_columns = [c for c in remaining_columns if c not in columns_to_delete]
+        journal_args = {"row": row, "column": column, "condition": condition}
+        if splice_rows:
+            deleted_rows = len(set(normalized_rows))
+            if dry_run:
+                return get_delete_result(full_path, None, operation, deleted_rows, [], row_count - deleted_rows, True)
+            with journal_operation(full_path, None, "delete_excel_row_or_column", journal_args, row_count):
+                _dataframe_cache.invalidate(full_path)
+                remaining_rows = delete_csv_rows_by_offset(full_path, normalized_rows)
+            return get_delete_result(full_path, None, operation, deleted_rows, [], remaining_rows)
+
+        if chunked:
+            if dry_run:
+                return delete_from_csv_chunked(
+                    full_path, normalized_rows, columns_to_delete, criteria, remaining_columns, operation, True
+                )
+            with journal_operation(full_path, None, "delete_excel_row_or_column", journal_args, row_count):
+                return delete_from_csv_chunked(
+                    full_path, normalized_rows, columns_to_delete, criteria, remaining_columns, operation
+                )
+
+        # 一次计算删除掩码（行号 + 全部条件）
+        matched = [0] * len(criteria)
+        newly_deleted = [0] * len(criteria)
+        mask = build_delete_mask(df, np.asarray(normalized_rows, dtype=np.int64), criteria, matched, newly_deleted)
+        unmatched = [label for (_, label), n in zip(criteria, matched) if n == 0]
+        if unmatched:
+            return {"status": "warning", "message": f"未找到{unmatched[0]} 的行", "error_code": "NO_MATCHING_ROWS"}
+        operation.extend(f"{n} 行（{label}）" for (_, label), n in zip(criteria, newly_deleted))
+
+        deleted_positions = np.flatnonzero(mask)
+        deleted_rows = len(deleted_positions)
+        remaining_rows = len(df) - deleted_rows
+        sheet_key = get_sheet_key(full_path, sheet_name)
+        if dry_run:
+            return get_delete_result(
+                full_path, sheet_key, operation, deleted_rows, columns_to_delete, remaining_rows, True
+            )
+
+        # 将结果写回文件
         if file_extension == ".csv":
-            df.to_csv(full_path, index=False, encoding="utf-8")
-            return {
-                "status": "success",
-                "message": f"成功从 CSV 文件删除 {', '.join(operation)}",
-                "file_path": str(full_path),
-                "operations": operation,
-                "remaining_rows": len(df),
-            }
+            # 保留的行和列一次切片得到，只复制一次
+            kept = df.iloc[np.flatnonzero(~mask), np.flatnonzero(~df.columns.isin(columns_to_delete))]
+            with journal_operation(full_path, None, "delete_excel_row_or_column", journal_args, row_count):
+                _dataframe_cache.invalidate(full_path)
+                run_cpu_bound(write_dataframe_atomic, full_path, None, kept)
         else:
-            df.to_excel(full_path, sheet_name=sheet_name, index=False, engine="openpyxl")
-            return {
-                "status": "success",
-                "message": f"成功从工作表 {sheet_name} 删除 {', '.join(operation)}",
-                "file_path": str(full_path),
-                "sheet_name": sheet_name,
-                "operations": operation,
-                "remaining_rows": len(df),
-            }
-
+            # Excel: 只删除对应的行和列，其他工作表保持不变
+            skiprows = get_header_skiprows(full_path, sheet_name)
+            with journal_operation(full_path, sheet_name, "delete_excel_row_or_column", journal_args, row_count):
+                _dataframe_cache.invalidate(full_path)
+                run_cpu_bound(
+                    delete_from_worksheet,
+                    full_path,
+                    sheet_name,
+                    deleted_positions.tolist(),
+                    columns_to_delete,
+                    skiprows + 1,
+                )
+            if skiprows and columns_to_delete:
+                record_header_skiprows(full_path, sheet_name, skiprows)
+        return get_delete_result(full_path, sheet_key, operation, deleted_rows, columns_to_delete, remaining_rows)
+
+    except ConditionError as ce:
+        return {"status": "error", "message": str(ce), "error_code": ce.error_code}
     except pd.errors.EmptyDataError:
         return {"status": "error", "message": f"文件或工作表 {sheet_name} 为空或无法读取", "error_code": "EMPTY_DATA"}
     except PermissionError:
@@ -842,12 +4899,17 @@ async def delete_excel_row_or_column(
 
 
 @mcp.tool()
-async def sort_excel_data(
+@offload_to_executor()
+def sort_excel_data(
     file_path: str,
     sheet_name: str = "Sheet1",
     sort_columns: Union[str, List[str]] = None,
     ascending: Union[bool, List[bool]] = True,
     top_n: Optional[int] = 10,
+    page_size: Optional[int] = None,
+    cursor: Optional[str] = None,
+    output_format: str = "records",
+    precision: Optional[int] = None,
 ) -> Dict[str, Any]:
     """
     Sorts data in an Excel or CSV file by specified columns and returns the sorted data, optionally limited to the top N rows.
@@ -855,6 +4917,7 @@ async def sort_excel_data(
     Description:
         This function sorts the data in an Excel (.xlsx, .xls) or CSV file based on one or more specified columns and sort orders (ascending or descending).
         It can return all sorted rows or a specified number of top rows.
+        Large results are paginated: when has_more is true, call again with the returned next_cursor to fetch the next page.
 
     Args:
         file_path (str): The absolute path to the input file (.xlsx, .xls, or .csv).
@@ -862,6 +4925,11 @@ async def sort_excel_data(
         sort_columns (Union[str, List[str]], optional): The column(s) to sort by. If None, returns the original data unsorted.
         ascending (Union[bool, List[bool]], optional): The sort order for each column (True for ascending, False for descending). If a single bool, applies to all columns. Defaults to True.
         top_n (Optional[int], optional): The number of top rows to return. If None, returns all sorted rows. Defaults to 10.
+        page_size (Optional[int], optional): Maximum rows per page. Defaults to the server page size (500).
+        cursor (Optional[str], optional): next_cursor from a previous call; the other sort parameters are ignored when set.
+        output_format (str, optional): Encoding of "data": "records" (list of row objects), "columnar" (list of row arrays
+            in the order of "columns", without repeating column names), "csv" text or a "markdown" table. Defaults to "records".
+        precision (Optional[int], optional): Round float values to this many decimal places. Defaults to None (no rounding).
 
     Returns:
         Dict[str, Any]: Dictionary containing sorted data or error information.
@@ -880,13 +4948,32 @@ async def sort_excel_data(
                 "error_code": "INVALID_FORMAT",
             }
 
-        # Read data
-        if file_extension == ".csv":
-            df = pd.read_csv(full_path, encoding="utf-8")
-        else:
-            df = pd.read_excel(full_path, sheet_name=sheet_name, engine="openpyxl")
+        output_format, precision = normalize_output_options(output_format, precision)
+
+        # Continue a paginated result
+        if cursor:
+            sorted_df, offset, cursor_page_size, result_id = resume_result_set(cursor, str(full_path))
+            page, page_info = paginate_dataframe(
+                sorted_df, str(full_path), cursor_page_size if page_size is None else page_size, offset, result_id
+            )
+            return {
+                "status": "success",
+                "message": "成功获取排序结果的下一页",
+                "file_path": str(full_path),
+                "sheet_name": sheet_name if file_extension != ".csv" else None,
+                "row_count": len(sorted_df),
+                "columns": page.columns.tolist(),
+                "data": encode_rows(page, output_format, precision),
+                "format": output_format,
+                **page_info,
+            }
+
+        # Read data (Top-N queries on a large CSV are answered chunk by chunk instead)
+        chunked = bool(sort_columns) and top_n is not None and use_chunked_csv(full_path)
+        df = None if chunked else load_dataframe(full_path, sheet_name)
+        available_columns = read_csv_columns(full_path) if chunked else df.columns.tolist()
 
-        if df.empty:
+        if df is not None and df.empty:
             return {
                 "status": "warning",
                 "message": "文件中未找到数据",
@@ -901,6 +4988,7 @@ async def sort_excel_data(
 
         # Validate sort columns
         if not sort_columns:
+            page, page_info = paginate_dataframe(df, str(full_path), page_size)
             return {
                 "status": "warning",
                 "message": "未指定排序列，返回原始数据",
@@ -910,11 +4998,13 @@ async def sort_excel_data(
                 "ascending": [],
                 "row_count": len(df),
                 "columns": df.columns.tolist(),
-                "data": df.to_dict(orient="records"),
+                "data": encode_rows(page, output_format, precision),
+                "format": output_format,
+                **page_info,
             }
 
         sort_cols = [sort_columns] if isinstance(sort_columns, str) else sort_columns
-        invalid_cols = [col for col in sort_cols if col not in df.columns]
+        invalid_cols = [col for col in sort_cols if col not in available_columns]
         if invalid_cols:
             return {
                 "status": "error",
@@ -931,15 +5021,16 @@ async def sort_excel_data(
                 "error_code": "ASCENDING_MISMATCH",
             }
 
-        # Perform sorting
-        sorted_df = df.sort_values(by=sort_cols, ascending=asc)
+        if top_n is not None and top_n <= 0:
+            return {"status": "error", "message": "top_n 必须为正整数", "error_code": "INVALID_TOP_N"}
 
-        # Select top N rows if specified
-        if top_n is not None:
-            if top_n <= 0:
-                return {"status": "error", "message": "top_n 必须为正整数", "error_code": "INVALID_TOP_N"}
-            sorted_df = sorted_df.head(top_n)
+        # Perform sorting: partial selection for small top_n, cached sort permutation for repeated queries
+        if chunked:
+            sorted_df = select_top_rows_chunked(full_path, sort_cols, asc, top_n)
+        else:
+            sorted_df = select_top_rows(df, sort_cols, asc, top_n, get_cache_key(full_path, sheet_name))
 
+        page, page_info = paginate_dataframe(sorted_df, str(full_path), page_size)
         return {
             "status": "success",
             "message": f"成功对列 {sort_cols} 进行排序",
@@ -949,19 +5040,753 @@ async def sort_excel_data(
             "ascending": asc,
             "row_count": len(sorted_df),
             "columns": sorted_df.columns.tolist(),
-            "data": sorted_df.to_dict(orient="records"),
+            "data": encode_rows(page, output_format, precision),
+            "format": output_format,
+            **page_info,
         }
 
+    except (CursorError, OutputFormatError) as ce:
+        return {"status": "error", "message": str(ce), "error_code": ce.error_code}
     except pd.errors.EmptyDataError:
         return {"status": "error", "message": "文件为空或格式不正确", "error_code": "EMPTY_DATA"}
     except Exception as e:
         return {"status": "error", "message": f"排序数据时发生错误: {str(e)}", "error_code": "SORT_ERROR"}
 
 
-def main():
-    # mcp.run(transport="stdio")
-    mcp.run(transport="sse", host="127.0.0.1", port=8000, log_level="info")  # 绑定到本机  # 可修改端口  # 或 "debug"
-    return mcp
+@mcp.tool()
+@offload_to_executor()
+def aggregate_excel_data(
+    file_path: str,
+    sheet_name: str = "Sheet1",
+    group_by: Optional[Union[str, List[str]]] = None,
+    metrics: Optional[Dict[str, Union[str, List[str]]]] = None,
+    condition: Optional[Dict[str, Any]] = None,
+    page_size: Optional[int] = None,
+    cursor: Optional[str] = None,
+    output_format: str = "records",
+    precision: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Groups the rows of an Excel or CSV file and returns only the aggregated values, e.g. total sales per region.
+
+    Description:
+        This function computes group-by aggregates on the server (vectorized pandas when the sheet is cached in memory,
+        otherwise DuckDB over the cached Parquet copy or the CSV file, reading only the columns involved) and returns
+        one row per group instead of the raw rows. Use it for summaries such as "按区域汇总销售额" or totals, averages,
+        counts and min/max, rather than reading all rows and computing in context.
+        Groups are sorted by the group_by columns; rows whose group value is empty form their own group, listed last.
+
+    Args:
+        file_path (str): Absolute path to the file (.xlsx, .xls, or .csv).
+        sheet_name (str, optional): Name of the Excel worksheet (ignored for CSV). Defaults to "Sheet1".
+        group_by (Optional[Union[str, List[str]]], optional): Column(s) to group by. If None, aggregates the whole sheet into one row.
+        metrics (Optional[Dict[str, Union[str, List[str]]]], optional): Column to statistic(s), e.g. {"销售额": ["sum", "mean"], "学号": "count"}.
+            Supported: sum, mean, count, min, max, median, std, nunique (count ignores empty cells).
+            Result columns are named "<column>_<statistic>". If None, only the number of rows per group is returned (column "count").
+        condition (Optional[Dict[str, Any]], optional): Filter applied before grouping, same syntax as read_range_sheet_data.
+        page_size (Optional[int], optional): Maximum groups per page. Defaults to the server page size (500).
+        cursor (Optional[str], optional): next_cursor from a previous call; the other parameters are ignored when set.
+        output_format (str, optional): Encoding of "data": "records" (list of row objects), "columnar" (list of row arrays
+            in the order of "columns", without repeating column names), "csv" text or a "markdown" table. Defaults to "records".
+        precision (Optional[int], optional): Round float values to this many decimal places. Defaults to None (no rounding).
+
+    Returns:
+        Dict[str, Any]: Dictionary containing the aggregated rows or error information, including:
+            - row_count (int): Number of groups.
+            - columns (List[str]): Group columns followed by the metric columns.
+            - data (Any): Aggregated rows of the current page, encoded as output_format.
+            - execution (str): "in_memory" or "duckdb".
+    """
+    try:
+        full_path = Path(get_excel_path(file_path))
+        if not full_path.exists():
+            return {"status": "error", "message": f"文件 {full_path} 不存在", "error_code": "FILE_NOT_FOUND"}
+
+        file_extension = full_path.suffix.lower()
+        if file_extension not in SUPPORTED_FORMATS:
+            return {
+                "status": "error",
+                "message": f"不支持的文件格式: {file_extension}. 支持格式: {', '.join(SUPPORTED_FORMATS)}",
+                "error_code": "INVALID_FORMAT",
+            }
+
+        output_format, precision = normalize_output_options(output_format, precision)
+
+        # Continue a paginated result
+        if cursor:
+            result, offset, cursor_page_size, result_id = resume_result_set(cursor, str(full_path))
+            page, page_info = paginate_dataframe(
+                result, str(full_path), cursor_page_size if page_size is None else page_size, offset, result_id
+            )
+            return {
+                "status": "success",
+                "message": "成功获取聚合结果的下一页",
+                "file_path": str(full_path),
+                "sheet_name": sheet_name if file_extension != ".csv" else None,
+                "row_count": len(result),
+                "columns": page.columns.tolist(),
+                "data": encode_rows(page, output_format, precision),
+                "format": output_format,
+                **page_info,
+            }
+
+        group_cols = [group_by] if isinstance(group_by, str) else list(group_by or [])
+        metric_pairs = normalize_metrics(metrics)
+        result, execution = aggregate_rows(full_path, sheet_name, group_cols, metric_pairs, condition)
+
+        page, page_info = paginate_dataframe(result, str(full_path), page_size)
+        return {
+            "status": "success",
+            "message": f"成功按 {group_cols} 聚合，共 {len(result)} 组" if group_cols else "成功完成整表聚合",
+            "file_path": str(full_path),
+            "sheet_name": sheet_name if file_extension != ".csv" else None,
+            "group_by": group_cols,
+            "metrics": [f"{column}_{func}" for column, func in metric_pairs],
+            "row_count": len(result),
+            "columns": result.columns.tolist(),
+            "data": encode_rows(page, output_format, precision),
+            "format": output_format,
+            "execution": execution,
+            **page_info,
+        }
+
+    except (AggregateError, ConditionError, CursorError, OutputFormatError) as e:
+        return {"status": "error", "message": str(e), "error_code": e.error_code}
+    except pd.errors.EmptyDataError:
+        return {"status": "error", "message": "文件为空或格式不正确", "error_code": "EMPTY_DATA"}
+    except Exception as e:
+        return {"status": "error", "message": f"聚合数据时发生错误: {str(e)}", "error_code": "AGGREGATE_ERROR"}
+
+
+# apply_operations 支持的操作类型
+BATCH_OPERATION_TYPES = ["insert", "append_column", "delete", "sort", "update"]
+
+
+class OperationError(ValueError):
+    """批量操作中的某一步不合法。"""
+
+    def __init__(self, message: str, error_code: str = "INVALID_OPERATION"):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+def _normalize_row_positions(row: Union[int, List[int]], row_count: int) -> List[int]:
+    """将行索引（支持负索引）转换为 0 起始的正索引，越界时抛出 OperationError。"""
+    positions = []
+    for r in [row] if isinstance(row, int) else row:
+        position = r if r >= 0 else row_count + r
+        if not 0 <= position < row_count:
+            raise OperationError(
+                f"行索引 {r} 超出范围（有效范围: -{row_count} 到 {row_count - 1}）", "INVALID_ROW_INDEX"
+            )
+        positions.append(position)
+    return positions
+
+
+def _apply_insert(df: pd.DataFrame, op: Dict[str, Any]) -> Tuple[pd.DataFrame, int, Optional[Dict[str, Any]]]:
+    data = op.get("data")
+    if not data:
+        raise OperationError("insert 操作缺少 data", "NO_DATA")
+    new_rows = pd.DataFrame(data)
+    if set(new_rows.columns) != set(df.columns):
+        raise OperationError(f"新数据的列名与现有列 {df.columns.tolist()} 不匹配", "COLUMN_MISMATCH")
+    new_rows = new_rows[df.columns]
+    return pd.concat([df, new_rows], ignore_index=True), len(new_rows), {"append_rows": new_rows}
+
+
+def _apply_append_column(df: pd.DataFrame, op: Dict[str, Any]) -> Tuple[pd.DataFrame, int, Optional[Dict[str, Any]]]:
+    column_name = op.get("column_name")
+    if not column_name:
+        raise OperationError("append_column 操作缺少 column_name", "NO_COLUMN_NAME")
+    column_names = [column_name] if isinstance(column_name, str) else column_name
+    for col in column_names:
+        if col in df.columns and not df[col].isna().all():
+            raise OperationError(f"列名 {col} 已存在且包含非空数据，无法覆盖", "COLUMN_EXISTS_NON_EMPTY")
+
+    column_data, expression = op.get("column_data"), op.get("expression")
+    if expression is not None:
+        if column_data is not None:
+            raise OperationError("column_data 与 expression 不能同时提供", "CONFLICTING_ARGUMENTS")
+        value = evaluate_expression(df, expression)
+    elif isinstance(column_data, list) and len(column_data) != len(df):
+        raise OperationError(f"列数据长度 {len(column_data)} 与行数 {len(df)} 不匹配", "DATA_LENGTH_MISMATCH")
+    else:
+        value = np.nan if column_data is None else column_data
+    result = df.assign(**{col: value for col in column_names})
+    return result, len(df), {"columns": {col: result[col] for col in column_names}}
+
+
+def _apply_delete(df: pd.DataFrame, op: Dict[str, Any]) -> Tuple[pd.DataFrame, int, Optional[Dict[str, Any]]]:
+    row, column, condition = op.get("row"), op.get("column"), op.get("condition")
+    if row is None and column is None and condition is None:
+        raise OperationError("delete 操作必须指定 row、column 或 condition", "NO_DELETE_CRITERIA")
+
+    keep = np.ones(len(df), dtype=bool)
+    if row is not None:
+        keep[_normalize_row_positions(row, len(df))] = False
+    if condition is not None:
+        keep &= ~build_condition_mask(df, normalize_condition(condition))
+    result = df[keep].reset_index(drop=True)
+
+    columns_to_delete = []
+    if column is not None:
+        columns_to_delete = [column] if isinstance(column, str) else column
+        invalid_columns = [c for c in columns_to_delete if c not in df.columns]
+        if invalid_columns:
+            raise OperationError(f"列名 {invalid_columns} 不存在于文件", "COLUMN_NOT_FOUND")
+        result = result.drop(columns=columns_to_delete)
+    edit = {"delete_rows": np.flatnonzero(~keep), "delete_columns": columns_to_delete}
+    return result, int(len(df) - keep.sum()), edit
+
+
+def _apply_sort(df: pd.DataFrame, op: Dict[str, Any]) -> Tuple[pd.DataFrame, int, Optional[Dict[str, Any]]]:
+    sort_columns = op.get("sort_columns")
+    if not sort_columns:
+        raise OperationError("sort 操作缺少 sort_columns", "NO_SORT_COLUMNS")
+    sort_cols = [sort_columns] if isinstance(sort_columns, str) else sort_columns
+    invalid_cols = [col for col in sort_cols if col not in df.columns]
+    if invalid_cols:
+        raise OperationError(f"排序列 {invalid_cols} 不存在于文件中", "INVALID_SORT_COLUMN")
+    ascending = op.get("ascending", True)
+    asc = ascending if isinstance(ascending, list) else [ascending] * len(sort_cols)
+    if len(asc) != len(sort_cols):
+        raise OperationError(f"排序顺序参数数量 {len(asc)} 与排序列数量 {len(sort_cols)} 不匹配", "ASCENDING_MISMATCH")
+    # 排序移动整行，无法表示为单元格修改，写回时重写整个数据区
+    return df.sort_values(by=sort_cols, ascending=asc, kind="stable").reset_index(drop=True), len(df), None
+
+
+def _apply_update(df: pd.DataFrame, op: Dict[str, Any]) -> Tuple[pd.DataFrame, int, Optional[Dict[str, Any]]]:
+    values = op.get("values")
+    if not values or not isinstance(values, dict):
+        raise OperationError("update 操作缺少 values（列名到新值的映射）", "NO_UPDATE_VALUES")
+    invalid_columns = [c for c in values if c not in df.columns]
+    if invalid_columns:
+        raise OperationError(f"列名 {invalid_columns} 不存在于文件", "COLUMN_NOT_FOUND")
+
+    condition = op.get("condition")
+    mask = build_condition_mask(df, normalize_condition(condition)) if condition else np.ones(len(df), dtype=bool)
+    # where 会在新值与原列类型不兼容时自动放宽列类型（如数值列写入文本）
+    result = df.assign(**{col: _update_column(df[col], mask, value) for col, value in values.items()})
+    return result, int(mask.sum()), {"update_rows": np.flatnonzero(mask), "values": values}
+
+
+def _update_column(series: pd.Series, mask: np.ndarray, value: Any) -> pd.Series:
+    """
+    把 mask 选中的行更新为 value。
+
+    字典编码列写入新的文本取值时追加为类别，并保持类别按字典序排列（按编码排序的结果与按文本排序一致）；
+    写入非文本值时还原为对象列。
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype) and value is not None:
+        if not isinstance(value, str):
+            series = series.astype(object)
+        elif value not in series.cat.categories:
+            series = series.cat.set_categories(sorted([*series.cat.categories, value]))
+    return series.where(~mask, value)
+
+
+# 处理函数返回 (执行后的 DataFrame, 受影响行数, 对工作表的修改)，修改的格式见 apply_edits_to_worksheet
+_BATCH_OPERATION_HANDLERS = {
+    "insert": _apply_insert,
+    "append_column": _apply_append_column,
+    "delete": _apply_delete,
+    "sort": _apply_sort,
+    "update": _apply_update,
+}
+
+
+@mcp.tool()
+@offload_to_executor(lock_arg="file_path")
+def apply_operations(file_path: str, sheet_name: str = "Sheet1", ops: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Applies an ordered batch of insert / append_column / delete / sort / update operations to one sheet in a single transaction.
+
+    Description:
+        This function loads the sheet once, applies every operation in memory in the given order, and writes the result back once.
+        The write goes to a temporary file that atomically replaces the original, so either all operations are saved or none are.
+        Excel worksheets are edited in place: only the affected cells, rows and columns change (a sort rewrites the data below the
+        header), so title rows above the header, cell formatting, column widths and other worksheets are preserved.
+        If any operation is invalid, nothing is written and the per-operation results show which one failed.
+        Row indexes and conditions in each operation refer to the data as produced by the previous operations.
+
+    Args:
+        file_path (str): Absolute path to the file (.xlsx, .xls, or .csv).
+        sheet_name (str, optional): Name of the Excel worksheet (ignored for CSV). Defaults to "Sheet1".
+        ops (List[Dict[str, Any]]): Operations to apply, each with an "op" key:
+            - {"op": "insert", "data": [{...}, ...]}: append rows (same columns as the sheet).
+            - {"op": "append_column", "column_name": "New", "column_data": value or [values]}: add column(s);
+              use "expression" instead of "column_data" to derive it from other columns (same syntax as append_column_to_excel).
+            - {"op": "delete", "row": 0 or [0, -1], "column": "Col" or [...], "condition": {...}}: delete rows/columns.
+            - {"op": "sort", "sort_columns": "Col" or [...], "ascending": true or [...]}: reorder rows.
+            - {"op": "update", "values": {"Col": value}, "condition": {...}}: set values on matching rows (all rows if no condition).
+            Conditions use the same syntax as read_range_sheet_data.
+
+    Returns:
+        Dict[str, Any]: Dictionary containing per-operation results or error information.
+    """
+    if not ops:
+        return {"status": "error", "message": "必须提供至少一个操作", "error_code": "NO_OPERATIONS"}
+
+    try:
+        full_path = Path(get_excel_path(file_path))
+        file_extension = full_path.suffix.lower()
+
+        if not full_path.exists():
+            return {"status": "error", "message": f"文件 {full_path} 不存在", "error_code": "FILE_NOT_FOUND"}
+        if file_extension not in SUPPORTED_FORMATS:
+            return {
+                "status": "error",
+                "message": f"不支持的文件格式: {file_extension}. 支持格式: {', '.join(SUPPORTED_FORMATS)}",
+                "error_code": "INVALID_FORMAT",
+            }
+
+        # 只解析一次，所有操作都在内存中完成
+        df = load_dataframe(full_path, sheet_name)
+        before_row_count, before_columns = len(df), df.columns.tolist()
+        results, edits = [], []
+        for idx, op in enumerate(ops):
+            op_type = op.get("op") if isinstance(op, dict) else None
+            handler = _BATCH_OPERATION_HANDLERS.get(op_type)
+            try:
+                if handler is None:
+                    raise OperationError(
+                        f"不支持的操作类型: {op_type}，支持: {', '.join(BATCH_OPERATION_TYPES)}", "INVALID_OPERATION"
+                    )
+                df, affected_rows, edit = handler(df, op)
+                edits.append(edit)
+            except (OperationError, ConditionError, ExpressionError) as e:
+                results.append({"index": idx, "op": op_type, "status": "error", "message": str(e)})
+                return {
+                    "status": "error",
+                    "message": f"第 {idx} 个操作 ({op_type}) 失败，未写入任何修改: {str(e)}",
+                    "error_code": e.error_code,
+                    "failed_operation": idx,
+                    "operations": results,
+                }
+            results.append(
+                {"index": idx, "op": op_type, "status": "success", "affected_rows": affected_rows, "row_count": len(df)}
+            )
+
+        # 全部校验通过后一次性原子写回；Excel 只改动涉及的单元格，表头之上的行和单元格格式保持不变
+        with journal_operation(full_path, sheet_name, "apply_operations", {"ops": ops}, before_row_count):
+            _dataframe_cache.invalidate(full_path)
+            if file_extension == ".csv":
+                run_cpu_bound(write_dataframe_atomic, full_path, None, df)
+            else:
+                skiprows = get_header_skiprows(full_path, sheet_name)
+                run_cpu_bound(apply_edits_to_worksheet, full_path, sheet_name, before_columns, edits, df, skiprows + 1)
+        if file_extension != ".csv" and skiprows and df.columns.tolist() != before_columns:
+            record_header_skiprows(full_path, sheet_name, skiprows)
+        return {
+            "status": "success",
+            "message": f"成功执行 {len(ops)} 个操作",
+            "file_path": str(full_path),
+            "sheet_name": sheet_name if file_extension != ".csv" else None,
+            "operations": results,
+            "total_rows": len(df),
+            "columns": df.columns.tolist(),
+        }
+
+    except pd.errors.EmptyDataError:
+        return {"status": "error", "message": f"文件或工作表 {sheet_name} 为空或无法读取", "error_code": "EMPTY_DATA"}
+    except PermissionError:
+        return {"status": "error", "message": f"无权限写入文件: {full_path}", "error_code": "PERMISSION_DENIED"}
+    except Exception as e:
+        return {"status": "error", "message": f"批量操作时发生错误: {str(e)}", "error_code": "BATCH_ERROR"}
+
+
+@mcp.tool()
+@offload_to_executor(lock_arg="file_path")
+def undo_last_operation(file_path: str) -> Dict[str, Any]:
+    """
+    Undoes the most recent modification made to a file through this server.
+
+    Description:
+        Every modifying tool (insert_row_to_excel, append_column_to_excel, delete_excel_row_or_column, apply_operations) writes a journal
+        entry for the file before changing it: the operation, a summary of its arguments, the row count and file state (size,
+        modification time, inode) before the change, and a snapshot of the previous file. Writes always replace the file atomically,
+        so the snapshot is a hard link to the previous version and costs no parsing or copying. This tool restores the state before
+        the last journaled operation: CSV appends are truncated back to the previous length, and other changes restore the previous
+        file byte for byte, including title rows, cell formatting, column widths and other worksheets.
+        Calling it repeatedly undoes earlier operations, up to the journal depth (EXCEL_MCP_JOURNAL_DEPTH, default 20).
+        If the file was changed by another program after the last journaled operation, nothing is undone.
+
+    Args:
+        file_path (str): Absolute path to the file (.xlsx, .xls, or .csv).
+
+    Returns:
+        Dict[str, Any]: Dictionary containing the undone operation or error information, including:
+            - undone_operation (str): Name of the tool call that was undone.
+            - arguments (Dict[str, Any]): Summary of its arguments (long lists are reported as item counts).
+            - before_row_count (Optional[int]): Row count of the sheet before that operation, when known.
+            - remaining_undo_steps (int): Number of earlier operations that can still be undone.
+    """
+    full_path = Path(get_excel_path(file_path))
+    if not full_path.exists():
+        return {"status": "error", "message": f"文件 {full_path} 不存在", "error_code": "FILE_NOT_FOUND"}
+    if not JOURNAL_ENABLED:
+        return {"status": "error", "message": "操作日志已关闭（EXCEL_MCP_JOURNAL=0）", "error_code": "JOURNAL_DISABLED"}
+
+    try:
+        entry, remaining_steps = undo_journal_entry(full_path)
+        return {
+            "status": "success",
+            "message": f"已撤销操作 {entry['op']}",
+            "file_path": str(full_path),
+            "sheet_name": entry["sheet_name"],
+            "undone_operation": entry["op"],
+            "arguments": entry["args"],
+            "before_row_count": entry["before_row_count"],
+            "remaining_undo_steps": remaining_steps,
+        }
+    except JournalError as e:
+        return {"status": "error", "message": str(e), "error_code": e.error_code}
+    except PermissionError:
+        return {"status": "error", "message": f"无权限写入文件: {full_path}", "error_code": "PERMISSION_DENIED"}
+    except Exception as e:
+        return {"status": "error", "message": f"撤销操作时发生错误: {str(e)}", "error_code": "UNDO_ERROR"}
+
+
+# 多进程分片：按文件路径一致性哈希把请求路由到 worker，每个文件的缓存与写锁只存在于一个 worker 中。
+# merge_multiple_data 只按 output_filepath 路由：输出文件的写锁在其所属 worker 上，而各输入文件由该 worker
+# 直接从磁盘读取，不经过输入文件所属的 worker。所有写操作都先写临时文件再原子替换，因此读到的总是某次写入完成后的
+# 完整内容；代价是输入文件会在两个 worker 的缓存中各解析一份，且不会等待输入文件所属 worker 上正在排队的写操作
+ROUTING_ARGS = ["file_path", "output_filepath"]
+HASH_RING_REPLICAS = 64
+WORKER_START_TIMEOUT_SECONDS = float(os.getenv("EXCEL_MCP_WORKER_START_TIMEOUT", "60"))
+
+
+class ConsistentHashRing:
+    """
+    一致性哈希环：每个节点在环上放置 replicas 个虚拟节点，键映射到顺时针方向的第一个虚拟节点。
+
+    节点数量变化时只有少量键改变归属，各 worker 已预热的缓存大部分仍然有效。
+    """
+
+    def __init__(self, nodes: List[int], replicas: int = HASH_RING_REPLICAS):
+        points = sorted((self._hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def get_node(self, key: str) -> int:
+        position = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[position]
+
+
+def get_routing_key(arguments: Dict[str, Any]) -> Optional[str]:
+    """
+    取调用参数中的目标文件路径（规范化为绝对路径）作为路由键；没有文件参数的调用返回 None。
+
+    只看 ROUTING_ARGS 中的参数：merge_multiple_data 的 file_configs 不参与路由，见 ROUTING_ARGS 处的说明。
+    """
+    for name in ROUTING_ARGS:
+        value = arguments.get(name)
+        if isinstance(value, str) and value:
+            try:
+                return str(get_excel_path(value).resolve())
+            except ValueError:
+                return value
+    return None
+
+
+class WorkerRouter:
+    """
+    前端进程中的请求路由器：为每个 worker 维持一个长连接的 MCP 客户端，按路由键把工具调用转发给对应 worker。
+
+    没有文件参数的调用按轮询分配。MCP 客户端与 httpx 只在分片模式下用到，在用到时才导入，模块顶层只保留单进程模式需要的依赖。
+    """
+
+    def __init__(self, worker_urls: List[str]):
+        self.worker_urls = worker_urls
+        self.ring = ConsistentHashRing(list(range(len(worker_urls))))
+        self.routed_calls = [0] * len(worker_urls)
+        self.in_flight = [0] * len(worker_urls)
+        self._clients: List[Optional[Any]] = [None] * len(worker_urls)
+        self._connect_locks = [asyncio.Lock() for _ in worker_urls]
+        self._round_robin = itertools.count()
+
+    def get_worker(self, arguments: Dict[str, Any]) -> int:
+        key = get_routing_key(arguments)
+        if key is None:
+            return next(self._round_robin) % len(self.worker_urls)
+        return self.ring.get_node(key)
+
+    async def get_client(self, worker: int) -> Any:
+        """返回已连接的 worker 客户端；worker 仍在启动时重试，直到超时。"""
+        from fastmcp import Client
+
+        async with self._connect_locks[worker]:
+            if self._clients[worker] is not None:
+                return self._clients[worker]
+            deadline = time.monotonic() + WORKER_START_TIMEOUT_SECONDS
+            while True:
+                client = Client(self.worker_urls[worker])
+                try:
+                    await client.__aenter__()
+                    self._clients[worker] = client
+                    return client
+                except Exception:
+                    if time.monotonic() > deadline:
+                        raise
+                    await asyncio.sleep(0.2)
+
+    async def call(self, worker: int, name: str, arguments: Dict[str, Any]) -> Any:
+        """在指定 worker 上执行工具调用，返回其结构化结果。"""
+        from fastmcp.exceptions import ToolError
+
+        client = await self.get_client(worker)
+        self.routed_calls[worker] += 1
+        self.in_flight[worker] += 1
+        try:
+            result = await client.call_tool(name, arguments, raise_on_error=False)
+        finally:
+            self.in_flight[worker] -= 1
+        if result.is_error:
+            raise ToolError(result.content[0].text if result.content else f"worker {worker} 执行 {name} 失败")
+        if result.structured_content is not None:
+            return result.structured_content
+        return json.loads(result.content[0].text)
+
+    async def fetch_metrics_snapshots(self) -> List[Dict[str, Any]]:
+        """读取所有 worker 的原始指标快照；无法访问的 worker 跳过。"""
+        import httpx
+
+        async with httpx.AsyncClient(timeout=10) as http:
+            responses = await asyncio.gather(
+                *(http.get(url.rsplit("/mcp/", 1)[0] + "/metrics/snapshot") for url in self.worker_urls),
+                return_exceptions=True,
+            )
+        return [
+            response.json() for response in responses if isinstance(response, httpx.Response) and response.is_success
+        ]
+
+    async def close(self) -> None:
+        for client in self._clients:
+            if client is not None:
+                with contextlib.suppress(Exception):
+                    await client.__aexit__(None, None, None)
+
+
+async def build_router_server(router: WorkerRouter) -> FastMCP:
+    """
+    构建前端 MCP 服务：工具列表、参数与说明和本模块完全相同，每个调用按文件路径转发给对应 worker。
+
+    get_cluster_stats 与 get_server_metrics 在前端汇总所有 worker 的统计信息，前者附带路由计数。
+    读取工具列表需要事件循环，因此为协程：已在事件循环中的调用方直接 await，不会嵌套 asyncio.run。
+    """
+    server = FastMCP("excel-operate-mcp")
+    tools = await mcp.get_tools()
+
+    def make_routed_tool(name: str, fn: Callable) -> Callable:
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def routed(*args: Any, **kwargs: Any) -> Any:
+            arguments = dict(signature.bind(*args, **kwargs).arguments)
+            return await router.call(router.get_worker(arguments), name, arguments)
+
+        return routed
+
+    for name, tool in tools.items():
+        if name not in ("get_cluster_stats", "get_server_metrics"):
+            server.tool(name=name, description=tool.description)(make_routed_tool(name, tool.fn))
+
+    @server.tool(name="get_cluster_stats", description=tools["get_cluster_stats"].description)
+    async def get_sharded_cluster_stats() -> Dict[str, Any]:
+        results = await asyncio.gather(
+            *(router.call(worker, "get_cluster_stats", {}) for worker in range(len(router.worker_urls))),
+            return_exceptions=True,
+        )
+        workers = []
+        for worker, result in enumerate(results):
+            if isinstance(result, BaseException):
+                stats = {"worker": worker, "status": "error", "message": str(result)}
+            else:
+                stats = result["workers"][0]
+            workers.append(
+                {**stats, "routed_calls": router.routed_calls[worker], "in_flight": router.in_flight[worker]}
+            )
+        return {"status": "success", "mode": "sharded", "workers": workers}
+
+    @server.tool(name="get_server_metrics", description=tools["get_server_metrics"].description)
+    async def get_sharded_server_metrics(metrics_format: str = "json") -> Dict[str, Any]:
+        snapshot = merge_metrics_snapshots(await router.fetch_metrics_snapshots())
+        return format_server_metrics(snapshot, metrics_format)
+
+    @server.custom_route("/metrics", methods=["GET"])
+    async def sharded_metrics_endpoint(request: Any) -> Any:
+        from starlette.responses import PlainTextResponse
+
+        snapshot = merge_metrics_snapshots(await router.fetch_metrics_snapshots())
+        return PlainTextResponse(render_prometheus_metrics(snapshot), media_type="text/plain; version=0.0.4")
+
+    return server
+
+
+def spawn_workers(count: int, base_port: int, log_level: str) -> List[subprocess.Popen]:
+    """
+    以 streamable-http 方式在本机启动 count 个 worker 进程（端口 base_port 起连续分配）。
+
+    未显式配置时，缓存容量按 worker 数均分；每个 worker 默认不再创建解析进程池（worker 本身已是独立进程）。
+    """
+    processes = []
+    for worker in range(count):
+        env = {**os.environ, "EXCEL_MCP_WORKER_ID": str(worker), "EXCEL_MCP_PARENT_PID": str(os.getpid())}
+        env.setdefault("EXCEL_MCP_CACHE_MAX_BYTES", str(DATAFRAME_CACHE_MAX_BYTES // count))
+        env.setdefault("EXCEL_MCP_PROCESS_WORKERS", "0")
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--transport",
+            "streamable-http",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(base_port + worker),
+            "--log-level",
+            log_level,
+        ]
+        processes.append(subprocess.Popen(command, env=env))
+    return processes
+
+
+def watch_parent_process(parent_pid: int) -> None:
+    """worker 在前端进程退出后自行退出，避免前端被信号直接终止时遗留孤儿进程。"""
+
+    def watch() -> None:
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=watch, name="excel-mcp-parent-watch", daemon=True).start()
+
+
+def get_prefork_socket_path() -> str:
+    """预热模式监听的 Unix socket 路径（excel_mcp_attach.py 使用同样的规则）。"""
+    return os.getenv("EXCEL_MCP_PREFORK_SOCKET") or os.path.join(tempfile.gettempdir(), f"excel-mcp-{os.getuid()}.sock")
+
+
+def serve_prefork(socket_path: str) -> None:
+    """
+    预热模式：导入全部依赖后在 Unix socket 上等待 excel_mcp_attach.py 连接，每个连接 fork 出一个 stdio 会话进程。
+
+    会话进程继承已导入的模块，省去解释器启动和依赖导入；会话之间不共享缓存和文件锁，
+    与每个客户端各自启动一个 stdio 服务的行为一致。仅支持提供 fork 与 socket.recv_fds 的平台。
+    """
+    preload_heavy_modules()
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # socket 文件仅当前用户可连接，连接方会把自己的标准输入输出交给会话进程
+    old_umask = os.umask(0o177)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(64)
+    # 会话进程退出后由内核直接回收，不产生僵尸进程
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    try:
+        while True:
+            conn, _ = listener.accept()
+            if os.fork() == 0:
+                listener.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                exit_code = 1
+                try:
+                    run_attached_session(conn)
+                    exit_code = 0
+                except BaseException:
+                    traceback.print_exc()
+                finally:
+                    os._exit(exit_code)
+            conn.close()
+    finally:
+        listener.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(socket_path)
+
+
+def run_attached_session(conn: socket.socket) -> None:
+    """会话进程：接管 attach 进程传来的 stdin/stdout/stderr 与工作目录，以 stdio 方式运行 MCP 服务直到客户端断开。"""
+    message, fds, _, _ = socket.recv_fds(conn, 4096, 3)
+    if len(fds) != 3:
+        # 只用于探测预热进程是否就绪的连接不携带文件描述符
+        for fd in fds:
+            os.close(fd)
+        return
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", closefd=False)
+    sys.stderr = open(2, "w", closefd=False)
+    if message:
+        os.chdir(message.decode())
+
+    def watch() -> None:
+        # attach 进程被终止时连接关闭，会话随之结束
+        while conn.recv(1):
+            pass
+        os._exit(0)
+
+    threading.Thread(target=watch, name="excel-mcp-attach-watch", daemon=True).start()
+    mcp.run(transport="stdio")
+    conn.sendall(b"0")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Excel/CSV MCP 服务")
+    parser.add_argument(
+        "--transport",
+        default="sse",
+        choices=["sse", "streamable-http", "stdio", "prefork"],
+        help="prefork 为预热模式：常驻进程预先导入依赖，stdio 客户端通过 excel_mcp_attach.py 接入",
+    )
+    parser.add_argument("--socket", default=None, help="prefork 模式监听的 Unix socket 路径")
+    parser.add_argument("--host", default="127.0.0.1")  # 绑定到本机
+    parser.add_argument("--port", type=int, default=8000)  # 可修改端口
+    parser.add_argument("--log-level", default="info")  # 或 "debug"
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("EXCEL_MCP_WORKERS", "1")),
+        help="worker 进程数；大于 1 时由本进程监听并按文件路径把请求分片到各 worker",
+    )
+    parser.add_argument(
+        "--worker-base-port", type=int, default=None, help="worker 使用的起始端口，默认为 --port 之后的端口"
+    )
+    args = parser.parse_args(argv)
+    if os.getenv("EXCEL_MCP_PARENT_PID"):
+        watch_parent_process(int(os.environ["EXCEL_MCP_PARENT_PID"]))
+
+    if args.transport == "stdio":
+        mcp.run(transport="stdio")
+        return mcp
+    if args.transport == "prefork":
+        serve_prefork(args.socket or get_prefork_socket_path())
+        return mcp
+    if args.workers <= 1:
+        mcp.run(transport=args.transport, host=args.host, port=args.port, log_level=args.log_level)
+        return mcp
+
+    base_port = args.worker_base_port or args.port + 1
+    processes = spawn_workers(args.workers, base_port, args.log_level)
+    router = WorkerRouter([f"http://127.0.0.1:{base_port + worker}/mcp/" for worker in range(args.workers)])
+    server = asyncio.run(build_router_server(router))
+    try:
+        server.run(transport=args.transport, host=args.host, port=args.port, log_level=args.log_level)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            with contextlib.suppress(subprocess.TimeoutExpired):
+                process.wait(timeout=10)
+    return server
 
 
 if __name__ == "__main__":
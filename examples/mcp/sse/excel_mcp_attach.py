@@ -0,0 +1,52 @@
+"""
+excel_mcp 的 stdio 轻量入口。
+
+连接已经运行的预热进程（python excel_mcp.py --transport prefork），把本进程的 stdin/stdout/stderr 交给
+预热进程 fork 出的会话进程，自身只等待会话结束。只依赖标准库，启动时不导入 fastmcp/pandas。
+
+预热进程未运行或平台不支持传递文件描述符（如 Windows）时，直接以 stdio 方式冷启动 excel_mcp.py。
+
+StdioServerParams 示例:
+    StdioServerParams(command="python", args=["examples/mcp/sse/excel_mcp_attach.py"])
+"""
+
+import os
+import sys
+import socket
+import tempfile
+from typing import Optional
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "excel_mcp.py")
+
+
+def get_prefork_socket_path() -> str:
+    """与 excel_mcp.get_prefork_socket_path 相同的规则。"""
+    return os.getenv("EXCEL_MCP_PREFORK_SOCKET") or os.path.join(tempfile.gettempdir(), f"excel-mcp-{os.getuid()}.sock")
+
+
+def attach(socket_path: str) -> Optional[int]:
+    """把标准输入输出交给预热进程并等待会话结束，返回退出码；无法接入时返回 None。"""
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except OSError:
+        conn.close()
+        return None
+    with conn:
+        socket.send_fds(conn, [os.getcwd().encode()], [0, 1, 2])
+        # 会话正常结束时回传 "0" 并关闭连接；会话进程异常退出时只会读到连接关闭
+        reply = b""
+        while chunk := conn.recv(16):
+            reply += chunk
+    return int(reply) if reply else 1
+
+
+def main() -> None:
+    exit_code = attach(get_prefork_socket_path()) if hasattr(socket, "send_fds") else None
+    if exit_code is None:
+        os.execv(sys.executable, [sys.executable, SERVER_SCRIPT, "--transport", "stdio"])
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -62,6 +62,7 @@ async def get_excel_analysis_team(memories: List[str] | None = None) -> Selector
             🤖【MCP 工具】：
             - 使用 `excel_mcp_workbench` 中的以下工具（仅限以下工具，禁止调用未列工具）：
                 - `get_excel_sheet_name`：获取指定 Excel 文件的所有工作表名称，确保选择正确的工作表。
+                - `read_workbook`：一次调用读取工作簿中多个（默认全部）工作表的列名、数据类型、行数和前几行预览（参数 `file_path`、`sheets`、`preview_rows`）。需要了解多个工作表时优先使用，避免逐个调用 `read_sheet_data`。
                 - `get_column_names`：读取指定 `sheet_name` 中的所有列名，用于理解表格结构。
                 - `read_sheet_data`：读取指定 `sheet_name` 中的前 5 行数据内容，作为样本帮助理解文件结构、内容和用途。
 
@@ -70,7 +71,12 @@ async def get_excel_analysis_team(memories: List[str] | None = None) -> Selector
                         - `file_path` (str): Absolute path to the file (.xlsx, .xls, or .csv).
                         - `sheet_name` (str, optional): Name of the Excel worksheet (ignored for CSV). Defaults to "Sheet1".
                         - `columns` (Optional[Union[str, List[str]]], optional): List of column names to read (all columns if None).
-                        - `condition` (Optional[Dict[str, Any]], optional): Filter conditions, e.g., {"Column_Name": "Value"}.
+                        - `condition` (Optional[Dict[str, Any]], optional): Filter conditions, e.g., {"Column_Name": "Value"}, {"销售额": {"op": ">", "value": 1000}}, {"or": [...]}. Supported ops: ==, !=, >, >=, <, <=, in, between, contains, isnull.
+                        - `count_only` (bool, optional): Return only the number of matching rows. Use it to check selectivity before reading rows.
+                        - `page_size` (Optional[int], optional): Rows per page. When `has_more` is true, pass the returned `next_cursor` as `cursor` to fetch the next page.
+                        - `output_format` (str, optional): "records" (default), "columnar" (rows as arrays in the order of `columns`), "csv" or "markdown". 宽表或大量行时优先使用 "columnar" 或 "csv" 以减少返回体积；`sort_excel_data`、`aggregate_excel_data`、`read_sheet_data` 同样支持。
+                        - `precision` (Optional[int], optional): Round float values to this many decimal places.
+                - `read_row_range`：按行号读取连续的若干行（参数 `file_path`、`sheet_name`、`start_row`（0 起始）、`num_rows`），行号与删除行时使用的行号一致。CSV 通过行偏移索引直接定位，只读取所需的行。
 
                 - `merge_multiple_data`：合并多个 Excel 表格数据，确保字段对齐和数据一致性。
                     - **Parameters**:
@@ -80,6 +86,7 @@ async def get_excel_analysis_team(memories: List[str] | None = None) -> Selector
                         - `output_sheet_name` (str, optional): Output sheet name. Defaults to "MergedSheet".
                         - `merge_type` (str, optional): "append", "merge", "union", or "intersection". Defaults to "append".
                         - `merge_key` (Optional[Union[str, List[str]]], optional): Key column(s) for "merge" type.
+                        - `out_of_core` (Optional[bool], optional): Merge on disk with DuckDB for inputs larger than memory. Defaults to automatic.
 
                 - `insert_row_to_excel`：向指定 Excel 表格中追加一行数据，适用于单行记录补充，需确保 row 数据与列数匹配。
                     - **Parameters**:
@@ -93,6 +100,7 @@ async def get_excel_analysis_team(memories: List[str] | None = None) -> Selector
                         - `sheet_name` (str, optional): Name of the Excel worksheet. Defaults to "Sheet1".
                         - `column_name` (Optional[Union[str, List[str]]], optional): Name of the new column.
                         - `column_data` (Optional[Union[Any, List[Any]]], optional): Data for the new column(s).
+                        - `expression` (Optional[str], optional): Derive the column from existing columns on the server, e.g. "销售额 * 1.1" or "concat(学号, '_', 姓名)". 计算列时优先使用，无需先读取数据再回传整列取值。
 
                 - `delete_excel_row_or_column`：删除特定行、列或匹配值的行。
                     - **Parameters**:
@@ -100,7 +108,8 @@ async def get_excel_analysis_team(memories: List[str] | None = None) -> Selector
                         - `sheet_name` (str, optional): Name of the Excel worksheet. Defaults to "Sheet1".
                         - `row` (Optional[Union[int, List[int]]], optional): Row index(es) to delete (0-based).
                         - `column` (Optional[Union[str, List[str]]], optional): Column name(s) to delete.
-                        - `condition` (Optional[Dict[str, Any]], optional): Filter condition, e.g., {"Column_Name": "Value"}.
+                        - `condition` (Optional[Dict[str, Any]], optional): Rows to delete, e.g., {"Column_Name": "Value"}, {"学号": [1, 2]}, {"销售额": {"op": "between", "value": [0, 500]}}. 多个键之间为“或”：满足任一条件的行都会被删除。
+                        - `dry_run` (bool, optional): 只返回将被删除的行数（deleted_rows），不修改文件。按条件批量删除前先用 dry_run 确认影响范围。
 
                 - `sort_excel_data`：按指定列排序，支持升序/降序。
                     - **Parameters**:
@@ -109,6 +118,25 @@ async def get_excel_analysis_team(memories: List[str] | None = None) -> Selector
                         - `sort_columns` (Union[str, List[str]], optional): Column(s) to sort by.
                         - `ascending` (Union[bool, List[bool]], optional): Sort order (True for ascending, False for descending).
                         - `top_n` (Optional[int], optional): Number of top rows to return. Defaults to 10.
+                        - `page_size` / `cursor`: Same pagination as `read_range_sheet_data` when `top_n` is None.
+
+                - `aggregate_excel_data`：在服务端执行分组聚合（如“按区域汇总销售额”、总和/平均值/计数/最值），只返回每组的统计结果。统计类需求必须使用该工具，禁止读取原始行后自行计算。
+                    - **Parameters**:
+                        - `file_path` (str): Absolute path to the file (.xlsx, .xls, or .csv).
+                        - `sheet_name` (str, optional): Name of the Excel worksheet. Defaults to "Sheet1".
+                        - `group_by` (Optional[Union[str, List[str]]], optional): Column(s) to group by; None aggregates the whole sheet.
+                        - `metrics` (Optional[Dict[str, Union[str, List[str]]]], optional): e.g. {"销售额": ["sum", "mean"]}. Supported: sum, mean, count, min, max, median, std, nunique. None returns row counts per group.
+                        - `condition` (Optional[Dict[str, Any]], optional): Filter applied before grouping, same syntax as `read_range_sheet_data`.
+
+                - `apply_operations`：在一次调用中按顺序执行多个增、删、改、排序操作，只读写文件一次；任一操作不合法时不写入任何修改。需要连续执行多个修改时优先使用。
+                    - **Parameters**:
+                        - `file_path` (str): Absolute path to the file (.xlsx, .xls, or .csv).
+                        - `sheet_name` (str, optional): Name of the Excel worksheet. Defaults to "Sheet1".
+                        - `ops` (List[Dict[str, Any]]): Ordered operations, e.g. {"op": "insert", "data": [...]}, {"op": "append_column", "column_name": "...", "column_data": ...}, {"op": "delete", "row": ..., "column": ..., "condition": {...}}, {"op": "sort", "sort_columns": ..., "ascending": ...}, {"op": "update", "values": {"Col": value}, "condition": {...}}.
+
+                - `undo_last_operation`：撤销该文件最近一次修改（插入、添加列、删除、批量操作），可连续调用逐步撤销。误删或误改数据时使用。
+                    - **Parameters**:
+                        - `file_path` (str): Absolute path to the file (.xlsx, .xls, or .csv).
 
             ✍【典型互动示例】：
             - 输入：“删除区域为空的行。”  输出：“已删除20行空白记录，时间：2025-07-09，操作：删除，影响行数：20。”
@@ -192,13 +220,25 @@ async def get_excel_analysis_team(memories: List[str] | None = None) -> Selector
                 - 请求的时候不要携带多余的内容，类似于"\n</tool_call>"等。
             - 使用 `excel_mcp_workbench` 中的以下工具（仅限以下工具，禁止调用未列出的 MCP 工具）：
                 - `get_excel_sheet_name`：获取指定 Excel 文件的所有工作表名称，确保选择正确的工作表。
+                - `read_workbook`：一次调用读取工作簿中多个（默认全部）工作表的列名、数据类型、行数和前几行预览（参数 `file_path`、`sheets`、`preview_rows`）。需要了解多个工作表时优先使用，避免逐个调用 `read_sheet_data`。
                 - `get_column_names`：读取 Excel 文件中指定的 sheet_name 中的所有列名，用于理解表格结构和字段含义。
                 - `read_sheet_data`：读取 Excel 文件中指定的 sheet_name 中的前5行数据内容，主要用于通过提供简洁的数据样本，帮助模型理解文件的结构、内容和用途。
                 - `read_range_sheet_data`：读取 Excel 文件中指定的 sheet_name 中指定范围的单元格数据，用于详细分析特定区域的内容。
                     - file_path (str): Absolute path to the file (.xlsx, .xls, or .csv).
                     - sheet_name (str, optional): Name of the Excel worksheet (ignored for CSV). Defaults to "Sheet1".
                     - columns (Optional[Union[str, List[str]]], optional): List of column names to read (all columns if None).
-                    - condition (Optional[Dict[str, Any]], optional): Filter conditions, e.g., {"Column_Name": "Value"}.
+                    - condition (Optional[Dict[str, Any]], optional): Filter conditions, e.g., {"Column_Name": "Value"}, {"销售额": {"op": ">", "value": 1000}}, {"and": [...]}. Supported ops: ==, !=, >, >=, <, <=, in, between, contains, isnull.
+                    - count_only (bool, optional): Return only the number of matching rows.
+                    - page_size (Optional[int], optional): Rows per page. When has_more is true, pass next_cursor as cursor to fetch the next page.
+                    - output_format (str, optional): "records" (default), "columnar", "csv" or "markdown". 分析大量行时优先使用 "columnar" 或 "csv"；`aggregate_excel_data` 同样支持。
+                    - precision (Optional[int], optional): Round float values to this many decimal places.
+                - `read_row_range`：按行号读取连续的若干行（file_path、sheet_name、start_row（0 起始）、num_rows），适合查看指定位置的数据。
+                - `aggregate_excel_data`：在服务端执行分组聚合并只返回统计结果，用于分组汇总、总和、均值、中位数、标准差、计数、最值等指标计算，避免读取全部原始数据。
+                    - file_path (str): Absolute path to the file (.xlsx, .xls, or .csv).
+                    - sheet_name (str, optional): Name of the Excel worksheet (ignored for CSV). Defaults to "Sheet1".
+                    - group_by (Optional[Union[str, List[str]]], optional): Column(s) to group by; None aggregates the whole sheet.
+                    - metrics (Optional[Dict[str, Union[str, List[str]]]], optional): e.g. {"销售额": ["sum", "mean", "median", "std"]}. Supported: sum, mean, count, min, max, median, std, nunique.
+                    - condition (Optional[Dict[str, Any]], optional): Filter applied before grouping.
 
             🚫【注意事项】：
             - 仅负责数据分析，不承担图表生成或报告撰写任务。
@@ -0,0 +1,28 @@
+import os
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+
+# 测试在当前进程内执行解析，不启动进程池
+os.environ.setdefault("EXCEL_MCP_PROCESS_WORKERS", "0")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import excel_mcp  # noqa: E402
+from fastmcp import Client  # noqa: E402
+
+
+@pytest.fixture
+def call_tool():
+    """通过内存中的 MCP 客户端调用工具，返回工具的结果字典。"""
+
+    def call(name, **arguments):
+        async def run():
+            async with Client(excel_mcp.mcp) as client:
+                result = await client.call_tool(name, arguments, raise_on_error=False)
+            return result.structured_content.get("result", result.structured_content)
+
+        return asyncio.run(run())
+
+    return call
@@ -0,0 +1,71 @@
+import pandas as pd
+import pytest
+
+
+@pytest.fixture(params=["csv", "xlsx"])
+def sheet_path(request, tmp_path):
+    path = tmp_path / f"data.{request.param}"
+    df = pd.DataFrame({"id": [3, 1, 2], "v": [1.5, 2.5, 3.5]})
+    if request.param == "csv":
+        df.to_csv(path, index=False)
+    else:
+        df.to_excel(path, index=False)
+    return path
+
+
+def read_sheet(path):
+    return pd.read_csv(path) if path.suffix == ".csv" else pd.read_excel(path)
+
+
+def test_batch_is_applied_in_order(call_tool, sheet_path):
+    result = call_tool(
+        "apply_operations",
+        file_path=str(sheet_path),
+        ops=[
+            {"op": "insert", "data": [{"id": 4, "v": 0.5}]},
+            {"op": "update", "values": {"v": 9.0}, "condition": {"id": 1}},
+            {"op": "sort", "sort_columns": "id"},
+            {"op": "delete", "row": 0},
+        ],
+    )
+    assert result["status"] == "success", result
+    assert [op["status"] for op in result["operations"]] == ["success"] * 4
+    df = read_sheet(sheet_path)
+    assert df["id"].tolist() == [2, 3, 4]
+    assert df["v"].tolist() == [3.5, 1.5, 0.5]
+
+
+@pytest.mark.parametrize(
+    "failing_op",
+    [
+        {"op": "delete", "column": "missing"},
+        {"op": "update", "values": {"v": 1}, "condition": {"missing": 1}},
+        {"op": "append_column", "column_name": "w", "expression": "unknown_fn(v)"},
+        {"op": "rename"},
+    ],
+)
+def test_failing_operation_rolls_back_the_whole_batch(call_tool, sheet_path, failing_op):
+    original = sheet_path.read_bytes()
+    result = call_tool(
+        "apply_operations",
+        file_path=str(sheet_path),
+        ops=[{"op": "insert", "data": [{"id": 4, "v": 0.5}]}, {"op": "sort", "sort_columns": "id"}, failing_op],
+    )
+    assert result["status"] == "error"
+    assert result["failed_operation"] == 2
+    assert [op["status"] for op in result["operations"]] == ["success", "success", "error"]
+    # 文件保持原样，没有残留临时文件，也没有写入可撤销的记录
+    assert sheet_path.read_bytes() == original
+    assert [p.name for p in sheet_path.parent.iterdir() if p.name.endswith(".tmp" + sheet_path.suffix)] == []
+    assert call_tool("undo_last_operation", file_path=str(sheet_path))["error_code"] == "NOTHING_TO_UNDO"
+
+
+def test_batch_is_undone_as_one_step(call_tool, sheet_path):
+    original = sheet_path.read_bytes()
+    ops = [{"op": "insert", "data": [{"id": 4, "v": 0.5}]}, {"op": "sort", "sort_columns": "id"}]
+    assert call_tool("apply_operations", file_path=str(sheet_path), ops=ops)["status"] == "success"
+
+    result = call_tool("undo_last_operation", file_path=str(sheet_path))
+    assert result["status"] == "success", result
+    assert result["undone_operation"] == "apply_operations"
+    assert sheet_path.read_bytes() == original
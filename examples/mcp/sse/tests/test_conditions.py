@@ -0,0 +1,105 @@
+import duckdb
+import numpy as np
+import pandas as pd
+import pytest
+
+import excel_mcp
+from excel_mcp import ConditionError, build_condition_mask, build_condition_sql, condition_sql_compatible
+from excel_mcp import normalize_condition
+
+
+@pytest.fixture(scope="module")
+def frame(tmp_path_factory):
+    df = pd.DataFrame(
+        {
+            "id": range(6),
+            "i": [1, 2, 3, 4, 5, 12],
+            "f": [0.5, 1.5, np.nan, 3.0, 1.0, 2.5],
+            "s": ["a", "5", None, "abc", "b", "15"],
+            "b": [True, False, True, False, True, False],
+        }
+    )
+    path = tmp_path_factory.mktemp("conditions") / "frame.parquet"
+    df.to_parquet(path, index=False)
+    return df, path
+
+
+def sql_ids(path, node):
+    """在 Parquet 上执行 SQL 路径；条件需交由 pandas 求值时返回 None。"""
+    with duckdb.connect() as conn:
+        column_types = dict(
+            row[:2] for row in conn.execute("DESCRIBE SELECT * FROM read_parquet(?)", [str(path)]).fetchall()
+        )
+        if not condition_sql_compatible(node, column_types):
+            return None
+        params = [str(path)]
+        where_sql = build_condition_sql(node, params, column_types)
+        rows = conn.execute(f"SELECT id FROM read_parquet(?) WHERE {where_sql} ORDER BY id", params).fetchall()
+    return [row[0] for row in rows]
+
+
+@pytest.mark.parametrize(
+    "condition, in_sql",
+    [
+        ({"i": {"op": "==", "value": 2}}, True),
+        ({"i": {"op": "!=", "value": 2}}, True),
+        ({"f": {"op": "!=", "value": 1.5}}, True),
+        ({"f": {"op": ">", "value": 1}}, True),
+        ({"f": {"op": ">=", "value": 1.5}}, True),
+        ({"i": {"op": "<", "value": 3}}, True),
+        ({"i": {"op": "<=", "value": 3.5}}, True),
+        ({"i": {"op": "in", "value": [1, 3]}}, True),
+        ({"i": {"op": "in", "value": []}}, True),
+        ({"s": {"op": "in", "value": []}}, True),
+        ({"s": ["a", "b"]}, True),
+        ({"f": {"op": "between", "value": [1, 3]}}, True),
+        ({"s": {"op": "contains", "value": "a"}}, True),
+        ({"i": {"op": "contains", "value": "1"}}, True),
+        ({"s": {"op": "isnull"}}, True),
+        ({"f": {"op": "isnull", "value": False}}, True),
+        ({"s": "5"}, True),
+        ({"b": True}, True),
+        ({"or": [{"i": {"op": ">", "value": 4}}, {"s": "a"}]}, True),
+        # 以下条件在 DuckDB 中会发生隐式类型转换，交由 pandas 求值
+        ({"s": 5}, False),
+        ({"s": {"op": "in", "value": [5, 15]}}, False),
+        ({"i": "2"}, False),
+        ({"i": {"op": "in", "value": [1, "3"]}}, False),
+        ({"f": {"op": "==", "value": None}}, False),
+        ({"f": {"op": "!=", "value": None}}, False),
+        ({"f": {"op": "contains", "value": "1"}}, False),
+        ({"i": True}, False),
+    ],
+)
+def test_sql_and_mask_paths_agree(frame, condition, in_sql):
+    df, path = frame
+    node = normalize_condition(condition)
+    expected = df["id"][build_condition_mask(df, node)].tolist()
+    result = sql_ids(path, node)
+    if in_sql:
+        assert result == expected
+    else:
+        assert result is None
+
+
+@pytest.mark.parametrize(
+    "condition",
+    [{"i": {"op": "in", "value": 1}}, {"i": {"op": "between", "value": [1]}}, {"i": {"op": "between", "value": 1}}],
+)
+def test_malformed_values_are_rejected_before_either_path(condition):
+    with pytest.raises(ConditionError):
+        normalize_condition(condition)
+
+
+def test_sidecar_query_matches_in_memory_filter(tmp_path):
+    path = tmp_path / "data.xlsx"
+    pd.DataFrame({"id": range(3), "s": ["a", "5", "x"]}).to_excel(path, index=False)
+    excel_mcp.load_dataframe(path, "Sheet1")
+    excel_mcp._dataframe_cache.invalidate(path)
+
+    empty_in = normalize_condition({"id": {"op": "in", "value": []}})
+    assert excel_mcp.query_sidecar(path, "Sheet1", empty_in, count_only=True) == 0
+    # 文本列与数字比较不走 DuckDB，回退到 pandas 后与内存筛选结果一致
+    assert excel_mcp.query_sidecar(path, "Sheet1", normalize_condition({"s": 5}), count_only=True) is None
+    assert excel_mcp.select_rows(path, "Sheet1", None, {"s": 5}, True) == 0
+    assert excel_mcp.select_rows(path, "Sheet1", None, {"s": "5"}, True) == 1
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+import excel_mcp
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(excel_mcp, "CSV_BLOCK_BYTES", 1024)
+    monkeypatch.setattr(excel_mcp, "STREAM_CHUNK_ROWS", 100)
+
+
+def write_csv(path, rows):
+    # 前面的行全为数值，最后几行在 code 列出现文本、在 count 列出现空值
+    df = pd.DataFrame({"id": range(rows), "code": range(rows), "count": range(rows)})
+    df["code"] = df["code"].astype(object)
+    df.loc[rows - 3 :, "code"] = "A-1"
+    df["count"] = df["count"].astype(object)
+    df.loc[rows - 2, "count"] = None
+    df.to_csv(path, index=False)
+
+
+def chunk_dtypes(path, columns=None):
+    return [tuple(map(str, chunk.dtypes)) for chunk in excel_mcp.iter_csv_chunks(path, columns)]
+
+
+@pytest.mark.parametrize("use_arrow", [True, False])
+def test_every_chunk_has_the_same_dtypes(tmp_path, monkeypatch, small_chunks, use_arrow):
+    if not use_arrow:
+        monkeypatch.setattr(excel_mcp, "pa_csv", None)
+    path = tmp_path / "data.csv"
+    write_csv(path, 1000)
+
+    dtypes = chunk_dtypes(path)
+    assert len(dtypes) > 1
+    assert len(set(dtypes)) == 1
+    assert dtypes[0] == ("int64", "object", "float64")
+    chunks = list(excel_mcp.iter_csv_chunks(path))
+    assert sum(len(chunk) for chunk in chunks) == 1000
+    assert chunks[-1].index[-1] == 999
+
+    # 第二次读取使用元数据索引中缓存的列类型，结果相同
+    assert chunk_dtypes(path, ["code"]) == [("object",)] * len(dtypes)
+
+
+def test_consistent_csv_keeps_arrow_types(tmp_path, small_chunks):
+    path = tmp_path / "data.csv"
+    pd.DataFrame({"id": range(1000), "v": [i * 0.5 for i in range(1000)]}).to_csv(path, index=False)
+
+    assert set(chunk_dtypes(path)) == {("int64", "float64")}
+    assert excel_mcp.get_csv_arrow_types(path) is not None
@@ -0,0 +1,45 @@
+import time
+
+import pandas as pd
+import pytest
+
+from excel_mcp import ExpressionError, evaluate_expression
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({"a": [1, 2, 3], "name": ["x", "y", "z"]})
+
+
+def test_arithmetic_and_functions(df):
+    assert evaluate_expression(df, "a ** 2 + 1").tolist() == [2, 5, 10]
+    assert evaluate_expression(df, "concat(name, '_', a)").tolist() == ["x_1", "y_2", "z_3"]
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "a + 9**9**9",
+        "a + (9**99)**99",
+        "a * 2 ** 1000",
+        "concat(name, 'x' * 10**9)",
+        "name * 100000",
+        "a" + " + a" * 600,
+        "(" * 40 + "a" + ")" * 40 + " + " + "abs(" * 40 + "a" + ")" * 40,
+    ],
+)
+def test_unbounded_expressions_are_rejected(df, expression):
+    started = time.perf_counter()
+    with pytest.raises(ExpressionError) as excinfo:
+        evaluate_expression(df, expression)
+    assert excinfo.value.error_code == "EXPRESSION_TOO_LARGE"
+    assert time.perf_counter() - started < 1
+
+
+def test_append_column_reports_expression_error(tmp_path, call_tool):
+    path = tmp_path / "data.csv"
+    pd.DataFrame({"a": [1, 2]}).to_csv(path, index=False)
+    result = call_tool("append_column_to_excel", file_path=str(path), column_name="b", expression="a + 9**9**9")
+    assert result["status"] == "error"
+    assert result["error_code"] == "EXPRESSION_TOO_LARGE"
+    assert pd.read_csv(path).columns.tolist() == ["a"]
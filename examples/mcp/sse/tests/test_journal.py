@@ -0,0 +1,81 @@
+import pickle
+
+import pandas as pd
+
+import excel_mcp
+
+
+class _Payload:
+    def __init__(self, marker):
+        self.marker = marker
+
+    def __reduce__(self):
+        return (open, (str(self.marker), "w"))
+
+
+def test_undo_refuses_snapshots_it_did_not_write(tmp_path, call_tool):
+    path = tmp_path / "data.csv"
+    pd.DataFrame({"a": [1, 2, 3]}).to_csv(path, index=False)
+    assert call_tool("delete_excel_row_or_column", file_path=str(path), row=0)["status"] == "success"
+
+    # 篡改日志，让最近一步指向同目录下的 pickle 文件
+    entry = excel_mcp.read_journal(path)[0][-1]
+    evil = excel_mcp.get_snapshot_path(path, "evil.pkl")
+    marker = tmp_path / "unpickled"
+    evil.write_bytes(pickle.dumps(_Payload(marker)))
+    excel_mcp.append_journal_records(path, [{"seq": entry["seq"], "snapshot": evil.name}])
+
+    result = call_tool("undo_last_operation", file_path=str(path))
+    assert result["error_code"] == "SNAPSHOT_INVALID"
+    assert not marker.exists()
+    assert pd.read_csv(path)["a"].tolist() == [2, 3]
+
+
+def test_csv_undo_round_trip(tmp_path, call_tool):
+    path = tmp_path / "data.csv"
+    pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"]}).to_csv(path, index=False)
+    versions = [path.read_bytes()]
+
+    assert call_tool("insert_row_to_excel", file_path=str(path), data=[{"a": 4, "b": "w"}])["status"] == "success"
+    versions.append(path.read_bytes())
+    assert call_tool("append_column_to_excel", file_path=str(path), column_name="c", expression="a * 2")["status"] == (
+        "success"
+    )
+    versions.append(path.read_bytes())
+    assert call_tool("delete_excel_row_or_column", file_path=str(path), row=0)["status"] == "success"
+
+    # 逐步撤销，每一步都恢复到对应写操作之前的字节内容
+    for expected in reversed(versions):
+        assert call_tool("undo_last_operation", file_path=str(path))["status"] == "success"
+        assert path.read_bytes() == expected
+    assert call_tool("undo_last_operation", file_path=str(path))["error_code"] == "NOTHING_TO_UNDO"
+
+
+def test_xlsx_undo_round_trip_keeps_formatting_and_other_sheets(tmp_path, call_tool):
+    from openpyxl import Workbook, load_workbook
+    from openpyxl.styles import Font
+
+    path = tmp_path / "data.xlsx"
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "Data"
+    sheet.append(["id", "v"])
+    for row in ([1, 1.5], [2, 2.5], [3, 3.5]):
+        sheet.append(row)
+    sheet["A1"].font = Font(bold=True)
+    sheet.column_dimensions["B"].width = 30
+    workbook.create_sheet("Other").append(["keep", "me"])
+    workbook.save(path)
+    original = path.read_bytes()
+
+    result = call_tool("delete_excel_row_or_column", file_path=str(path), sheet_name="Data", condition={"id": 2})
+    assert result["status"] == "success", result
+    assert pd.read_excel(path, sheet_name="Data")["id"].tolist() == [1, 3]
+
+    result = call_tool("undo_last_operation", file_path=str(path))
+    assert result["status"] == "success", result
+    assert path.read_bytes() == original
+    restored = load_workbook(path)
+    assert restored["Data"]["A1"].font.bold
+    assert restored["Data"].column_dimensions["B"].width == 30
+    assert [cell.value for cell in restored["Other"][1]] == ["keep", "me"]
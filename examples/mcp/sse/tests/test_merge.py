@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+
+def test_streaming_union_matches_in_memory_union(call_tool, tmp_path):
+    first = pd.DataFrame({"x": [1, 2, 2, np.nan, np.nan], "s": ["a", "b", "b", None, None]})
+    second = pd.DataFrame({"x": [1.0, 3.5, 2.0], "s": ["a", "c,d", "b"], "t": [1, 2, np.nan]})
+    paths = [tmp_path / "first.csv", tmp_path / "second.csv"]
+    first.to_csv(paths[0], index=False)
+    second.to_csv(paths[1], index=False)
+    output = tmp_path / "union.csv"
+
+    result = call_tool(
+        "merge_multiple_data",
+        file_configs=[{"file_path": str(path)} for path in paths],
+        output_filepath=str(output),
+        merge_type="union",
+    )
+    assert result["status"] == "success", result
+    assert result["execution"] == "streaming"
+
+    expected = pd.concat([first, second], ignore_index=True).drop_duplicates()
+    expected.to_csv(tmp_path / "expected.csv", index=False)
+    pd.testing.assert_frame_equal(pd.read_csv(output), pd.read_csv(tmp_path / "expected.csv"))
+    (tmp_path / "expected.csv").unlink()
+    # 暂存文件与临时文件都已清理
+    assert sorted(p.name for p in tmp_path.iterdir() if not p.name.startswith(".excel_mcp")) == [
+        "first.csv",
+        "second.csv",
+        "union.csv",
+    ]
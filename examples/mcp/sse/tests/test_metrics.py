@@ -0,0 +1,40 @@
+import asyncio
+
+import pandas as pd
+from fastmcp import Client
+
+import excel_mcp
+
+
+def test_response_bytes_and_queue_wait_are_recorded(tmp_path, monkeypatch):
+    monkeypatch.setattr(excel_mcp, "_tool_metrics", excel_mcp.ToolMetrics())
+    path = tmp_path / "data.csv"
+    pd.DataFrame({"姓名": ["张三", "李四"], "销售额": [1.5, 2.5]}).to_csv(path, index=False)
+
+    async def run():
+        async with Client(excel_mcp.mcp) as client:
+            result = await client.call_tool("read_range_sheet_data", {"file_path": str(path)})
+            metrics = await client.call_tool("get_server_metrics", {})
+        return result, metrics.structured_content
+
+    result, metrics = asyncio.run(run())
+    tool = metrics["tools"]["read_range_sheet_data"]
+    # 记录的是 UTF-8 编码后的字节数，而不是字符数
+    assert tool["response_bytes"]["total"] == len(result.content[0].text.encode("utf-8"))
+    assert tool["calls"] == 1
+    assert set(tool["duration_ms"]) == {"total", "queue_wait", "parse", "compute", "serialize"}
+    assert tool["duration_ms"]["queue_wait"]["max"] <= tool["duration_ms"]["total"]["max"]
+
+
+def test_queue_wait_is_separate_from_compute():
+    metrics = excel_mcp.ToolMetrics()
+    call_metrics = excel_mcp.CallMetrics()
+    call_metrics.queue_wait = 0.2
+    call_metrics.parse = 0.1
+    metrics.record("read_sheet_data", 0.5, call_metrics)
+
+    snapshot = metrics.snapshot()
+    compute = snapshot["tools"]["read_sheet_data"]["duration_seconds"]["compute"]
+    assert abs(compute["sum"] - 0.2) < 1e-9
+    text = excel_mcp.render_prometheus_metrics(snapshot)
+    assert 'phase="queue_wait"' in text
@@ -0,0 +1,79 @@
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / "data.csv"
+    pd.DataFrame({"id": range(25), "v": [i * 1.5 for i in range(25)]}).to_csv(path, index=False)
+    return path
+
+
+def read_all_pages(call_tool, path, **kwargs):
+    result = call_tool("read_range_sheet_data", file_path=str(path), **kwargs)
+    pages = [result]
+    while result["has_more"]:
+        result = call_tool("read_range_sheet_data", file_path=str(path), cursor=result["next_cursor"])
+        assert result["status"] == "success", result
+        pages.append(result)
+    return pages
+
+
+def test_cursor_pages_cover_every_row_once(call_tool, csv_path):
+    pages = read_all_pages(call_tool, csv_path, page_size=10)
+    assert [page["returned_rows"] for page in pages] == [10, 10, 5]
+    assert [row["id"] for page in pages for row in page["data"]] == list(range(25))
+
+
+def test_cursor_page_size_can_be_changed(call_tool, csv_path):
+    first = call_tool("read_range_sheet_data", file_path=str(csv_path), page_size=10)
+    second = call_tool("read_range_sheet_data", file_path=str(csv_path), cursor=first["next_cursor"], page_size=3)
+    assert [row["id"] for row in second["data"]] == [10, 11, 12]
+
+
+@pytest.mark.parametrize("page_size", [0, -1])
+def test_non_positive_page_size_is_rejected(call_tool, csv_path, page_size):
+    result = call_tool("read_range_sheet_data", file_path=str(csv_path), page_size=page_size)
+    assert result["error_code"] == "INVALID_PAGE_SIZE"
+
+
+def test_cursor_expires_when_file_changes(call_tool, csv_path):
+    first = call_tool("read_range_sheet_data", file_path=str(csv_path), page_size=10)
+    inserted = call_tool("insert_row_to_excel", file_path=str(csv_path), data=[{"id": 99, "v": 0.0}])
+    assert inserted["status"] == "success"
+    result = call_tool("read_range_sheet_data", file_path=str(csv_path), cursor=first["next_cursor"])
+    assert result["error_code"] == "CURSOR_EXPIRED"
+
+
+def test_cursor_is_bound_to_its_file(call_tool, csv_path, tmp_path):
+    other = tmp_path / "other.csv"
+    other.write_bytes(csv_path.read_bytes())
+    first = call_tool("read_range_sheet_data", file_path=str(csv_path), page_size=10)
+    result = call_tool("read_range_sheet_data", file_path=str(other), cursor=first["next_cursor"])
+    assert result["error_code"] == "INVALID_CURSOR"
+
+
+def follow_cursor(call_tool, tool, first, **arguments):
+    pages = [first]
+    while pages[-1]["has_more"]:
+        pages.append(call_tool(tool, cursor=pages[-1]["next_cursor"], **arguments))
+        assert pages[-1]["status"] == "success", pages[-1]
+    return [row for page in pages for row in page["data"]]
+
+
+def test_sort_cursor_returns_every_row_in_order(call_tool, csv_path):
+    first = call_tool(
+        "sort_excel_data", file_path=str(csv_path), sort_columns="v", ascending=False, top_n=None, page_size=7
+    )
+    rows = follow_cursor(call_tool, "sort_excel_data", first, file_path=str(csv_path))
+    assert [len(rows), first["row_count"]] == [25, 25]
+    assert [row["id"] for row in rows] == list(range(24, -1, -1))
+
+
+def test_aggregate_cursor_returns_every_group(call_tool, tmp_path):
+    path = tmp_path / "groups.csv"
+    pd.DataFrame({"g": [i % 12 for i in range(60)], "v": range(60)}).to_csv(path, index=False)
+    first = call_tool("aggregate_excel_data", file_path=str(path), group_by="g", metrics={"v": "sum"}, page_size=5)
+    rows = follow_cursor(call_tool, "aggregate_excel_data", first, file_path=str(path))
+    assert [row["g"] for row in rows] == list(range(12))
+    assert sum(row["v_sum"] for row in rows) == sum(range(60))
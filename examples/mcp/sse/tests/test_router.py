@@ -0,0 +1,19 @@
+import asyncio
+
+import excel_mcp
+
+
+def test_router_server_can_be_built_inside_a_running_loop():
+    async def run():
+        router = excel_mcp.WorkerRouter(["http://127.0.0.1:1/mcp/", "http://127.0.0.1:2/mcp/"])
+        server = await excel_mcp.build_router_server(router)
+        return set(await server.get_tools()), set(await excel_mcp.mcp.get_tools())
+
+    routed_tools, tools = asyncio.run(run())
+    assert routed_tools == tools
+
+
+def test_merge_is_routed_by_output_file(tmp_path):
+    output = tmp_path / "merged.csv"
+    arguments = {"file_configs": [{"file_path": str(tmp_path / "input.csv")}], "output_filepath": str(output)}
+    assert excel_mcp.get_routing_key(arguments) == str(output.resolve())